@@ -0,0 +1,318 @@
+"""
+Декларативные правила уведомлений, проверяемые одним SQL-запросом
+"""
+
+import json
+import sqlite3
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+import logging
+from config import NOTIFICATION_CONFIG
+from database import LazyInstance, db_manager
+from dates import period_key, sql_period_key
+from notifications import NotificationManager
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('day', 'week', 'month')
+
+# Уровни как в check_spending_limits: превышение, более 150%, более 200%
+DEFAULT_LEVELS = ((1.0, 'warning'), (1.5, 'serious'), (2.0, 'critical'))
+
+# Ключ периода по дню (YYYY-MM-DD); неделя начинается с понедельника
+BUCKET_SQL = f'''
+    CASE period
+        WHEN 'day' THEN {sql_period_key('day', 'day')}
+        WHEN 'week' THEN {sql_period_key('day', 'week')}
+        ELSE {sql_period_key('day', 'month')}
+    END
+'''
+
+
+class AlertRule:
+    """Правило: порог расходов для области (пользователь, категория) за период.
+
+    user_id=None означает правило для каждого пользователя, category=None —
+    по всем категориям вместе. Правило конкретного пользователя заменяет
+    общее правило с той же категорией и периодом.
+    """
+
+    def __init__(self, period: str, threshold: float, category: Optional[str] = None,
+                 user_id: Optional[int] = None,
+                 levels: Sequence[Tuple[float, str]] = DEFAULT_LEVELS,
+                 rule_id: Optional[int] = None):
+        if period not in PERIODS:
+            raise ValueError(f"Неподдерживаемый период правила: {period}")
+        if threshold <= 0:
+            raise ValueError("Порог правила должен быть положительным")
+        self.rule_id = rule_id
+        self.user_id = user_id
+        self.category = category
+        self.period = period
+        self.threshold = threshold
+        self.levels = sorted((float(ratio), severity) for ratio, severity in levels)
+
+    def severity(self, total: float) -> Optional[str]:
+        """Наивысший достигнутый уровень для суммы (строгое превышение)"""
+        result = None
+        for ratio, severity in self.levels:
+            if total > self.threshold * ratio:
+                result = severity
+        return result
+
+    def format_message(self, bucket: str, total: float) -> str:
+        """Текст уведомления в формате существующих проверок"""
+        if self.category:
+            return NotificationManager.format_limit_warning(self.category, total, self.threshold)
+        if self.period == 'day':
+            return NotificationManager.format_daily_warning(bucket, total)
+        if self.period == 'week':
+            return NotificationManager.format_weekly_warning(bucket, total)
+        return NotificationManager.format_monthly_warning(bucket, total)
+
+    def to_dict(self) -> Dict:
+        return {
+            'rule_id': self.rule_id,
+            'user_id': self.user_id,
+            'category': self.category,
+            'period': self.period,
+            'threshold': self.threshold,
+            'levels': self.levels
+        }
+
+
+def load_rules_from_config(config: Dict = None) -> List[AlertRule]:
+    """Правила из NOTIFICATION_CONFIG"""
+    config = config or NOTIFICATION_CONFIG
+    rules = [AlertRule('month', limit, category=category)
+             for category, limit in config.get('default_limits', {}).items()]
+
+    for period, key in (('day', 'daily_limit'), ('week', 'weekly_limit'), ('month', 'monthly_limit')):
+        if config.get(key):
+            rules.append(AlertRule(period, config[key], levels=((1.0, 'warning'),)))
+    return rules
+
+
+class AlertRuleEngine:
+    """Хранение правил и их проверка для всех пользователей за один проход"""
+
+    def __init__(self, db=None, config: Dict = None):
+        self.db_manager = db or db_manager
+        self.config = config or NOTIFICATION_CONFIG
+        self._ensure_tables()
+
+    def _ensure_tables(self):
+        """Создание таблицы пользовательских правил"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS alert_rules (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER,
+                        category TEXT,
+                        period TEXT NOT NULL DEFAULT 'month',
+                        threshold REAL NOT NULL CHECK(threshold > 0),
+                        levels TEXT,
+                        enabled INTEGER DEFAULT 1,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                    )
+                ''')
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка создания таблицы правил: {e}")
+            raise
+
+    def add_rule(self, rule: AlertRule) -> int:
+        """Сохранение правила в БД"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO alert_rules (user_id, category, period, threshold, levels)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (rule.user_id, rule.category, rule.period, rule.threshold,
+                      json.dumps(rule.levels)))
+                conn.commit()
+                rule.rule_id = cursor.lastrowid
+                return rule.rule_id
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка добавления правила: {e}")
+            raise
+
+    def delete_rule(self, rule_id: int) -> bool:
+        """Удаление правила из БД"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM alert_rules WHERE id = ?', (rule_id,))
+                conn.commit()
+                return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка удаления правила: {e}")
+            raise
+
+    def load_rules(self, config: Dict = None) -> List[AlertRule]:
+        """Правила из конфигурации (по умолчанию self.config) и из БД"""
+        rules = load_rules_from_config(config or self.config)
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, user_id, category, period, threshold, levels
+                    FROM alert_rules WHERE enabled = 1
+                ''')
+                for row in cursor.fetchall():
+                    levels = json.loads(row['levels']) if row['levels'] else DEFAULT_LEVELS
+                    rules.append(AlertRule(row['period'], row['threshold'], row['category'],
+                                           row['user_id'], levels, row['id']))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка загрузки правил: {e}")
+            raise
+        return rules
+
+    def evaluate(self, rules: Optional[List[AlertRule]] = None,
+                 as_of: Optional[datetime] = None,
+                 user_id: Optional[int] = None) -> List[Dict]:
+        """Проверка всех правил для всех пользователей за текущий месяц.
+
+        Расходы сканируются один раз: агрегаты (пользователь, категория, день)
+        материализуются (SQLite 3.35+ делает это сам для CTE, на которое
+        ссылаются дважды; подсказка MATERIALIZED не используется ради старых
+        версий), после чего правила из временной таблицы соединяются с ними
+        и группируются по периодам.
+        """
+        rules = rules if rules is not None else self.load_rules()
+        if not rules:
+            return []
+        as_of = as_of or datetime.now()
+        month_start = as_of.replace(day=1)
+        window_start = month_start - timedelta(days=month_start.weekday())
+        indexed = {i: rule for i, rule in enumerate(rules)}
+
+        user_filter = "AND e.user_id = ?" if user_id else ""
+        params = [window_start.strftime("%Y-%m-%d"), as_of.strftime("%Y-%m-%d")]
+        if user_id:
+            params.append(user_id)
+        params.append(month_start.strftime("%Y-%m"))
+
+        query = f'''
+            WITH base AS (
+                SELECT e.user_id AS user_id, c.name AS category,
+                       DATE(e.date) AS day, SUM(e.amount) AS total
+                FROM expenses e
+                JOIN categories c ON e.category_id = c.id
+                WHERE DATE(e.date) >= ? AND DATE(e.date) <= ? {user_filter}
+                GROUP BY 1, 2, 3
+            ),
+            matched AS (
+                SELECT r.rule_key, r.period, b.user_id, b.day, b.total
+                FROM temp.rule_set r
+                JOIN base b ON b.user_id = r.user_id
+                WHERE r.category IS NULL OR r.category = b.category
+                UNION ALL
+                SELECT r.rule_key, r.period, b.user_id, b.day, b.total
+                FROM temp.rule_set r
+                JOIN base b ON r.category IS NULL OR r.category = b.category
+                WHERE r.user_id IS NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM temp.rule_set o
+                      WHERE o.user_id = b.user_id AND o.period = r.period
+                        AND o.category IS r.category
+                  )
+            ),
+            buckets AS (
+                SELECT rule_key, user_id, {BUCKET_SQL} AS bucket,
+                       period, SUM(total) AS total
+                FROM matched
+                GROUP BY 1, 2, 3
+            )
+            SELECT b.rule_key, b.user_id, b.bucket, b.total
+            FROM buckets b
+            JOIN temp.rule_set s ON s.rule_key = b.rule_key
+            WHERE b.total > s.min_total
+              AND (b.period = 'week' OR b.bucket >= ?)
+            ORDER BY b.user_id, b.rule_key, b.bucket
+        '''
+
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE TEMP TABLE IF NOT EXISTS rule_set (
+                        rule_key INTEGER PRIMARY KEY,
+                        user_id INTEGER,
+                        category TEXT,
+                        period TEXT,
+                        min_total REAL
+                    )
+                ''')
+                cursor.execute('DELETE FROM temp.rule_set')
+                cursor.executemany('INSERT INTO temp.rule_set VALUES (?, ?, ?, ?, ?)', [
+                    (key, rule.user_id, rule.category, rule.period,
+                     rule.threshold * rule.levels[0][0])
+                    for key, rule in indexed.items()
+                ])
+                cursor.execute('CREATE INDEX IF NOT EXISTS temp.idx_rule_set_user ON rule_set(user_id, period, category)')
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка проверки правил: {e}")
+            raise
+
+        alerts = []
+        for rule_key, row_user_id, bucket, total in rows:
+            alert = self._alert(indexed[rule_key], row_user_id, bucket, total)
+            if alert:
+                alerts.append(alert)
+        return alerts
+
+    def evaluate_snapshot(self, rules: List[AlertRule], snapshot) -> List[Dict]:
+        """Проверка правил по агрегатам AnalysisSnapshot (без запросов к БД).
+
+        Снимок описывает одного пользователя или, при user_id=None, сумму
+        расходов всех пользователей; тогда применяются только общие правила.
+        Снимок охватывает текущий месяц, поэтому неделя, начатая в прошлом
+        месяце, считается с первого числа.
+        """
+        scoped = [rule for rule in rules
+                  if rule.user_id is None or (snapshot.user_id and rule.user_id == snapshot.user_id)]
+        overridden = {(rule.period, rule.category) for rule in scoped if rule.user_id is not None}
+
+        alerts = []
+        for rule in scoped:
+            if rule.user_id is None and (rule.period, rule.category) in overridden:
+                continue
+            buckets: Dict[str, float] = defaultdict(float)
+            for (category, day), total in snapshot.category_daily_totals.items():
+                if day and (rule.category is None or rule.category == category):
+                    buckets[period_key(day, rule.period)] += total
+            for bucket in sorted(buckets):
+                alert = self._alert(rule, snapshot.user_id, bucket, buckets[bucket])
+                if alert:
+                    alerts.append(alert)
+        return alerts
+
+    @staticmethod
+    def _alert(rule: AlertRule, user_id: Optional[int], bucket: str, total: float) -> Optional[Dict]:
+        """Описание сработавшего правила (None, если порог не превышен)"""
+        severity = rule.severity(total)
+        if severity is None:
+            return None
+        return {
+            'rule_id': rule.rule_id,
+            'user_id': user_id,
+            'category': rule.category,
+            'period': rule.period,
+            'bucket': bucket,
+            'total': total,
+            'threshold': rule.threshold,
+            'severity': severity,
+            'message': rule.format_message(bucket, total)
+        }
+
+
+# Создаем глобальный экземпляр движка правил
+alert_rule_engine = LazyInstance(AlertRuleEngine)
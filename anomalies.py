@@ -0,0 +1,260 @@
+"""
+Потоковое обнаружение необычных расходов
+"""
+
+import math
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+from changes import ChangeJournal
+from database import LazyInstance, db_manager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 3.0
+MIN_SAMPLES = 5
+
+
+class RunningStats:
+    """Среднее и дисперсия по алгоритму Уэлфорда с поддержкой удаления"""
+
+    def __init__(self, n: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value: float):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value: float):
+        if self.n <= 1:
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        old_mean = self.mean
+        self.n -= 1
+        self.mean = (old_mean * (self.n + 1) - value) / self.n
+        self.m2 = max(0.0, self.m2 - (value - old_mean) * (value - self.mean))
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+    def score(self, value: float) -> Optional[float]:
+        """z-оценка значения относительно накопленной статистики"""
+        if self.n < MIN_SAMPLES or self.std == 0:
+            return None
+        return (value - self.mean) / self.std
+
+
+class AnomalyDetector:
+    """Оценка каждого расхода при вставке по статистике пользователь × категория.
+
+    Статистика ведется по log(1 + сумма), так как суммы расходов сильно
+    скошены вправо. Состояние хранится в таблице anomaly_stats и
+    обновляется по журналу изменений (changes.py) с контрольной точкой
+    потребителя 'anomalies' в той же транзакции, поэтому расходы из любого
+    процесса оцениваются ровно один раз, а после перезапуска пересчитывать
+    историю не нужно. sync() вызывается перед каждым чтением.
+    """
+
+    CONSUMER = 'anomalies'
+
+    def __init__(self, db=None, threshold: float = DEFAULT_THRESHOLD):
+        self.db_manager = db or db_manager
+        self.threshold = threshold
+        self.journal = ChangeJournal(self.db_manager)
+        self._lock = threading.Lock()
+        self._pending: List[Dict] = []
+        self._ensure_tables()
+
+    def _ensure_tables(self):
+        """Создание таблиц статистики и найденных аномалий"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS anomaly_stats (
+                        user_id INTEGER NOT NULL,
+                        category_id INTEGER NOT NULL,
+                        n INTEGER NOT NULL,
+                        mean REAL NOT NULL,
+                        m2 REAL NOT NULL,
+                        PRIMARY KEY (user_id, category_id)
+                    )
+                ''')
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS expense_anomalies (
+                        expense_id INTEGER PRIMARY KEY,
+                        user_id INTEGER NOT NULL,
+                        category_id INTEGER NOT NULL,
+                        amount REAL NOT NULL,
+                        score REAL NOT NULL,
+                        typical_amount REAL,
+                        detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (expense_id) REFERENCES expenses(id) ON DELETE CASCADE
+                    )
+                ''')
+                conn.commit()
+
+            # Без контрольной точки (новая БД или статистика до журнала) — пересчет
+            if not self.journal.has_consumer(self.CONSUMER):
+                self.rebuild()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка создания таблиц аномалий: {e}")
+            raise
+
+    @staticmethod
+    def _transform(amount: float) -> float:
+        return math.log1p(amount)
+
+    def _load(self, cursor: sqlite3.Cursor, user_id: int, category_id: int) -> RunningStats:
+        cursor.execute('SELECT n, mean, m2 FROM anomaly_stats WHERE user_id = ? AND category_id = ?',
+                       (user_id, category_id))
+        row = cursor.fetchone()
+        return RunningStats(*row) if row else RunningStats()
+
+    def _save(self, cursor: sqlite3.Cursor, user_id: int, category_id: int, stats: RunningStats):
+        cursor.execute('''
+            INSERT OR REPLACE INTO anomaly_stats (user_id, category_id, n, mean, m2)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, category_id, stats.n, stats.mean, stats.m2))
+
+    def sync(self) -> int:
+        """Применение новых изменений журнала; возвращает их число"""
+        return self.journal.apply(self.CONSUMER, self._apply_changes)
+
+    def _apply_changes(self, cursor: sqlite3.Cursor, changes: List[Dict]):
+        """Оценка и обновление статистики порцией журнала (статистика пары
+        пользователь/категория читается и сохраняется один раз на порцию)"""
+        touched: Dict[Tuple[int, int], RunningStats] = {}
+        anomalies, deleted = {}, []
+
+        def stats_for(expense: Dict) -> RunningStats:
+            key = (expense['user_id'], expense['category_id'])
+            if key not in touched:
+                touched[key] = self._load(cursor, *key)
+            return touched[key]
+
+        for change in changes:
+            old, new = change['old'], change['new']
+            if change['op'] == 'update' and all(old[field] == new[field]
+                                                for field in ('user_id', 'category_id', 'amount')):
+                continue
+            if change['op'] in ('update', 'delete'):
+                stats_for(old).remove(self._transform(old['amount']))
+                anomalies.pop(old['id'], None)
+                deleted.append((old['id'],))
+            if change['op'] in ('insert', 'update'):
+                stats = stats_for(new)
+                value = self._transform(new['amount'])
+                score = stats.score(value)
+                if score is not None and abs(score) >= self.threshold:
+                    anomalies[new['id']] = {
+                        'expense_id': new['id'],
+                        'user_id': new['user_id'],
+                        'category_id': new['category_id'],
+                        'amount': new['amount'],
+                        'score': score,
+                        'typical_amount': math.expm1(stats.mean)
+                    }
+                stats.add(value)
+
+        if deleted:
+            cursor.executemany('DELETE FROM expense_anomalies WHERE expense_id = ?', deleted)
+        if anomalies:
+            detected_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            cursor.executemany('''
+                INSERT OR REPLACE INTO expense_anomalies
+                    (expense_id, user_id, category_id, amount, score, typical_amount, detected_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(a['expense_id'], a['user_id'], a['category_id'], a['amount'], a['score'],
+                   a['typical_amount'], detected_at) for a in anomalies.values()])
+            with self._lock:
+                self._pending.extend(anomalies.values())
+
+        for (user_id, category_id), stats in touched.items():
+            self._save(cursor, user_id, category_id, stats)
+
+    def rebuild(self):
+        """Пересчет статистики по таблице расходов (однократная миграция).
+
+        Контрольная точка сдвигается на конец журнала в той же транзакции.
+        """
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                stats: Dict[Tuple[int, int], RunningStats] = {}
+                cursor.execute('SELECT user_id, category_id, amount FROM expenses ORDER BY id')
+                while True:
+                    rows = cursor.fetchmany(5000)
+                    if not rows:
+                        break
+                    for user_id, category_id, amount in rows:
+                        key = (user_id, category_id)
+                        if key not in stats:
+                            stats[key] = RunningStats()
+                        stats[key].add(self._transform(amount))
+
+                cursor.execute('DELETE FROM anomaly_stats')
+                for (user_id, category_id), item in stats.items():
+                    self._save(cursor, user_id, category_id, item)
+                self.journal.commit(self.CONSUMER, self.journal.latest_seq(cursor), cursor)
+                conn.commit()
+                logger.info(f"Статистика аномалий пересчитана: {len(stats)}")
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка пересчета статистики аномалий: {e}")
+            raise
+
+    def score(self, user_id: int, category_id: int, amount: float) -> Optional[float]:
+        """z-оценка суммы без записи в БД (None — мало данных)"""
+        self.sync()
+        with self.db_manager.connect_db() as conn:
+            stats = self._load(conn.cursor(), user_id, category_id)
+        return stats.score(self._transform(amount))
+
+    def pop_new_anomalies(self) -> List[Dict]:
+        """Аномалии, найденные этим процессом с момента последнего вызова"""
+        self.sync()
+        with self._lock:
+            anomalies, self._pending = self._pending, []
+            return anomalies
+
+    def get_anomalies(self, user_id: Optional[int] = None, limit: int = 50) -> List[Dict]:
+        """Последние найденные аномалии"""
+        self.sync()
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                query = '''
+                    SELECT a.expense_id, a.user_id, c.name AS category, a.amount,
+                           a.score, a.typical_amount, a.detected_at
+                    FROM expense_anomalies a
+                    JOIN categories c ON a.category_id = c.id
+                '''
+                params = []
+                if user_id:
+                    query += " WHERE a.user_id = ?"
+                    params.append(user_id)
+                query += " ORDER BY a.expense_id DESC LIMIT ?"
+                params.append(limit)
+                cursor.execute(query, params)
+                return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка получения аномалий: {e}")
+            raise
+
+    @staticmethod
+    def format_anomaly(anomaly: Dict) -> str:
+        """Текст уведомления о необычном расходе"""
+        return (f"🔎 Необычная сумма {anomaly['amount']:.2f} ₽ "
+                f"(обычно около {anomaly['typical_amount']:.2f} ₽ в этой категории)")
+
+
+# Создаем глобальный экземпляр детектора аномалий
+anomaly_detector = LazyInstance(AnomalyDetector)
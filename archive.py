@@ -0,0 +1,454 @@
+"""
+Архивация старых расходов в сжатые годовые базы только для чтения
+"""
+
+import json
+import os
+import sqlite3
+import stat
+import threading
+import zlib
+from collections import OrderedDict, defaultdict
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+from changes import ChangeJournal
+from config import ARCHIVE_CONFIG
+from database import LazyInstance, db_manager
+from dates import period_key
+
+logger = logging.getLogger(__name__)
+
+# Поля строки в сжатой порции месяца
+CHUNK_FIELDS = ('id', 'user_id', 'category_id', 'payment_method_id', 'amount',
+                'description', 'date', 'created_at', 'category', 'payment_method')
+DELETE_BATCH = 500
+# Измерения, для которых достаточно итогов по месяцам
+ROLLUP_DIMENSIONS = ('category', 'payment_method', 'user', 'month', 'year')
+
+
+def month_start(value: str) -> str:
+    """Первое число месяца даты YYYY-MM-DD (YYYY-MM-01)"""
+    return f"{value[:7]}-01"
+
+
+def next_month(month: str) -> str:
+    """Первое число следующего месяца для YYYY-MM"""
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}-01"
+
+
+def month_end(month: str) -> str:
+    """Последний день месяца YYYY-MM"""
+    return (date.fromisoformat(next_month(month)) - timedelta(days=1)).isoformat()
+
+
+def covers_month(month: str, start_date: Optional[str], end_date: Optional[str]) -> bool:
+    """Период целиком включает месяц YYYY-MM"""
+    return ((not start_date or start_date[:10] <= f"{month}-01")
+            and (not end_date or end_date[:10] >= month_end(month)))
+
+
+def default_boundary(today: Optional[date] = None, horizon_months: Optional[int] = None) -> str:
+    """Граница архивации: первое число месяца horizon_months месяцев назад"""
+    today = today or date.today()
+    horizon = ARCHIVE_CONFIG['horizon_months'] if horizon_months is None else horizon_months
+    index = today.year * 12 + today.month - 1 - horizon
+    return f"{index // 12:04d}-{index % 12 + 1:02d}-01"
+
+
+class ExpenseArchiver:
+    """Перенос расходов старше горизонта в годовые архивы.
+
+    Расходы каждого месяца хранятся в архиве <имя БД>_<год>.db одной
+    строкой: список строк в JSON, сжатый zlib. В основной БД остаются
+    итоги по месяцам (expense_rollups) и граница архива (archive_state):
+    все расходы с датой раньше границы находятся в архиве, поэтому
+    get_expenses() читает архив, только если запрошенный период ее
+    затрагивает, и распаковывает лишь нужные месяцы. Строки, добавленные
+    задним числом после архивации, остаются в основной таблице до
+    следующего запуска archive(), который дописывает их в порцию месяца.
+
+    Перенос не оповещает слушателей DatabaseManager: для агрегатов это
+    не удаление, итоги сохраняются в expense_rollups. В журнале изменений
+    (changes.py) перенесенные строки отмечаются операцией 'archive';
+    каждый запуск archive() заодно очищает журнал (ChangeJournal.prune).
+    """
+
+    def __init__(self, db=None, directory: Optional[str] = None):
+        self.db_manager = db or db_manager
+        base = os.path.dirname(os.path.abspath(self.db_manager.db_name))
+        self.directory = os.path.join(base, directory or ARCHIVE_CONFIG['directory'])
+        self.prefix = os.path.splitext(os.path.basename(self.db_manager.db_name))[0]
+        self._lock = threading.Lock()
+        self._chunks: "OrderedDict[Tuple[str, str, int], List[list]]" = OrderedDict()
+
+    def archive_path(self, year: int) -> str:
+        return os.path.join(self.directory, f"{self.prefix}_{year}.db")
+
+    def archived_before(self) -> Optional[str]:
+        try:
+            with self.db_manager.connect_db() as conn:
+                return self.db_manager.archived_before(conn.cursor())
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения границы архива: {e}")
+            raise
+
+    # Запись
+
+    def archive(self, before: Optional[str] = None, vacuum: bool = False) -> Dict:
+        """Перенос в архив расходов с датой раньше before (по умолчанию — горизонт из ARCHIVE_CONFIG)"""
+        boundary = month_start(before) if before else default_boundary()
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT DISTINCT strftime('%Y-%m', date) FROM expenses
+                    WHERE date < ? ORDER BY 1
+                ''', (boundary,))
+                months = [row[0] for row in cursor.fetchall() if row[0]]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка выбора месяцев для архивации: {e}")
+            raise
+
+        archived = 0
+        for month in months:
+            archived += self._archive_month(month)
+
+        try:
+            with self.db_manager.connect_db() as conn:
+                self._advance_boundary(conn.cursor(), boundary)
+                conn.commit()
+            if vacuum and archived:
+                # Освобождение места в файле основной БД
+                conn = self.db_manager.connect_db()
+                try:
+                    conn.execute('VACUUM')
+                finally:
+                    conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка обновления границы архива: {e}")
+            raise
+
+        logger.info(f"В архив перенесено {archived} расходов за {len(months)} мес. (до {boundary})")
+        pruned = self._prune_journal()
+        return {'archived': archived, 'months': months, 'archived_before': self.archived_before(),
+                'pruned': pruned}
+
+    def _prune_journal(self) -> int:
+        """Очистка журнала изменений после того, как его догонят производные данные.
+
+        Записи, не прочитанные хотя бы одним потребителем, не удаляются,
+        поэтому скетчи, статистика аномалий и прогнозные модели этой БД
+        сначала применяют накопленные изменения.
+        """
+        from anomalies import AnomalyDetector
+        from forecasting import ForecastEngine
+        from sketches import SketchStore
+
+        journal = ChangeJournal(self.db_manager)
+        for consumer_class, catch_up in ((SketchStore, 'sync'), (AnomalyDetector, 'sync'),
+                                         (ForecastEngine, 'update')):
+            if journal.has_consumer(consumer_class.CONSUMER):
+                getattr(consumer_class(self.db_manager), catch_up)()
+        return journal.prune()
+
+    def _archive_month(self, month: str) -> int:
+        """Перенос одного месяца: запись порции в архив, затем итоги и удаление одной транзакцией"""
+        start, end = f"{month}-01", next_month(month)
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT e.id, e.user_id, e.category_id, e.payment_method_id, e.amount,
+                           e.description, e.date, e.created_at, c.name, pm.method_name
+                    FROM expenses e
+                    JOIN categories c ON e.category_id = c.id
+                    JOIN payment_methods pm ON e.payment_method_id = pm.id
+                    WHERE e.date >= ? AND e.date < ?
+                ''', (start, end))
+                rows = [list(row) for row in cursor.fetchall()]
+                if not rows:
+                    return 0
+
+                # Сначала архив: при сбое до удаления строки останутся в основной
+                # таблице, а граница не сдвинется, поэтому дублей при чтении не будет
+                self._write_chunk(month, rows)
+
+                rollups = defaultdict(lambda: [0.0, 0])
+                for row in rows:
+                    key = (row[1], row[2], row[3])
+                    rollups[key][0] += row[4]
+                    rollups[key][1] += 1
+                cursor.executemany('''
+                    INSERT INTO expense_rollups (user_id, category_id, payment_method_id, month, total, count)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (user_id, category_id, payment_method_id, month)
+                    DO UPDATE SET total = total + excluded.total, count = count + excluded.count
+                ''', [(*key, month, total, count) for key, (total, count) in rollups.items()])
+
+                # Метка для журнала изменений: удаление — это перенос в архив
+                cursor.execute("INSERT OR REPLACE INTO archive_state (key, value) VALUES ('archiving', ?)", (month,))
+                ids = [row[0] for row in rows]
+                for i in range(0, len(ids), DELETE_BATCH):
+                    batch = ids[i:i + DELETE_BATCH]
+                    cursor.execute(f"DELETE FROM expenses WHERE id IN ({','.join('?' * len(batch))})", batch)
+                cursor.execute("DELETE FROM archive_state WHERE key = 'archiving'")
+                self._advance_boundary(cursor, end)
+                conn.commit()
+                return len(rows)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка архивации месяца {month}: {e}")
+            raise
+
+    def _advance_boundary(self, cursor: sqlite3.Cursor, boundary: str):
+        """Граница архива только увеличивается"""
+        current = self.db_manager.archived_before(cursor)
+        if current is None or boundary > current:
+            cursor.execute("INSERT OR REPLACE INTO archive_state (key, value) VALUES ('archived_before', ?)",
+                           (boundary,))
+
+    def _write_chunk(self, month: str, rows: List[list]):
+        """Запись (или дополнение) порции месяца в годовой архив"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.archive_path(int(month[:4]))
+        if os.path.exists(path):
+            os.chmod(path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS expense_chunks (
+                    month TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    rows INTEGER NOT NULL,
+                    total REAL NOT NULL,
+                    data BLOB NOT NULL
+                )
+            ''')
+            existing = conn.execute('SELECT version, data FROM expense_chunks WHERE month = ?',
+                                    (month,)).fetchone()
+            version = 1
+            if existing:
+                # Дополнение задним числом; строки с теми же id не дублируются
+                version = existing[0] + 1
+                known = {row[0] for row in rows}
+                rows = [row for row in self._decode(existing[1]) if row[0] not in known] + rows
+            rows.sort(key=lambda row: (row[6], row[0]))
+            data = zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+                                 ARCHIVE_CONFIG['compression_level'])
+            conn.execute('INSERT OR REPLACE INTO expense_chunks (month, version, rows, total, data) VALUES (?, ?, ?, ?, ?)',
+                         (month, version, len(rows), sum(row[4] for row in rows), data))
+            conn.commit()
+        finally:
+            conn.close()
+        # Архив доступен только для чтения
+        os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+    # Чтение
+
+    @staticmethod
+    def _decode(data: bytes) -> List[list]:
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+
+    def _months(self, start_date: Optional[str], end_date: Optional[str], before: str) -> Dict[int, Tuple[str, str]]:
+        """Диапазоны месяцев (первый, последний) по годам архивов для периода"""
+        first = (start_date or '0000-01')[:7]
+        last = min((end_date or before)[:7], before[:7])
+        years = {}
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                stem, ext = os.path.splitext(name)
+                year = stem[len(self.prefix) + 1:]
+                if ext == '.db' and stem.startswith(self.prefix + '_') and year.isdigit():
+                    if first[:4] <= year <= last[:4]:
+                        years[int(year)] = (first, last)
+        return years
+
+    def _read_chunks(self, start_date: Optional[str], end_date: Optional[str], before: str,
+                     only: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, List[list]]]:
+        """Распакованные порции месяцев периода (только месяцы, для которых only() истинно)"""
+        chunks = []
+        for year, (first, last) in sorted(self._months(start_date, end_date, before).items()):
+            path = self.archive_path(year)
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                meta = conn.execute('''
+                    SELECT month, version FROM expense_chunks
+                    WHERE month >= ? AND month <= ? ORDER BY month
+                ''', (first, last)).fetchall()
+                for month, version in meta:
+                    if only is not None and not only(month):
+                        continue
+                    key = (path, month, version)
+                    with self._lock:
+                        rows = self._chunks.get(key)
+                        if rows is not None:
+                            self._chunks.move_to_end(key)
+                    if rows is None:
+                        data = conn.execute('SELECT data FROM expense_chunks WHERE month = ?', (month,)).fetchone()[0]
+                        rows = self._decode(data)
+                        with self._lock:
+                            self._chunks[key] = rows
+                            while len(self._chunks) > ARCHIVE_CONFIG['chunk_cache']:
+                                self._chunks.popitem(last=False)
+                    chunks.append((month, rows))
+            finally:
+                conn.close()
+        return chunks
+
+    @staticmethod
+    def _matches(row: list, user_id: Optional[int], start_date: Optional[str],
+                 end_date: Optional[str], category_id: Optional[int], before: str) -> bool:
+        # Те же условия, что build_expense_filters (сравнение DATE(date) со строкой)
+        day = (row[6] or '')[:10]
+        return (day < before
+                and (not user_id or row[1] == user_id)
+                and (not start_date or day >= start_date)
+                and (not end_date or day <= end_date)
+                and (not category_id or row[2] == category_id))
+
+    def get_rows(self, user_id: Optional[int] = None,
+                 start_date: Optional[str] = None,
+                 end_date: Optional[str] = None,
+                 category_id: Optional[int] = None,
+                 before: Optional[str] = None) -> List[list]:
+        """Архивные строки (поля CHUNK_FIELDS) по фильтрам в порядке (date, id)"""
+        before = before or self.archived_before()
+        if not before:
+            return []
+        try:
+            return [row
+                    for _, rows in self._read_chunks(start_date, end_date, before)
+                    for row in rows
+                    if self._matches(row, user_id, start_date, end_date, category_id, before)]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения архива расходов: {e}")
+            raise
+
+    def get_expenses(self, user_id: Optional[int] = None,
+                     start_date: Optional[str] = None,
+                     end_date: Optional[str] = None,
+                     category_id: Optional[int] = None,
+                     before: Optional[str] = None) -> List[Tuple]:
+        """Архивные расходы в формате get_expenses(): (date, amount, category, method, description, id)"""
+        return [(row[6], row[4], row[8], row[9], row[5], row[0])
+                for row in self.get_rows(user_id, start_date, end_date, category_id, before)]
+
+    def get_total(self, user_id: Optional[int] = None,
+                  start_date: Optional[str] = None,
+                  end_date: Optional[str] = None,
+                  before: Optional[str] = None) -> float:
+        """Сумма архивных расходов: полные месяцы — из итогов, неполные — из архива"""
+        before = before or self.archived_before()
+        if not before:
+            return 0.0
+
+        try:
+            with self.db_manager.connect_db() as conn:
+                query = 'SELECT month, SUM(total) FROM expense_rollups'
+                params = []
+                if user_id:
+                    query += ' WHERE user_id = ?'
+                    params.append(user_id)
+                rollups = dict(conn.execute(query + ' GROUP BY month', params).fetchall())
+
+            first = (start_date or '0000-01')[:7]
+            last = min((end_date or before)[:7], before[:7])
+            total = sum(amount for month, amount in rollups.items()
+                        if first <= month <= last and covers_month(month, start_date, end_date))
+            partial = {month for month in rollups
+                       if first <= month <= last and not covers_month(month, start_date, end_date)}
+            if partial:
+                total += sum(row[4]
+                             for _, rows in self._read_chunks(start_date, end_date, before, partial.__contains__)
+                             for row in rows
+                             if self._matches(row, user_id, start_date, end_date, None, before))
+            return total
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка подсчета суммы архива: {e}")
+            raise
+
+    def aggregate(self, dimensions: List[str], user_id: Optional[int] = None,
+                  start_date: Optional[str] = None,
+                  end_date: Optional[str] = None,
+                  category_id: Optional[int] = None,
+                  before: Optional[str] = None) -> Dict[Tuple, List]:
+        """Суммы и количества архива по измерениям сводных таблиц
+        (category, payment_method, user, day, week, month, year):
+        {(метки...): [сумма, количество]}.
+
+        Полностью входящие в период месяцы берутся из итогов, если измерения
+        не мельче месяца; остальные месяцы — из распакованных порций.
+        """
+        before = before or self.archived_before()
+        if not before or (start_date and start_date[:10] >= before):
+            return {}
+        first = (start_date or '0000-01')[:7]
+        last = min((end_date or before)[:7], before[:7])
+        cells: Dict[Tuple, List] = defaultdict(lambda: [0.0, 0])
+        rolled = set()
+        try:
+            if all(name in ROLLUP_DIMENSIONS for name in dimensions):
+                with self.db_manager.connect_db() as conn:
+                    rows = conn.execute('''
+                        SELECT r.month, r.user_id, r.category_id, c.name, pm.method_name, r.total, r.count
+                        FROM expense_rollups r
+                        JOIN categories c ON r.category_id = c.id
+                        JOIN payment_methods pm ON r.payment_method_id = pm.id
+                        WHERE r.month >= ? AND r.month <= ?
+                    ''', (first, last)).fetchall()
+                for month, row_user, row_category, category, method, total, count in rows:
+                    if not covers_month(month, start_date, end_date):
+                        continue
+                    rolled.add(month)
+                    if (user_id and row_user != user_id) or (category_id and row_category != category_id):
+                        continue
+                    labels = {'category': category, 'payment_method': method, 'user': row_user,
+                              'month': month, 'year': month[:4]}
+                    cell = cells[tuple(labels[name] for name in dimensions)]
+                    cell[0] += total
+                    cell[1] += count
+
+            for _, rows in self._read_chunks(start_date, end_date, before, lambda month: month not in rolled):
+                for row in rows:
+                    if not self._matches(row, user_id, start_date, end_date, category_id, before):
+                        continue
+                    cell = cells[tuple(self._label(row, name) for name in dimensions)]
+                    cell[0] += row[4]
+                    cell[1] += 1
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка агрегации архива: {e}")
+            raise
+        return dict(cells)
+
+    @staticmethod
+    def _label(row: list, dimension: str):
+        if dimension == 'category':
+            return row[8]
+        if dimension == 'payment_method':
+            return row[9]
+        if dimension == 'user':
+            return row[1]
+        return period_key(row[6], dimension)
+
+    def stats(self) -> Dict:
+        """Сведения об архиве: граница, число месяцев, строк и размер файлов"""
+        before = self.archived_before()
+        months = rows = size = 0
+        if before:
+            for year in self._months(None, None, before):
+                path = self.archive_path(year)
+                size += os.path.getsize(path)
+                conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                try:
+                    count, total_rows = conn.execute('SELECT COUNT(*), COALESCE(SUM(rows), 0) FROM expense_chunks').fetchone()
+                finally:
+                    conn.close()
+                months += count
+                rows += total_rows
+        return {'archived_before': before, 'months': months, 'rows': rows, 'bytes': size}
+
+
+# Создаем глобальный экземпляр архива
+expense_archiver = LazyInstance(ExpenseArchiver)
@@ -0,0 +1,184 @@
+"""
+Фоновое выполнение работы с БД и планирование обновлений Tkinter-интерфейса
+"""
+
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Set
+import logging
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_MS = 50
+REFRESH_DELAY_MS = 100
+
+
+class TkBackgroundExecutor:
+    """Пул потоков, результаты которого доставляются в главный поток через root.after.
+
+    Задачи помечаются ключом ("load_expenses", "report" и т.п.). Новая задача
+    с тем же ключом отменяет еще не начатую предыдущую, а результат
+    устаревшей задачи отбрасывается, поэтому быстрые повторные обновления
+    не накапливаются (replace=False отключает это для задач, которые нельзя
+    терять, например записи в БД). Обратные вызовы on_success/on_error
+    всегда выполняются в главном потоке и могут работать с виджетами.
+    """
+
+    def __init__(self, root, max_workers: int = 2, poll_interval: int = POLL_INTERVAL_MS):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.on_busy_change: Optional[Callable[[bool, Set[str]], None]] = None
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gui-worker")
+        self._results: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._generations: Dict[str, int] = {}
+        self._futures: Dict[str, Future] = {}
+        self._pending: Dict[str, int] = {}
+        self._polling = False
+        self._closed = False
+
+    def submit(self, key: str, func: Callable, *args,
+               on_success: Optional[Callable] = None,
+               on_error: Optional[Callable[[Exception], None]] = None,
+               replace: bool = True, **kwargs) -> Future:
+        """Запуск func(*args, **kwargs) в фоне; вызывать из главного потока"""
+        if self._closed:
+            raise RuntimeError("Фоновый исполнитель остановлен")
+
+        generation = None
+        if replace:
+            with self._lock:
+                generation = self._generations.get(key, 0) + 1
+                self._generations[key] = generation
+                previous = self._futures.get(key)
+            if previous is not None and previous.cancel():
+                logger.debug(f"Отменена устаревшая задача: {key}")
+                self._change_pending(key, -1)
+
+        def run():
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self._results.put((key, generation, False, e, on_success, on_error))
+            else:
+                self._results.put((key, generation, True, result, on_success, on_error))
+
+        future = self._pool.submit(run)
+        if replace:
+            with self._lock:
+                self._futures[key] = future
+        self._change_pending(key, 1)
+        self._schedule_poll()
+        return future
+
+    def call_in_main(self, func: Callable, *args):
+        """Выполнение func в главном потоке (для вызова из фоновой задачи)"""
+        self._results.put((None, None, True, None, lambda _: func(*args), None))
+
+    def is_busy(self, key: Optional[str] = None) -> bool:
+        return key in self._pending if key else bool(self._pending)
+
+    def _is_current(self, key: str, generation: Optional[int]) -> bool:
+        if generation is None:
+            return True
+        with self._lock:
+            return self._generations.get(key) == generation
+
+    def _change_pending(self, key: str, delta: int):
+        count = self._pending.get(key, 0) + delta
+        if count > 0:
+            self._pending[key] = count
+        else:
+            self._pending.pop(key, None)
+        if self.on_busy_change:
+            self.on_busy_change(bool(self._pending), set(self._pending))
+
+    def _schedule_poll(self):
+        if not self._polling and not self._closed:
+            self._polling = True
+            self.root.after(self.poll_interval, self._poll)
+
+    def _poll(self):
+        """Доставка готовых результатов в главном потоке"""
+        self._polling = False
+        while True:
+            try:
+                key, generation, ok, value, on_success, on_error = self._results.get_nowait()
+            except queue.Empty:
+                break
+
+            if key is not None:
+                self._change_pending(key, -1)
+                if not self._is_current(key, generation):
+                    continue
+
+            try:
+                if ok:
+                    if on_success:
+                        on_success(value)
+                elif on_error:
+                    on_error(value)
+                else:
+                    logger.error(f"Ошибка фоновой задачи {key}: {value}")
+            except Exception as e:
+                logger.error(f"Ошибка обработки результата задачи {key}: {e}")
+
+        if self._pending:
+            self._schedule_poll()
+
+    def shutdown(self):
+        """Остановка пула без ожидания незавершенных задач"""
+        self._closed = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class RefreshScheduler:
+    """Объединение запросов на обновление виджетов через root.after.
+
+    Повторные request() в пределах delay_ms выполняются одним обновлением;
+    обновления виджетов на скрытых вкладках откладываются, пока вкладка не
+    станет видимой (is_visible(tab) и повторный flush()).
+    """
+
+    def __init__(self, root, delay_ms: int = REFRESH_DELAY_MS,
+                 is_visible: Optional[Callable[[str], bool]] = None):
+        self.root = root
+        self.delay_ms = delay_ms
+        self.is_visible = is_visible or (lambda tab: True)
+        self._callbacks: Dict[str, Callable[[], None]] = {}
+        self._tabs: Dict[str, Optional[str]] = {}
+        self._dirty: Set[str] = set()
+        self._scheduled = False
+
+    def register(self, name: str, callback: Callable[[], None], tab: Optional[str] = None):
+        """Регистрация обновления; tab — вкладка, на которой находится виджет"""
+        self._callbacks[name] = callback
+        self._tabs[name] = tab
+
+    def request(self, *names: str):
+        """Пометка обновлений как необходимых (выполнятся через delay_ms)"""
+        self._dirty.update(names)
+        if not self._scheduled:
+            self._scheduled = True
+            self.root.after(self.delay_ms, self.flush)
+
+    def discard(self, tab: str):
+        """Отмена отложенных обновлений вкладки (например, после ее построения)"""
+        self._dirty -= {name for name in self._dirty if self._tabs.get(name) == tab}
+
+    def is_pending(self, name: str) -> bool:
+        return name in self._dirty
+
+    def flush(self):
+        """Выполнение накопленных обновлений для видимых вкладок"""
+        self._scheduled = False
+        for name in sorted(self._dirty):
+            tab = self._tabs.get(name)
+            if tab is not None and not self.is_visible(tab):
+                continue
+            self._dirty.discard(name)
+            try:
+                self._callbacks[name]()
+            except Exception as e:
+                logger.error(f"Ошибка обновления {name}: {e}")
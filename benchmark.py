@@ -0,0 +1,374 @@
+"""
+Нагрузочные замеры на синтетических данных: генератор, прогон, сравнение с эталоном
+"""
+
+import argparse
+import glob
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import logging
+from config import DEFAULT_CATEGORIES
+from database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# Размеры наборов данных
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+PAYMENT_METHODS = ["💳 Банковская карта", "💵 Наличные", "📱 Онлайн-платеж", "🏦 Перевод"]
+PAYMENT_WEIGHTS = [0.6, 0.15, 0.15, 0.1]
+ROWS_PER_USER = 5000
+DEFAULT_YEARS = 3
+DEFAULT_SEED = 42
+INSERT_CHUNK = 50_000
+# Состояние, производное от расходов: очищается при новой генерации. Потребители
+# журнала без контрольной точки пересчитываются при первом обращении, прогнозные
+# модели обучаются заново
+DERIVED_TABLES = ('expense_changes', 'consumer_checkpoints', 'spend_sketches', 'anomaly_stats',
+                  'expense_anomalies', 'forecast_models', 'expense_rollups', 'archive_state',
+                  'import_hashes')
+REGRESSION_THRESHOLD = 1.2
+
+# Типичная сумма (медиана, ₽) и относительная частота покупок по категориям;
+# суммы распределены логнормально, у неизвестных категорий — значения по умолчанию
+CATEGORY_PROFILES = {
+    '🍕 Еда': (700, 25),
+    '🚗 Транспорт': (300, 15),
+    '🛍️ Покупки': (1500, 8),
+    '🎬 Развлечения': (1200, 4),
+    '🏥 Здоровье': (2000, 2),
+    '📚 Образование': (3000, 1),
+    '☕ Кофе': (250, 20),
+    '🏠 Жилье': (30000, 0.3),
+    '💡 Коммунальные услуги': (5000, 0.5),
+    '📱 Связь': (600, 0.5),
+    '👕 Одежда': (3500, 2),
+    '🎁 Подарки': (2500, 1),
+    '✈️ Путешествия': (25000, 0.3),
+    '🏃 Спорт': (1500, 2),
+    '🎮 Игры': (1000, 1),
+    '💊 Лекарства': (800, 2),
+}
+DEFAULT_PROFILE = (1000, 1)
+AMOUNT_SIGMA = 0.6
+
+
+def parse_size(value: str) -> int:
+    """Размер набора: '10k', '1m', '10m' или число строк"""
+    value = value.lower().replace('_', '')
+    if value in SIZES:
+        return SIZES[value]
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Неверный размер набора данных: {value}")
+
+
+class SyntheticDataGenerator:
+    """Детерминированный генератор расходов.
+
+    Одинаковые seed, число строк и конечная дата дают одинаковые данные.
+    Строки равномерно распределены по дням за years лет до end_date и
+    по пользователям (один пользователь на ROWS_PER_USER строк).
+    """
+
+    def __init__(self, rows: int, seed: int = DEFAULT_SEED, years: int = DEFAULT_YEARS,
+                 end_date: Optional[date] = None):
+        self.rows = rows
+        self.seed = seed
+        self.years = years
+        self.end_date = end_date or date.today()
+        self.start_date = self.end_date - timedelta(days=365 * years - 1)
+        self.users = max(1, rows // ROWS_PER_USER)
+        self.categories = [category['name'] for category in DEFAULT_CATEGORIES]
+
+    def rows_iter(self, category_ids: List[int], method_ids: List[int],
+                  user_ids: List[int]) -> Iterator[Tuple]:
+        """Строки (user_id, category_id, payment_method_id, amount, description, date)"""
+        rng = random.Random(self.seed)
+        profiles = [CATEGORY_PROFILES.get(name, DEFAULT_PROFILE) for name in self.categories]
+        weights = [weight for _, weight in profiles]
+        log_medians = [math.log(median) for median, _ in profiles]
+        days = (self.end_date - self.start_date).days + 1
+        start_ordinal = self.start_date.toordinal()
+
+        for index in range(self.rows):
+            category = rng.choices(range(len(category_ids)), weights)[0]
+            method = rng.choices(method_ids, PAYMENT_WEIGHTS)[0]
+            amount = round(rng.lognormvariate(log_medians[category], AMOUNT_SIGMA), 2)
+            # Равномерно по дням от start_date до end_date, время суток случайное
+            day = date.fromordinal(start_ordinal + index * (days - 1) // max(self.rows - 1, 1))
+            seconds = rng.randrange(7 * 3600, 23 * 3600)
+            timestamp = f"{day.isoformat()} {seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+            yield (user_ids[rng.randrange(len(user_ids))], category_ids[category], method,
+                   max(amount, 0.01), f"Покупка #{index}", timestamp)
+
+    def signature(self) -> str:
+        return f"rows={self.rows};seed={self.seed};years={self.years};end={self.end_date.isoformat()}"
+
+    def populate(self, db: DatabaseManager) -> bool:
+        """Заполнение БД; False, если данные с той же сигнатурой уже есть"""
+        try:
+            with db.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('CREATE TABLE IF NOT EXISTS benchmark_meta (key TEXT PRIMARY KEY, value TEXT)')
+                cursor.execute("SELECT value FROM benchmark_meta WHERE key = 'signature'")
+                row = cursor.fetchone()
+                if row and row[0] == self.signature():
+                    return False
+
+                cursor.execute('DELETE FROM expenses')
+                cursor.executemany('INSERT OR IGNORE INTO users (username) VALUES (?)',
+                                   [(f"bench_user_{n}",) for n in range(self.users)])
+                cursor.executemany('INSERT OR IGNORE INTO categories (name, color) VALUES (?, ?)',
+                                   [(category['name'], category['color']) for category in DEFAULT_CATEGORIES])
+                cursor.executemany('INSERT OR IGNORE INTO payment_methods (method_name) VALUES (?)',
+                                   [(method,) for method in PAYMENT_METHODS])
+
+                user_ids = self._ids(cursor, 'users', 'username',
+                                     [f"bench_user_{n}" for n in range(self.users)])
+                category_ids = self._ids(cursor, 'categories', 'name', self.categories)
+                method_ids = self._ids(cursor, 'payment_methods', 'method_name', PAYMENT_METHODS)
+
+                started = time.perf_counter()
+                chunk = []
+                for row in self.rows_iter(category_ids, method_ids, user_ids):
+                    chunk.append(row)
+                    if len(chunk) >= INSERT_CHUNK:
+                        db._insert_expenses_bulk(cursor, chunk)
+                        chunk = []
+                if chunk:
+                    db._insert_expenses_bulk(cursor, chunk)
+
+                # Синтетические строки не являются изменениями для потребителей журнала;
+                # скетчи, статистика и модели прежнего набора к новому не относятся
+                cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+                existing = {row[0] for row in cursor.fetchall()}
+                for table in DERIVED_TABLES:
+                    if table in existing:
+                        cursor.execute(f'DELETE FROM {table}')
+                cursor.execute("INSERT OR REPLACE INTO benchmark_meta VALUES ('signature', ?)",
+                               (self.signature(),))
+                conn.commit()
+                cursor.execute('ANALYZE')
+                self._remove_archives(db)
+                logger.info(f"Сгенерировано {self.rows} строк за {time.perf_counter() - started:.1f} с")
+                return True
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка генерации данных для замеров: {e}")
+            raise
+
+    @staticmethod
+    def _remove_archives(db: DatabaseManager):
+        """Удаление годовых архивов прежнего набора (граница архива уже сброшена)"""
+        from archive import ExpenseArchiver
+
+        for path in glob.glob(ExpenseArchiver(db).archive_path('*')):
+            os.remove(path)
+
+    @staticmethod
+    def _ids(cursor: sqlite3.Cursor, table: str, column: str, names: List[str]) -> List[int]:
+        cursor.execute(f'SELECT {column}, id FROM {table}')
+        ids = dict(cursor.fetchall())
+        return [ids[name] for name in names]
+
+
+class BenchmarkRunner:
+    """Замер операций БД, отчетов и уведомлений на заполненной БД.
+
+    Файлы отчетов пишутся в workdir (если задан), а не в текущий каталог.
+    """
+
+    def __init__(self, db: DatabaseManager, end_date: date, repeat: int = 3,
+                 workdir: Optional[str] = None):
+        self.db_manager = db
+        self.end_date = end_date
+        self.repeat = repeat
+        self.workdir = workdir
+
+    def cases(self) -> Dict[str, Callable[[], object]]:
+        """Набор замеров: имя -> вызов"""
+        # Тяжелые модули подключаются только при прогоне
+        from notifications import NotificationManager
+        from reports import ReportGenerator
+
+        db = self.db_manager
+        reports = ReportGenerator(db)
+        notifications = NotificationManager(db)
+        month_start = self.end_date.replace(day=1).isoformat()
+        year_start = (self.end_date - timedelta(days=364)).isoformat()
+        week_start = (self.end_date - timedelta(days=6)).isoformat()
+        end = self.end_date.isoformat() + " 23:59:59"
+
+        return {
+            'db.get_expenses.month': lambda: db.get_expenses(start_date=month_start, end_date=end),
+            'db.get_expenses.user': lambda: db.get_expenses(user_id=1),
+            'db.get_total_expenses': lambda: db.get_total_expenses(),
+            'db.get_total_expenses.year': lambda: db.get_total_expenses(start_date=year_start, end_date=end),
+            'db.get_expenses_by_category.month': lambda: db.get_expenses_by_category(
+                start_date=month_start, end_date=end),
+            'report.monthly': lambda: reports.generate_monthly_report(self.end_date.year, self.end_date.month),
+            'report.weekly': lambda: reports.generate_weekly_report(week_start),
+            'report.category_analysis': lambda: reports.generate_category_analysis(year_start, end),
+            'report.payment_method_analysis': lambda: reports.generate_payment_method_analysis(year_start, end),
+            'report.daily_breakdown': lambda: reports.generate_daily_breakdown(year_start, end),
+            'notifications.check_spending_limits': notifications.check_spending_limits,
+            'notifications.forecast': notifications.get_spending_forecast,
+            'notifications.category_insights': notifications.get_category_insights,
+            'notifications.budget_recommendations': notifications.get_budget_recommendations,
+            'notifications.analyze': notifications.analyze,
+        }
+
+    def measure(self, func: Callable[[], object]) -> Dict:
+        """Первый (холодный) вызов и repeat повторов"""
+        timings = []
+        for _ in range(self.repeat + 1):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        warm = timings[1:] or timings
+        return {
+            'first_ms': timings[0],
+            'min_ms': min(warm),
+            'median_ms': statistics.median(warm),
+            'mean_ms': statistics.fmean(warm),
+            'repeat': len(warm)
+        }
+
+    def run(self, only: Optional[List[str]] = None) -> Dict[str, Dict]:
+        results = {}
+        # Модули отчетов открывают глобальную БД по относительному пути,
+        # поэтому импортируются до смены каталога
+        cases = self.cases()
+        previous_dir = os.getcwd()
+        if self.workdir:
+            os.chdir(self.workdir)
+        try:
+            for name, func in cases.items():
+                if only and not any(name.startswith(prefix) for prefix in only):
+                    continue
+                try:
+                    results[name] = self.measure(func)
+                except Exception as e:
+                    logger.error(f"Ошибка замера {name}: {e}")
+                    results[name] = {'error': str(e)}
+        finally:
+            os.chdir(previous_dir)
+        return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict],
+            threshold: float = REGRESSION_THRESHOLD) -> List[Dict]:
+    """Сравнение медиан с эталоном; regression — замедление больше threshold раз"""
+    rows = []
+    for name, values in results.items():
+        base = baseline.get(name)
+        if not base or 'median_ms' not in base or 'median_ms' not in values:
+            continue
+        ratio = values['median_ms'] / base['median_ms'] if base['median_ms'] else float('inf')
+        rows.append({
+            'name': name,
+            'baseline_ms': base['median_ms'],
+            'current_ms': values['median_ms'],
+            'ratio': ratio,
+            'regression': ratio > threshold
+        })
+    return rows
+
+
+def run_benchmarks(rows: int, seed: int = DEFAULT_SEED, years: int = DEFAULT_YEARS,
+                   end_date: Optional[date] = None, repeat: int = 3,
+                   workdir: Optional[str] = None, only: Optional[List[str]] = None) -> Dict:
+    """Генерация (или повторное использование) набора данных и прогон замеров.
+
+    БД и файлы отчетов создаются в workdir, а не в рабочем каталоге приложения.
+    """
+    workdir = workdir or os.path.join(tempfile.gettempdir(), "expense_benchmark")
+    os.makedirs(workdir, exist_ok=True)
+    generator = SyntheticDataGenerator(rows, seed, years, end_date)
+    db = DatabaseManager(os.path.join(workdir, f"bench_{rows}.db"), instrumented=False)
+
+    started = time.perf_counter()
+    generated = generator.populate(db)
+    generate_seconds = time.perf_counter() - started
+
+    results = BenchmarkRunner(db, generator.end_date, repeat, workdir).run(only)
+
+    return {
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'dataset': {'rows': rows, 'seed': seed, 'years': years, 'users': generator.users,
+                    'end_date': generator.end_date.isoformat(),
+                    'generated': generated, 'generate_seconds': generate_seconds},
+        'environment': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                        'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'results': results
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """python benchmark.py --size 1m --output bench.json --baseline baseline.json"""
+    parser = argparse.ArgumentParser(description="Замеры производительности трекера расходов")
+    parser.add_argument('--size', type=parse_size, default=SIZES['10k'],
+                        help="число строк: 10k, 1m, 10m или число")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--years', type=int, default=DEFAULT_YEARS)
+    parser.add_argument('--end-date', type=date.fromisoformat, default=None,
+                        help="последняя дата данных (по умолчанию сегодня)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workdir', default=None, help="каталог для БД и отчетов")
+    parser.add_argument('--only', nargs='*', help="префиксы замеров: db, report, notifications...")
+    parser.add_argument('--output', default=None, help="файл результатов JSON")
+    parser.add_argument('--baseline', default=None, help="эталонный файл результатов")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--profile', nargs='?', const='', metavar='КАТАЛОГ',
+                        help="сохранить профили отчетов и проверок (искажает замеры)")
+    args = parser.parse_args(argv)
+
+    if args.profile is not None:
+        from profiling import profiler
+        profiler.enable(os.path.abspath(args.profile or profiler.output_dir))
+
+    data = run_benchmarks(args.size, args.seed, args.years, args.end_date,
+                          args.repeat, args.workdir, args.only)
+
+    print(f"Набор данных: {data['dataset']['rows']} строк, "
+          f"{data['dataset']['users']} пользователей, до {data['dataset']['end_date']}")
+    print(f"{'Замер':<42} {'Первый':>10} {'Медиана':>10} {'Мин.':>10}")
+    for name, values in data['results'].items():
+        if 'error' in values:
+            print(f"{name:<42} ошибка: {values['error']}")
+        else:
+            print(f"{name:<42} {values['first_ms']:>10.1f} {values['median_ms']:>10.1f} {values['min_ms']:>10.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('dataset', {}).get('rows') != data['dataset']['rows']:
+            print("⚠️ Эталон получен на наборе другого размера")
+        comparison = compare(data['results'], baseline.get('results', {}), args.threshold)
+        print(f"\n{'Замер':<42} {'Эталон':>10} {'Сейчас':>10} {'x':>7}")
+        for row in comparison:
+            mark = " ⚠️" if row['regression'] else ""
+            print(f"{row['name']:<42} {row['baseline_ms']:>10.1f} {row['current_ms']:>10.1f} "
+                  f"{row['ratio']:>7.2f}{mark}")
+        if any(row['regression'] for row in comparison):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
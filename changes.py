@@ -0,0 +1,221 @@
+"""
+Журнал изменений расходов (change data capture) с контрольными точками потребителей
+"""
+
+import json
+import sqlite3
+from typing import Callable, Dict, List, Optional
+import logging
+from config import CHANGES_CONFIG
+from database import LazyInstance, db_manager
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeJournal:
+    """Чтение журнала expense_changes.
+
+    Журнал заполняют триггеры таблицы expenses (DatabaseManager), поэтому
+    в него попадают все изменения: add_expense, пакетные вставки,
+    каскадные удаления и записи из других процессов (CLI, HTTP API).
+    Каждая запись — операция 'insert', 'update', 'delete' или 'archive'
+    (перенос в архив) с возрастающим номером seq и строкой расхода до
+    (old) и после (new) изменения. SQLite выполняет записи по одной,
+    поэтому видимая запись с номером N означает, что все записи до N уже
+    зафиксированы: потребитель, читающий после своего seq, ничего не
+    пропустит. Номера не переиспользуются и после очистки.
+
+    Потребитель хранит контрольную точку (consumer_checkpoints): read()
+    возвращает изменения после нее, commit() сдвигает ее после обработки.
+    consume() делает и то и другое порциями (доставка не менее одного
+    раза: при сбое до commit() порция будет прочитана повторно).
+
+    Хранение: prune() удаляет записи старше CHANGES_CONFIG['retention_days'],
+    если их уже прочитали все потребители; запись, не подтвержденная хотя
+    бы одним потребителем, хранится сколько угодно долго, поэтому
+    заброшенных потребителей нужно удалять через remove_consumer().
+    Очистку выполняет каждый запуск ExpenseArchiver.archive()
+    (python cli.py archive), который удобно запускать по расписанию.
+    """
+
+    def __init__(self, db=None):
+        self.db_manager = db or db_manager
+
+    def latest_seq(self, cursor: Optional[sqlite3.Cursor] = None) -> int:
+        """Номер последней записи журнала (0, если журнал пуст); с cursor — в его транзакции"""
+        query = "SELECT seq FROM sqlite_sequence WHERE name = 'expense_changes'"
+        if cursor is not None:
+            row = cursor.execute(query).fetchone()
+            return row[0] if row else 0
+        try:
+            with self.db_manager.connect_db() as conn:
+                row = conn.execute(query).fetchone()
+                return row[0] if row else 0
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения номера журнала изменений: {e}")
+            raise
+
+    def changes_since(self, seq: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        """Изменения с номером больше seq в порядке номеров"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                return self._fetch(conn.cursor(), seq, limit)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения журнала изменений: {e}")
+            raise
+
+    @staticmethod
+    def _fetch(cursor: sqlite3.Cursor, seq: int, limit: Optional[int]) -> List[Dict]:
+        rows = cursor.execute('''
+            SELECT seq, op, expense_id, old, new, changed_at FROM expense_changes
+            WHERE seq > ? ORDER BY seq LIMIT ?
+        ''', (seq, limit or CHANGES_CONFIG['batch_size'])).fetchall()
+        return [{
+            'seq': row['seq'],
+            'op': row['op'],
+            'expense_id': row['expense_id'],
+            'old': json.loads(row['old']) if row['old'] else None,
+            'new': json.loads(row['new']) if row['new'] else None,
+            'changed_at': row['changed_at']
+        } for row in rows]
+
+    # Потребители
+
+    def checkpoint(self, consumer: str) -> int:
+        """Контрольная точка потребителя (0 для нового)"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                row = conn.execute('SELECT seq FROM consumer_checkpoints WHERE consumer = ?',
+                                   (consumer,)).fetchone()
+                return row[0] if row else 0
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения контрольной точки {consumer}: {e}")
+            raise
+
+    def has_consumer(self, consumer: str) -> bool:
+        """Есть ли у потребителя контрольная точка"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                return conn.execute('SELECT EXISTS(SELECT 1 FROM consumer_checkpoints WHERE consumer = ?)',
+                                    (consumer,)).fetchone()[0] == 1
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения контрольной точки {consumer}: {e}")
+            raise
+
+    def has_pending(self, consumer: str) -> bool:
+        """Есть ли изменения после контрольной точки потребителя"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                return conn.execute('''
+                    SELECT EXISTS(SELECT 1 FROM expense_changes WHERE seq > COALESCE(
+                        (SELECT seq FROM consumer_checkpoints WHERE consumer = ?), 0))
+                ''', (consumer,)).fetchone()[0] == 1
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения журнала изменений: {e}")
+            raise
+
+    def read(self, consumer: str, limit: Optional[int] = None) -> List[Dict]:
+        """Необработанные изменения потребителя (контрольная точка не сдвигается)"""
+        return self.changes_since(self.checkpoint(consumer), limit)
+
+    def commit(self, consumer: str, seq: int, cursor: Optional[sqlite3.Cursor] = None):
+        """Подтверждение обработки изменений до seq включительно; точка только растет.
+
+        С cursor точка записывается в транзакцию вызывающего (без фиксации).
+        """
+        if cursor is not None:
+            self._save_checkpoint(cursor, consumer, seq)
+            return
+        try:
+            with self.db_manager.connect_db() as conn:
+                self._save_checkpoint(conn.cursor(), consumer, seq)
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка сохранения контрольной точки {consumer}: {e}")
+            raise
+
+    @staticmethod
+    def _save_checkpoint(cursor: sqlite3.Cursor, consumer: str, seq: int):
+        cursor.execute('''
+            INSERT INTO consumer_checkpoints (consumer, seq) VALUES (?, ?)
+            ON CONFLICT (consumer) DO UPDATE SET seq = MAX(seq, excluded.seq),
+                                                 updated_at = CURRENT_TIMESTAMP
+        ''', (consumer, seq))
+
+    def remove_consumer(self, consumer: str):
+        """Удаление потребителя: его точка больше не удерживает журнал от очистки"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                conn.execute('DELETE FROM consumer_checkpoints WHERE consumer = ?', (consumer,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка удаления потребителя {consumer}: {e}")
+            raise
+
+    def consume(self, consumer: str, handler: Callable[[List[Dict]], None],
+                limit: Optional[int] = None) -> int:
+        """Обработка всех новых изменений порциями; возвращает число изменений"""
+        processed = 0
+        while True:
+            changes = self.read(consumer, limit)
+            if not changes:
+                return processed
+            handler(changes)
+            self.commit(consumer, changes[-1]['seq'])
+            processed += len(changes)
+
+    def apply(self, consumer: str, handler: Callable[[sqlite3.Cursor, List[Dict]], None],
+              limit: Optional[int] = None) -> int:
+        """Обработка новых изменений ровно один раз; возвращает число изменений.
+
+        Каждая порция читается, передается в handler(cursor, changes) и
+        подтверждается в одной транзакции BEGIN IMMEDIATE: производные
+        данные, которые handler пишет через cursor, фиксируются вместе с
+        контрольной точкой, а потребители из разных процессов не
+        обрабатывают одну порцию дважды.
+        """
+        # Без новых изменений блокировка на запись не берется
+        if not self.has_pending(consumer):
+            return 0
+
+        processed = 0
+        while True:
+            try:
+                with self.db_manager.connect_db() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('BEGIN IMMEDIATE')
+                    row = cursor.execute('SELECT seq FROM consumer_checkpoints WHERE consumer = ?',
+                                         (consumer,)).fetchone()
+                    changes = self._fetch(cursor, row[0] if row else 0, limit)
+                    if changes:
+                        handler(cursor, changes)
+                        self._save_checkpoint(cursor, consumer, changes[-1]['seq'])
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка обработки журнала изменений {consumer}: {e}")
+                raise
+            if not changes:
+                return processed
+            processed += len(changes)
+
+    def prune(self, retention_days: Optional[int] = None) -> int:
+        """Удаление записей старше retention_days, уже прочитанных всеми потребителями"""
+        days = CHANGES_CONFIG['retention_days'] if retention_days is None else retention_days
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.execute('''
+                    DELETE FROM expense_changes
+                    WHERE changed_at <= datetime('now', ?)
+                      AND seq <= COALESCE((SELECT MIN(seq) FROM consumer_checkpoints), seq)
+                ''', (f"-{days} days",))
+                conn.commit()
+                if cursor.rowcount:
+                    logger.info(f"Из журнала изменений удалено {cursor.rowcount} записей")
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка очистки журнала изменений: {e}")
+            raise
+
+
+# Создаем глобальный журнал изменений
+change_journal = LazyInstance(ChangeJournal)
@@ -0,0 +1,418 @@
+"""
+Командная строка трекера расходов (без графического интерфейса)
+
+Примеры:
+    python cli.py add 350 "☕ Кофе" --method "💵 Наличные"
+    python cli.py add --file expenses.csv
+    python cli.py import statement.csv statement2.ofx --jobs 4
+    python cli.py query --from 2024-01-01 --category "🍕 Еда" --format csv
+    python cli.py export expenses.jsonl.gz --from 2024-01-01
+    python cli.py report monthly categories daily --jobs 3
+    python cli.py limits --all-users --jobs 4 --strict
+    python cli.py archive --before 2024-01-01 --vacuum
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Модули БД, отчетов и уведомлений импортируются в обработчиках команд,
+# чтобы запуск CLI не платил за неиспользуемые подсистемы
+ADD_BATCH_SIZE = 5000
+QUERY_CHUNK_SIZE = 1000
+DEFAULT_USER = "default_user"
+REPORT_KINDS = ('monthly', 'weekly', 'categories', 'methods', 'daily')
+
+
+class CommandError(Exception):
+    """Ошибка входных данных команды (код выхода 2)"""
+
+
+def _db(args):
+    from database import DatabaseManager, db_manager
+    return DatabaseManager(args.db) if args.db else db_manager
+
+
+def _user_id(db, args, create: bool = False) -> Optional[int]:
+    """ID пользователя из --user; для записи — пользователь по умолчанию"""
+    name = args.user or (DEFAULT_USER if create else None)
+    if not name:
+        return None
+    user_id = db.get_user_id(name)
+    if user_id is None:
+        if not create:
+            raise CommandError(f"Пользователь не найден: {name}")
+        user_id = db.add_user(name)
+    return user_id
+
+
+def _category_id(db, name: Optional[str]) -> Optional[int]:
+    if not name:
+        return None
+    category_id = db.get_category_id(name)
+    if category_id is None:
+        raise CommandError(f"Категория не найдена: {name}")
+    return category_id
+
+
+def _out(text: str):
+    """Вывод строки сразу, без накопления в буфере"""
+    sys.stdout.write(text + "\n")
+    sys.stdout.flush()
+
+
+def _run_parallel(tasks: Dict[str, Callable], jobs: int) -> Iterable[Tuple[str, object, Optional[Exception]]]:
+    """Выполнение задач в jobs потоках; результаты выдаются по мере готовности"""
+    if jobs <= 1 or len(tasks) <= 1:
+        for name, task in tasks.items():
+            try:
+                yield name, task(), None
+            except Exception as e:
+                yield name, None, e
+        return
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(task): name for name, task in tasks.items()}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
+
+
+def _read_expense_rows(filename: str) -> Iterable[Dict[str, str]]:
+    """Строки CSV с колонками date, amount, category, payment_method, description"""
+    stream = sys.stdin if filename == '-' else open(filename, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.DictReader(stream)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def cmd_add(args) -> int:
+    """Добавление одного расхода или пакета из CSV (пакетами по ADD_BATCH_SIZE)"""
+    from config import IMPORT_CONFIG
+    from utils import validate_amount, validate_category, validate_date
+
+    db = _db(args)
+    user_id = _user_id(db, args, create=True)
+    default_method = args.method or IMPORT_CONFIG['default_payment_method']
+
+    if args.file:
+        rows = _read_expense_rows(args.file)
+    elif args.amount and args.category:
+        rows = [{'amount': args.amount, 'category': args.category, 'payment_method': default_method,
+                 'description': args.description or '', 'date': args.date or ''}]
+    else:
+        raise CommandError("Укажите сумму и категорию или --file")
+
+    categories: Dict[str, int] = {}
+    methods: Dict[str, int] = {}
+    batch, added, invalid = [], 0, 0
+    for line_no, row in enumerate(rows, start=1):
+        valid, amount, error = validate_amount(row.get('amount', ''))
+        category = (row.get('category') or '').strip()
+        category_ok, category_error = validate_category(category)
+        date_ok, date, date_error = validate_date(row['date']) if row.get('date') else (True, None, "")
+        if not valid or not category_ok or not date_ok:
+            invalid += 1
+            print(f"Строка {line_no}: {error or category_error or date_error}", file=sys.stderr)
+            continue
+        method = (row.get('payment_method') or '').strip() or default_method
+        if category not in categories:
+            categories[category] = db.add_category(category)
+        if method not in methods:
+            methods[method] = db.add_payment_method(method)
+        batch.append((user_id, categories[category], methods[method], amount,
+                      row.get('description') or '', date))
+        if len(batch) >= ADD_BATCH_SIZE:
+            added += db.add_expenses_bulk(batch)
+            batch = []
+            print(f"Добавлено: {added}", file=sys.stderr, flush=True)
+    if batch:
+        added += db.add_expenses_bulk(batch)
+
+    _out(f"Добавлено расходов: {added}" + (f", отклонено: {invalid}" if invalid else ""))
+    return 0 if added or not invalid else 1
+
+
+def cmd_import(args) -> int:
+    """Импорт выписок; каждый файл разбирается в --jobs процессах"""
+    from importer import StatementImporter
+
+    db = _db(args)
+    importer = StatementImporter(db, workers=args.jobs)
+    user_id = _user_id(db, args, create=True)
+    for filename in args.files:
+        result = importer.import_file(filename, user_id, args.format, args.method)
+        _out(f"{filename}: прочитано {result['read']}, добавлено {result['imported']}, "
+             f"дубликатов {result['duplicates']}, ошибок {result['invalid']} "
+             f"({result['seconds']:.2f} с)")
+        for error in result['errors']:
+            print(f"  {error}", file=sys.stderr)
+    return 0
+
+
+def cmd_query(args) -> int:
+    """Вывод расходов по фильтрам порциями из курсора"""
+    from export import EXPORT_COLUMNS
+
+    db = _db(args)
+    user_id = _user_id(db, args)
+    category_id = _category_id(db, args.category)
+    writer = csv.writer(sys.stdout) if args.format == 'csv' else None
+    if writer:
+        writer.writerow(EXPORT_COLUMNS)
+    elif args.format == 'table':
+        _out(f"{'ID':>8}  {'Дата':<19}  {'Сумма':>12}  {'Категория':<24}  {'Оплата':<22}  Описание")
+
+    shown = 0
+    for chunk in db.iter_expenses(user_id, args.date_from, args.date_to, category_id,
+                                  chunk_size=QUERY_CHUNK_SIZE):
+        if args.limit is not None:
+            chunk = chunk[:args.limit - shown]
+        if writer:
+            writer.writerows(chunk)
+        elif args.format == 'jsonl':
+            sys.stdout.write("".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n"
+                                     for row in chunk))
+        else:
+            sys.stdout.write("".join(
+                f"{expense_id:>8}  {date:<19}  {amount:>12.2f}  {category[:24]:<24}  {method[:22]:<22}  {description}\n"
+                for expense_id, date, amount, category, method, description, _ in chunk))
+        sys.stdout.flush()
+        shown += len(chunk)
+        if args.limit is not None and shown >= args.limit:
+            break
+
+    if args.format == 'table':
+        _out(f"Записей: {shown}")
+    return 0
+
+
+def cmd_export(args) -> int:
+    """Экспорт в файл (формат и сжатие по расширению)"""
+    from export import ExpenseExporter, ExportError
+
+    after = None
+    if args.after:
+        date, _, expense_id = args.after.rpartition(',')
+        if not date or not expense_id.isdigit():
+            raise CommandError(f"Ключ продолжения должен иметь вид 'ДАТА,ID': {args.after}")
+        after = (date, int(expense_id))
+
+    db = _db(args)
+    exporter = ExpenseExporter(db)
+    progress = None
+    if not args.quiet:
+        def progress(rows, seconds, last_key):
+            print(f"\rЭкспортировано: {rows}", end='', file=sys.stderr, flush=True)
+
+    try:
+        stats = exporter.export(args.file, args.format, args.compression, _user_id(db, args),
+                                args.date_from, args.date_to, _category_id(db, args.category),
+                                after=after, progress=progress)
+    except ExportError as e:
+        if progress:
+            print(file=sys.stderr)
+        print(f"Ошибка: {e}", file=sys.stderr)
+        if e.last_key:
+            print(f"Продолжить выгрузку: --after '{e.last_key[0]},{e.last_key[1]}'", file=sys.stderr)
+        return 1
+    if progress:
+        print(file=sys.stderr)
+    _out(f"{stats['filename']}: {stats['rows']} записей за {stats['seconds']:.2f} с "
+         f"({stats['rows_per_second']:.0f} строк/с)")
+    return 0
+
+
+def cmd_report(args) -> int:
+    """Генерация отчетов; несколько отчетов строятся параллельно в --jobs потоках"""
+    from reports import ReportGenerator
+
+    generator = ReportGenerator(_db(args))
+    builders = {
+        'monthly': lambda: generator.generate_monthly_report(args.year, args.month),
+        'weekly': lambda: generator.generate_weekly_report(args.start),
+        'categories': lambda: generator.generate_category_analysis(args.date_from, args.date_to),
+        'methods': lambda: generator.generate_payment_method_analysis(args.date_from, args.date_to),
+        'daily': lambda: generator.generate_daily_breakdown(args.date_from, args.date_to),
+    }
+    tasks = {kind: builders[kind] for kind in dict.fromkeys(args.kinds)}
+
+    failed = 0
+    for kind, result, error in _run_parallel(tasks, args.jobs):
+        if error:
+            failed += 1
+            print(f"❌ {kind}: {error}", file=sys.stderr, flush=True)
+        elif isinstance(result, str):
+            _out(result)
+        else:
+            _out(json.dumps({kind: result}, ensure_ascii=False, indent=2, default=str))
+    return 1 if failed else 0
+
+
+def cmd_limits(args) -> int:
+    """Проверка лимитов текущего месяца; --all-users — по всем пользователям параллельно"""
+    from notifications import NotificationManager
+
+    db = _db(args)
+    manager = NotificationManager(db if args.db else None)
+    if args.all_users:
+        with db.connect_db() as conn:
+            users = [(row['id'], row['username']) for row in conn.execute('SELECT id, username FROM users')]
+    else:
+        user_id = _user_id(db, args)
+        users = [(user_id, args.user or "все пользователи")]
+
+    tasks = {name: (lambda uid=uid: manager.check_spending_limits(uid)) for uid, name in users}
+    total_warnings = 0
+    for name, warnings, error in _run_parallel(tasks, args.jobs):
+        if error:
+            print(f"❌ {name}: {error}", file=sys.stderr, flush=True)
+            continue
+        total_warnings += len(warnings)
+        _out(f"{name}: " + ("превышений нет" if not warnings else f"предупреждений: {len(warnings)}"))
+        for warning in warnings:
+            _out(f"  {warning}")
+
+    return 1 if args.strict and total_warnings else 0
+
+
+def cmd_archive(args) -> int:
+    """Перенос старых расходов в сжатые архивы; --stats — только сведения об архиве"""
+    from datetime import date
+
+    db = _db(args)
+    if not args.stats:
+        if args.before:
+            try:
+                date.fromisoformat(args.before)
+            except ValueError:
+                raise CommandError(f"Неверная дата --before: {args.before}")
+        result = db.archive.archive(args.before, vacuum=args.vacuum)
+        _out(f"Перенесено в архив: {result['archived']} расходов за {len(result['months'])} мес.; "
+             f"удалено из журнала изменений: {result['pruned']}")
+    stats = db.archive.stats()
+    _out(f"Граница архива: {stats['archived_before'] or 'нет'}; месяцев: {stats['months']}, "
+         f"расходов: {stats['rows']}, размер: {stats['bytes'] / 1024:.1f} КиБ")
+    return 0
+
+
+def _add_common_options(parser: argparse.ArgumentParser, defaults: bool = True):
+    """Общие параметры; у подкоманд без значений по умолчанию, чтобы не затирать
+    указанные перед подкомандой"""
+    def default(value):
+        return value if defaults else argparse.SUPPRESS
+
+    parser.add_argument('--db', default=default(None), help="путь к базе данных (по умолчанию expenses.db)")
+    parser.add_argument('--user', default=default(None),
+                        help="имя пользователя (фильтр и владелец новых записей)")
+    parser.add_argument('--jobs', '-j', type=int, default=default(1), help="число параллельных задач")
+    parser.add_argument('--verbose', '-v', action='store_true', default=default(False), help="подробный журнал")
+    parser.add_argument('--profile', nargs='?', const='', default=default(None), metavar='КАТАЛОГ',
+                        help="профилировать отчеты и проверки (cProfile и tracemalloc)")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Трекер расходов: командная строка")
+    _add_common_options(parser)
+    common = argparse.ArgumentParser(add_help=False)
+    _add_common_options(common, defaults=False)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_filters(command):
+        command.add_argument('--from', dest='date_from', help="начальная дата YYYY-MM-DD")
+        command.add_argument('--to', dest='date_to', help="конечная дата YYYY-MM-DD")
+        command.add_argument('--category', help="название категории")
+
+    add = commands.add_parser('add', parents=[common], help="добавить расход или пакет из CSV")
+    add.add_argument('amount', nargs='?')
+    add.add_argument('category', nargs='?')
+    add.add_argument('--method', help="способ оплаты")
+    add.add_argument('--description', default='')
+    add.add_argument('--date', help="дата YYYY-MM-DD [HH:MM:SS] (по умолчанию сейчас)")
+    add.add_argument('--file', help="CSV с колонками date, amount, category, payment_method, "
+                                    "description ('-' — стандартный ввод)")
+    add.set_defaults(handler=cmd_add)
+
+    import_command = commands.add_parser('import', parents=[common], help="импорт банковских выписок CSV/OFX")
+    import_command.add_argument('files', nargs='+')
+    import_command.add_argument('--format', choices=('csv', 'ofx'))
+    import_command.add_argument('--method', help="способ оплаты для операций выписки")
+    import_command.set_defaults(handler=cmd_import)
+
+    query = commands.add_parser('query', parents=[common], help="вывести расходы по фильтрам")
+    add_filters(query)
+    query.add_argument('--limit', type=int)
+    query.add_argument('--format', choices=('table', 'csv', 'jsonl'), default='table')
+    query.set_defaults(handler=cmd_query)
+
+    export = commands.add_parser('export', parents=[common], help="экспорт в CSV/JSON Lines (gzip/zstd)")
+    export.add_argument('file')
+    add_filters(export)
+    export.add_argument('--format', choices=('csv', 'jsonl'))
+    export.add_argument('--compression', choices=('gzip', 'zstd'))
+    export.add_argument('--quiet', '-q', action='store_true', help="без индикатора прогресса")
+    export.add_argument('--after', metavar='ДАТА,ID',
+                        help="продолжить прерванную выгрузку после этого ключа (дописать в файл)")
+    export.set_defaults(handler=cmd_export)
+
+    report = commands.add_parser('report', parents=[common], help="сгенерировать отчеты")
+    report.add_argument('kinds', nargs='+', choices=REPORT_KINDS)
+    report.add_argument('--year', type=int)
+    report.add_argument('--month', type=int)
+    report.add_argument('--start', help="начало недели для weekly (YYYY-MM-DD)")
+    report.add_argument('--from', dest='date_from')
+    report.add_argument('--to', dest='date_to')
+    report.set_defaults(handler=cmd_report)
+
+    limits = commands.add_parser('limits', parents=[common], help="проверить лимиты текущего месяца")
+    limits.add_argument('--all-users', action='store_true')
+    limits.add_argument('--strict', action='store_true', help="код выхода 1 при предупреждениях")
+    limits.set_defaults(handler=cmd_limits)
+
+    archive = commands.add_parser('archive', parents=[common], help="перенести старые расходы в архив")
+    archive.add_argument('--before', help="граница (YYYY-MM-DD), по умолчанию горизонт из ARCHIVE_CONFIG")
+    archive.add_argument('--vacuum', action='store_true', help="сжать файл основной БД после переноса")
+    archive.add_argument('--stats', action='store_true', help="только показать сведения об архиве")
+    archive.set_defaults(handler=cmd_archive)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.jobs < 1:
+        args.jobs = 1
+
+    # Первый basicConfig побеждает, поэтому INFO-журнал database.py не засоряет вывод
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.profile is not None:
+        from profiling import profiler
+        profiler.enable(args.profile or None)
+
+    try:
+        return args.handler(args)
+    except CommandError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 2
+    except BrokenPipeError:
+        # Вывод оборван (например, "| head"): завершаемся без трассировки
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -100,12 +100,98 @@ VALIDATION_CONFIG = {
     'required_fields': ['amount', 'category', 'payment_method']
 }
 
+# Настройки импорта банковских выписок
+IMPORT_CONFIG = {
+    'chunk_size': 20000,  # строк на задачу разбора
+    'workers': 4,
+    'default_category': '🛍️ Покупки',
+    'default_payment_method': '💳 Банковская карта',
+    # Ключевые слова в описании операции (в нижнем регистре) -> категория
+    'merchant_categories': {
+        'пятерочка': '🍕 Еда',
+        'перекресток': '🍕 Еда',
+        'магнит': '🍕 Еда',
+        'вкусвилл': '🍕 Еда',
+        'яндекс.такси': '🚗 Транспорт',
+        'yandex.taxi': '🚗 Транспорт',
+        'uber': '🚗 Транспорт',
+        'метро': '🚗 Транспорт',
+        'azs': '🚗 Транспорт',
+        'starbucks': '☕ Кофе',
+        'кофе': '☕ Кофе',
+        'аптека': '💊 Лекарства',
+        'apteka': '💊 Лекарства',
+        'мтс': '📱 Связь',
+        'билайн': '📱 Связь',
+        'кинотеатр': '🎬 Развлечения',
+        'steam': '🎮 Игры',
+        'ozon': '🛍️ Покупки',
+        'wildberries': '🛍️ Покупки'
+    },
+    # Возможные названия колонок CSV (в нижнем регистре)
+    'csv_columns': {
+        'date': ['date', 'дата', 'дата операции', 'transaction date'],
+        'amount': ['amount', 'сумма', 'сумма операции', 'сумма в валюте счета'],
+        'description': ['description', 'описание', 'назначение', 'merchant', 'payee'],
+        'category': ['category', 'категория'],
+        'direction': ['type', 'direction', 'тип', 'тип операции', 'направление']
+    },
+    # Значения колонки направления, означающие поступление (не расход)
+    'credit_types': ['credit', 'cr', 'income', 'приход', 'поступление', 'зачисление', 'пополнение'],
+    'date_formats': ['%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y', '%d/%m/%Y', '%Y%m%d%H%M%S', '%Y%m%d']
+}
+
 # Настройки логирования
 LOGGING_CONFIG = {
     'level': 'INFO',
     'format': '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     'file': 'expense_tracker.log',
     'max_size': 10485760,  # 10MB
-    'backup_count': 5
+    'backup_count': 5,
+    'instrument_queries': True,  # замер каждого SQL-запроса DatabaseManager
+    'slow_query_ms': 100,
+    'slow_query_file': 'slow_queries.log',
+    'metrics_file': 'metrics.json'
+}
+
+
+# Настройки профилирования (включается переменной окружения или флагом --profile)
+PROFILING_CONFIG = {
+    'env_var': 'EXPENSE_TRACKER_PROFILE',  # "1" или каталог для профилей
+    'output_dir': 'profiles',
+    'tracemalloc_frames': 10,
+    'top_functions': 30,
+    'top_allocators': 20
 }
 
+# Настройки локального HTTP API (server.py)
+SERVER_CONFIG = {
+    'host': '127.0.0.1',
+    'port': 8765,
+    'pool_size': 8,  # подключений к SQLite и потоков для запросов
+    'busy_timeout_ms': 5000,
+    'cache_entries': 256,  # ответов GET в кэше
+    'page_size': 100,
+    'max_page_size': 1000,
+    'max_body_bytes': 1048576
+}
+
+# Настройки архивации старых расходов (archive.py)
+ARCHIVE_CONFIG = {
+    'horizon_months': 24,  # в основной таблице остаются расходы за последние N месяцев
+    'directory': 'archive',  # относительно каталога файла БД
+    'compression_level': 6,
+    'chunk_cache': 24  # распакованных месяцев в памяти
+}
+
+# Настройки журнала изменений расходов (changes.py)
+CHANGES_CONFIG = {
+    'batch_size': 1000,  # изменений за одно чтение потребителя
+    'retention_days': 30  # записи, прочитанные всеми потребителями, хранятся N дней (очистка — при архивации)
+}
+
+# Настройки квантильных скетчей (sketches.py)
+SKETCH_CONFIG = {
+    'compression': 100,
+    'stale_ratio': 0.05  # скетч пересчитывается, когда удалено больше этой доли его расходов
+}
@@ -1,7 +1,12 @@
+import heapq
+import itertools
 import sqlite3
+import threading
 from datetime import datetime
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Callable, Dict, Iterator
 import logging
+from config import LOGGING_CONFIG
+from metrics import TimedConnection
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -9,17 +14,81 @@ logger = logging.getLogger(__name__)
 
 DB_NAME = "expenses.db"
 
+class LazyInstance:
+    """Глобальный экземпляр, создаваемый при первом обращении к атрибуту.
+    
+    Импорт модуля не открывает expenses.db в текущем каталоге: CLI и
+    сервер с --db, а также процессы пула, которые импортируют модули
+    заново, работают со своей БД и не создают лишний файл.
+    """
+    
+    def __init__(self, factory: Callable):
+        object.__setattr__(self, '_lazy_factory', factory)
+        object.__setattr__(self, '_lazy_instance', None)
+        object.__setattr__(self, '_lazy_lock', threading.Lock())
+    
+    def _lazy_get(self):
+        if self._lazy_instance is None:
+            with self._lazy_lock:
+                if self._lazy_instance is None:
+                    object.__setattr__(self, '_lazy_instance', self._lazy_factory())
+        return self._lazy_instance
+    
+    @property
+    def created(self) -> bool:
+        return self._lazy_instance is not None
+    
+    def __getattr__(self, name: str):
+        return getattr(self._lazy_get(), name)
+    
+    def __setattr__(self, name: str, value):
+        setattr(self._lazy_get(), name, value)
+    
+    def __repr__(self) -> str:
+        name = getattr(self._lazy_factory, '__name__', 'instance')
+        return repr(self._lazy_instance) if self.created else f"<{name} (не создан)>"
+
 class DatabaseManager:
     """Класс для управления базой данных расходов"""
     
-    def __init__(self, db_name: str = DB_NAME):
+    def __init__(self, db_name: str = DB_NAME, instrumented: Optional[bool] = None):
         self.db_name = db_name
+        # Замер запросов (metrics.py): гистограммы и журнал медленных запросов
+        self.instrumented = (LOGGING_CONFIG.get('instrument_queries', False)
+                             if instrumented is None else instrumented)
+        self._listeners: List[Callable] = []
+        self._archive = None
         self.init_database()
     
+    def add_listener(self, listener: Callable[[str, List[Dict], sqlite3.Cursor], None]):
+        """Подписка на изменения расходов.
+        
+        Слушатель вызывается как listener(event, expenses, cursor), где event —
+        'insert' или 'delete', expenses — список словарей с полями расходов
+        (пакетная вставка передается одним вызовом), а cursor принадлежит той
+        же транзакции, что и само изменение.
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+    
+    def remove_listener(self, listener: Callable):
+        """Отписка от изменений расходов"""
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+    
+    def _notify_listeners(self, event: str, expenses: List[Dict], cursor: sqlite3.Cursor):
+        """Оповещение слушателей об изменении расходов"""
+        for listener in list(self._listeners):
+            try:
+                listener(event, expenses, cursor)
+            except Exception as e:
+                logger.warning(f"Ошибка обработчика изменений расходов: {e}")
+    
     def connect_db(self) -> sqlite3.Connection:
         """Создание подключения к базе данных"""
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = sqlite3.connect(self.db_name,
+                                   factory=TimedConnection if self.instrumented else sqlite3.Connection)
             conn.row_factory = sqlite3.Row  # Для доступа к колонкам по имени
             return conn
         except sqlite3.Error as e:
@@ -92,6 +161,42 @@ class DatabaseManager:
                     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
                     FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE CASCADE
                 )
+            ''',
+            # Итоги по месяцам для расходов, перенесенных в архив (archive.py)
+            'expense_rollups': '''
+                CREATE TABLE IF NOT EXISTS expense_rollups (
+                    user_id INTEGER NOT NULL,
+                    category_id INTEGER NOT NULL,
+                    payment_method_id INTEGER NOT NULL,
+                    month TEXT NOT NULL,
+                    total REAL NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, category_id, payment_method_id, month)
+                ) WITHOUT ROWID
+            ''',
+            'archive_state': '''
+                CREATE TABLE IF NOT EXISTS archive_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''',
+            # Журнал изменений расходов (changes.py), заполняется триггерами
+            'expense_changes': '''
+                CREATE TABLE IF NOT EXISTS expense_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    op TEXT NOT NULL,
+                    expense_id INTEGER NOT NULL,
+                    old TEXT,
+                    new TEXT,
+                    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''',
+            'consumer_checkpoints': '''
+                CREATE TABLE IF NOT EXISTS consumer_checkpoints (
+                    consumer TEXT PRIMARY KEY,
+                    seq INTEGER NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
             '''
         }
         
@@ -99,9 +204,42 @@ class DatabaseManager:
             cursor.execute(sql)
             logger.info(f"Таблица {table_name} создана/проверена")
         
+        # Индекс для постраничной выборки по дате (keyset-пагинация)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date, id)')
+        
+        self._create_change_triggers(cursor)
+        
         # Обновляем существующие таблицы для совместимости
         self._update_existing_tables(cursor)
     
+    @staticmethod
+    def _create_change_triggers(cursor: sqlite3.Cursor):
+        """Триггеры журнала изменений: любая вставка, изменение и удаление
+        расхода (в том числе из других процессов и каскадом) попадает в
+        expense_changes в той же транзакции"""
+        def row(alias: str) -> str:
+            return (f"json_object('id', {alias}.id, 'user_id', {alias}.user_id, "
+                    f"'category_id', {alias}.category_id, 'payment_method_id', {alias}.payment_method_id, "
+                    f"'amount', {alias}.amount, 'description', {alias}.description, 'date', {alias}.date)")
+        
+        triggers = {
+            'insert': f"INSERT INTO expense_changes (op, expense_id, new) VALUES ('insert', NEW.id, {row('NEW')})",
+            'update': (f"INSERT INTO expense_changes (op, expense_id, old, new) "
+                       f"VALUES ('update', NEW.id, {row('OLD')}, {row('NEW')})"),
+            # Перенос в архив (archive.py) помечается отдельно: это не удаление расхода
+            'delete': (f"INSERT INTO expense_changes (op, expense_id, old) VALUES ("
+                       f"CASE WHEN EXISTS (SELECT 1 FROM archive_state WHERE key = 'archiving') "
+                       f"THEN 'archive' ELSE 'delete' END, OLD.id, {row('OLD')})")
+        }
+        for event, action in triggers.items():
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS expenses_journal_{event}
+                AFTER {event.upper()} ON expenses
+                BEGIN
+                    {action};
+                END
+            ''')
+    
     def _update_existing_tables(self, cursor: sqlite3.Cursor):
         """Обновление существующих таблиц для совместимости"""
         try:
@@ -241,22 +379,111 @@ class DatabaseManager:
             raise
     
     def add_expense(self, user_id: int, category_id: int, payment_method_id: int, 
-                   amount: float, description: str = '') -> int:
-        """Добавление расхода"""
+                   amount: float, description: str = '', date: Optional[str] = None) -> int:
+        """Добавление расхода (по умолчанию с текущей датой)"""
         try:
             with self.connect_db() as conn:
                 cursor = conn.cursor()
-                date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                cursor.execute('''
-                    INSERT INTO expenses (user_id, category_id, payment_method_id, amount, description, date)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (user_id, category_id, payment_method_id, amount, description, date))
+                expense_id = self._insert_expense(cursor, user_id, category_id, payment_method_id,
+                                                  amount, description, date)
                 conn.commit()
-                return cursor.lastrowid
+                return expense_id
         except sqlite3.Error as e:
             logger.error(f"Ошибка добавления расхода: {e}")
             raise
     
+    def add_expenses_bulk(self, expenses: List[Tuple]) -> int:
+        """Пакетное добавление расходов одной транзакцией.
+        
+        Каждый элемент: (user_id, category_id, payment_method_id, amount,
+        description, date); date может быть None. Возвращает число добавленных строк.
+        """
+        try:
+            with self.connect_db() as conn:
+                cursor = conn.cursor()
+                count = self._insert_expenses_bulk(cursor, expenses)
+                conn.commit()
+                return count
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка пакетного добавления расходов: {e}")
+            raise
+    
+    def _insert_expenses_bulk(self, cursor: sqlite3.Cursor, expenses: List[Tuple]) -> int:
+        """Пакетная вставка в текущей транзакции (без commit)"""
+        last_id = None
+        if self._listeners:
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM expenses')
+            last_id = cursor.fetchone()[0]
+        
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.executemany('''
+            INSERT INTO expenses (user_id, category_id, payment_method_id, amount, description, date)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(*row[:5], row[5] or now) for row in expenses])
+        count = cursor.rowcount
+        
+        if last_id is not None and count > 0:
+            # Слушателям нужны id строк: в транзакции пишет только она, поэтому
+            # строки пакета — все строки с id больше прежнего максимума
+            cursor.execute('''
+                SELECT id, user_id, category_id, payment_method_id, amount, description, date
+                FROM expenses WHERE id > ? ORDER BY id
+            ''', (last_id,))
+            fields = [column[0] for column in cursor.description]
+            self._notify_listeners('insert', [dict(zip(fields, row)) for row in cursor.fetchall()], cursor)
+        return count
+    
+    def _insert_expense(self, cursor: sqlite3.Cursor, user_id: int, category_id: int,
+                        payment_method_id: int, amount: float, description: str = '',
+                        date: Optional[str] = None) -> int:
+        """Вставка расхода в текущей транзакции с оповещением слушателей"""
+        date = date or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute('''
+            INSERT INTO expenses (user_id, category_id, payment_method_id, amount, description, date)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, category_id, payment_method_id, amount, description, date))
+        expense_id = cursor.lastrowid
+        if self._listeners:
+            self._notify_listeners('insert', [{
+                'id': expense_id,
+                'user_id': user_id,
+                'category_id': category_id,
+                'payment_method_id': payment_method_id,
+                'amount': amount,
+                'description': description,
+                'date': date
+            }], cursor)
+        return expense_id
+    
+    @staticmethod
+    def build_expense_filters(user_id: Optional[int] = None,
+                              start_date: Optional[str] = None,
+                              end_date: Optional[str] = None,
+                              category_id: Optional[int] = None,
+                              alias: str = '') -> Tuple[List[str], List]:
+        """Построение условий WHERE для фильтрации расходов"""
+        prefix = f"{alias}." if alias else ''
+        conditions = []
+        params = []
+        
+        if user_id:
+            conditions.append(f"{prefix}user_id = ?")
+            params.append(user_id)
+        
+        if start_date:
+            conditions.append(f"DATE({prefix}date) >= ?")
+            params.append(start_date)
+        
+        if end_date:
+            conditions.append(f"DATE({prefix}date) <= ?")
+            params.append(end_date)
+        
+        if category_id:
+            conditions.append(f"{prefix}category_id = ?")
+            params.append(category_id)
+        
+        return conditions, params
+    
     def get_expenses(self, user_id: Optional[int] = None, 
                     start_date: Optional[str] = None, 
                     end_date: Optional[str] = None,
@@ -286,35 +513,158 @@ class DatabaseManager:
                         JOIN payment_methods pm ON e.payment_method_id = pm.id
                     '''
                 
-                conditions = []
-                params = []
+                conditions, params = self.build_expense_filters(
+                    user_id, start_date, end_date, category_id, alias='e'
+                )
                 
-                if user_id:
-                    conditions.append("e.user_id = ?")
-                    params.append(user_id)
+                if conditions:
+                    query += " WHERE " + " AND ".join(conditions)
                 
-                if start_date:
-                    conditions.append("DATE(e.date) >= ?")
-                    params.append(start_date)
+                query += " ORDER BY e.date DESC"
+                
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
                 
-                if end_date:
-                    conditions.append("DATE(e.date) <= ?")
-                    params.append(end_date)
+                # Старые расходы читаются из архива, только если период его затрагивает
+                archived_before = self.archived_before(cursor)
+                if archived_before and (not start_date or start_date < archived_before):
+                    rows.extend(self.archive.get_expenses(user_id, start_date, end_date,
+                                                          category_id, archived_before))
+                    rows.sort(key=lambda row: row[0], reverse=True)
+                return rows
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка получения расходов: {e}")
+            raise
+    
+    def get_expenses_page(self, after: Optional[Tuple[str, int]] = None, limit: int = 100,
+                          user_id: Optional[int] = None,
+                          start_date: Optional[str] = None,
+                          end_date: Optional[str] = None,
+                          category_id: Optional[int] = None) -> List[Tuple]:
+        """Страница расходов (новые первыми) после курсора (date, id).
+        
+        Курсор — дата и id последней строки предыдущей страницы; стоимость
+        запроса не зависит от того, насколько далеко пролистан список.
+        """
+        try:
+            with self.connect_db() as conn:
+                cursor = conn.cursor()
+                query = '''
+                    SELECT e.date, e.amount, c.name, pm.method_name, e.description, e.id
+                    FROM expenses e
+                    JOIN categories c ON e.category_id = c.id
+                    JOIN payment_methods pm ON e.payment_method_id = pm.id
+                '''
+                conditions, params = self.build_expense_filters(
+                    user_id, start_date, end_date, category_id, alias='e'
+                )
                 
-                if category_id:
-                    conditions.append("e.category_id = ?")
-                    params.append(category_id)
+                if after:
+                    conditions.append("(e.date, e.id) < (?, ?)")
+                    params.extend(after)
                 
                 if conditions:
                     query += " WHERE " + " AND ".join(conditions)
                 
-                query += " ORDER BY e.date DESC"
+                query += " ORDER BY e.date DESC, e.id DESC LIMIT ?"
+                params.append(limit)
                 
                 cursor.execute(query, params)
-                return cursor.fetchall()
+                rows = cursor.fetchall()
+                
+                # Архив нужен, только если страница доходит до его границы
+                archived_before = self.archived_before(cursor)
+                if (archived_before and (not start_date or start_date < archived_before)
+                        and (len(rows) < limit or rows[-1][0] < archived_before)):
+                    archived = [(row[6], row[4], row[8], row[9], row[5], row[0])
+                                for row in self.archive.get_rows(user_id, start_date, end_date,
+                                                                 category_id, archived_before)
+                                if not after or (row[6], row[0]) < tuple(after)]
+                    rows = sorted(list(rows) + archived, key=lambda row: (row[0], row[5]),
+                                  reverse=True)[:limit]
+                return rows
         except sqlite3.Error as e:
-            logger.error(f"Ошибка получения расходов: {e}")
+            logger.error(f"Ошибка получения страницы расходов: {e}")
+            raise
+    
+    def iter_expenses(self, user_id: Optional[int] = None,
+                      start_date: Optional[str] = None,
+                      end_date: Optional[str] = None,
+                      category_id: Optional[int] = None,
+                      after: Optional[Tuple[str, int]] = None,
+                      chunk_size: int = 1000) -> Iterator[List[Tuple]]:
+        """Потоковое чтение расходов порциями в порядке (date, id).
+        
+        Строки: (id, date, amount, category, payment_method, description, user_id).
+        after — ключ (date, id) последней уже обработанной строки для
+        продолжения прерванной выгрузки.
+        """
+        conn = self.connect_db()
+        try:
+            cursor = conn.cursor()
+            query = '''
+                SELECT e.id, e.date, e.amount, c.name, pm.method_name, e.description, e.user_id
+                FROM expenses e
+                JOIN categories c ON e.category_id = c.id
+                JOIN payment_methods pm ON e.payment_method_id = pm.id
+            '''
+            conditions, params = self.build_expense_filters(
+                user_id, start_date, end_date, category_id, alias='e'
+            )
+            
+            if after:
+                conditions.append("(e.date, e.id) > (?, ?)")
+                params.extend(after)
+            
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            
+            query += " ORDER BY e.date, e.id"
+            archived_before = self.archived_before(cursor)
+            cursor.execute(query, params)
+            
+            if archived_before and (not start_date or start_date < archived_before):
+                # Слияние архива с основной таблицей (задним числом добавленные
+                # строки могут оказаться между архивными)
+                archived = [(row[0], row[6], row[4], row[8], row[9], row[5], row[1])
+                            for row in self.archive.get_rows(user_id, start_date, end_date,
+                                                             category_id, archived_before)
+                            if not after or (row[6], row[0]) > tuple(after)]
+                live = (tuple(row) for chunk in iter(lambda: cursor.fetchmany(chunk_size), [])
+                        for row in chunk)
+                merged = heapq.merge(archived, live, key=lambda row: (row[1], row[0]))
+                while True:
+                    rows = list(itertools.islice(merged, chunk_size))
+                    if not rows:
+                        break
+                    yield rows
+                return
+            
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [tuple(row) for row in rows]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка потокового чтения расходов: {e}")
             raise
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def archived_before(cursor: sqlite3.Cursor) -> Optional[str]:
+        """Граница архива: расходы с датой раньше нее перенесены в архив"""
+        cursor.execute("SELECT value FROM archive_state WHERE key = 'archived_before'")
+        row = cursor.fetchone()
+        return row[0] if row else None
+    
+    @property
+    def archive(self):
+        """Архив старых расходов (модуль archive подключается при первом обращении)"""
+        if self._archive is None:
+            from archive import ExpenseArchiver
+            self._archive = ExpenseArchiver(self)
+        return self._archive
     
     def get_all_payment_methods(self) -> List[str]:
         """Получение всех способов оплаты"""
@@ -371,9 +721,20 @@ class DatabaseManager:
         try:
             with self.connect_db() as conn:
                 cursor = conn.cursor()
+                expense = None
+                if self._listeners:
+                    cursor.execute('''
+                        SELECT id, user_id, category_id, payment_method_id, amount, description, date
+                        FROM expenses WHERE id = ?
+                    ''', (expense_id,))
+                    row = cursor.fetchone()
+                    expense = dict(row) if row else None
                 cursor.execute('DELETE FROM expenses WHERE id = ?', (expense_id,))
+                deleted = cursor.rowcount > 0
+                if deleted and expense:
+                    self._notify_listeners('delete', [expense], cursor)
                 conn.commit()
-                return cursor.rowcount > 0
+                return deleted
         except sqlite3.Error as e:
             logger.error(f"Ошибка удаления расхода: {e}")
             raise
@@ -387,33 +748,25 @@ class DatabaseManager:
                 cursor = conn.cursor()
                 
                 query = "SELECT SUM(amount) FROM expenses"
-                conditions = []
-                params = []
-                
-                if user_id:
-                    conditions.append("user_id = ?")
-                    params.append(user_id)
-                
-                if start_date:
-                    conditions.append("DATE(date) >= ?")
-                    params.append(start_date)
-                
-                if end_date:
-                    conditions.append("DATE(date) <= ?")
-                    params.append(end_date)
+                conditions, params = self.build_expense_filters(user_id, start_date, end_date)
                 
                 if conditions:
                     query += " WHERE " + " AND ".join(conditions)
                 
                 cursor.execute(query, params)
                 result = cursor.fetchone()
-                return result[0] or 0.0
+                total = result[0] or 0.0
+                
+                archived_before = self.archived_before(cursor)
+                if archived_before and (not start_date or start_date < archived_before):
+                    total += self.archive.get_total(user_id, start_date, end_date, archived_before)
+                return total
         except sqlite3.Error as e:
             logger.error(f"Ошибка получения общей суммы расходов: {e}")
             raise
 
-# Создаем глобальный экземпляр менеджера БД
-db_manager = DatabaseManager()
+# Глобальный экземпляр менеджера БД (создается при первом обращении)
+db_manager = LazyInstance(DatabaseManager)
 
 # Функции для обратной совместимости
 def connect_db():
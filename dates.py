@@ -0,0 +1,108 @@
+"""
+Быстрый разбор дат и арифметическая разбивка по периодам
+"""
+
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Tuple
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+PERIODS = ('day', 'week', 'month', 'year')
+CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_timestamp(value: str) -> datetime:
+    """Разбор 'YYYY-MM-DD[ HH:MM:SS]' через fromisoformat с кэшированием"""
+    return datetime.fromisoformat(value)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def epoch_day(value: str) -> int:
+    """Номер дня от 1970-01-01 по строке даты или времени"""
+    return date.fromisoformat(value[:10]).toordinal() - EPOCH_ORDINAL
+
+
+def epoch_second(value: str) -> int:
+    """Секунды от 1970-01-01 00:00:00 (без учета часового пояса)"""
+    seconds = epoch_day(value) * 86400
+    if len(value) >= 19:
+        seconds += int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])
+    return seconds
+
+
+def civil_from_days(days: int) -> Tuple[int, int, int]:
+    """(год, месяц, день) по номеру дня от эпохи без создания объектов date"""
+    days += 719468
+    era = days // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524
+                   - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_index = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * month_index + 2) // 5 + 1
+    month = month_index + 3 if month_index < 10 else month_index - 9
+    year = year_of_era + era * 400 + (1 if month <= 2 else 0)
+    return year, month, day
+
+
+def weekday(days: int) -> int:
+    """День недели (0 — понедельник); 1970-01-01 был четвергом"""
+    return (days + 3) % 7
+
+
+def bucket(days: int, period: str = "day") -> int:
+    """Целочисленный ключ периода для номера дня.
+
+    day и week — номер дня (для недели — понедельника), month — год * 12 +
+    месяц - 1, year — год.
+    """
+    if period == "week":
+        return days - weekday(days)
+    if period == "month":
+        year, month, _ = civil_from_days(days)
+        return year * 12 + month - 1
+    if period == "year":
+        return civil_from_days(days)[0]
+    return days
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def bucket_label(key: int, period: str = "day") -> str:
+    """Текстовая метка ключа периода в формате, принятом в отчетах"""
+    if period == "month":
+        return f"{key // 12:04d}-{key % 12 + 1:02d}"
+    if period == "year":
+        return f"{key:04d}"
+    year, month, day = civil_from_days(key)
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+def period_key(value: str, period: str = "day") -> str:
+    """Метка периода для строки даты (например, начало недели)"""
+    return bucket_label(bucket(epoch_day(value), period), period)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def format_timestamp(value: str) -> str:
+    """'YYYY-MM-DD HH:MM:SS' -> 'DD.MM.YYYY HH:MM' без strptime/strftime"""
+    if len(value) >= 16 and value[4] == '-' and value[7] == '-':
+        return f"{value[8:10]}.{value[5:7]}.{value[0:4]} {value[11:16]}"
+    return parse_timestamp(value).strftime("%d.%m.%Y %H:%M")
+
+
+def sql_period_key(column: str, period: str = "day") -> str:
+    """SQL-выражение SQLite, дающее ту же метку периода, что и period_key"""
+    if period == "week":
+        return (f"DATE({column}, '-' || ((CAST(strftime('%w', {column}) AS INTEGER) + 6) % 7)"
+                f" || ' days')")
+    if period == "month":
+        return f"strftime('%Y-%m', {column})"
+    if period == "year":
+        return f"strftime('%Y', {column})"
+    return f"DATE({column})"
+
+
+def sql_epoch_day(column: str) -> str:
+    """SQL-выражение номера дня от эпохи"""
+    return f"CAST(julianday(DATE({column})) - 2440587.5 AS INTEGER)"
@@ -0,0 +1,234 @@
+"""
+Виртуализированная таблица расходов с постраничной подгрузкой
+"""
+
+from tkinter import ttk
+from typing import Dict, List, Optional, Tuple
+import logging
+from database import db_manager
+from dates import format_timestamp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 200
+PREFETCH_MARGIN = 50
+LOADING_TEXT = "Загрузка…"
+
+
+class ExpenseTableModel:
+    """Строки таблицы, загружаемые страницами по ключу (date, id).
+
+    Хранит только уже просмотренные строки в отформатированном виде;
+    следующая страница запрашивается, когда окно просмотра подходит к
+    концу загруженной части, поэтому стоимость открытия не зависит от
+    размера истории.
+    """
+
+    def __init__(self, db=None, page_size: int = DEFAULT_PAGE_SIZE,
+                 filters: Optional[Dict] = None):
+        self.db_manager = db or db_manager
+        self.page_size = page_size
+        self.filters = filters or {}
+        self.reset()
+
+    def reset(self):
+        """Сброс загруженных строк (следующий запрос начнется с начала)"""
+        self.rows: List[Tuple] = []
+        self.ids: List[int] = []
+        self._first: Optional[Tuple[str, int]] = None
+        self._after: Optional[Tuple[str, int]] = None
+        self.exhausted = False
+
+    @staticmethod
+    def format_row(expense: Tuple) -> Tuple:
+        """Значения строки Treeview: дата, сумма, категория, способ оплаты"""
+        return (format_timestamp(expense[0]), f"{expense[1]:.2f} ₽", expense[2], expense[3])
+
+    @property
+    def after(self) -> Optional[Tuple[str, int]]:
+        """Ключ последней загруженной строки (с него продолжается подгрузка)"""
+        return self._after
+
+    def load_rows(self, after: Optional[Tuple[str, int]], count: int) -> Tuple[List[Tuple], bool]:
+        """Запрос не менее count строк после ключа after страницами.
+
+        Модель не меняется, поэтому метод можно вызывать в фоновом потоке;
+        результат (строки, данные закончились) применяет add_rows().
+        """
+        expenses: List[Tuple] = []
+        while True:
+            page = self.db_manager.get_expenses_page(after=after, limit=self.page_size,
+                                                     **self.filters)
+            expenses.extend(page)
+            if len(page) < self.page_size:
+                return expenses, True
+            after = (page[-1][0], page[-1][5])
+            if len(expenses) >= count:
+                return expenses, False
+
+    def add_rows(self, expenses: List[Tuple], exhausted: bool):
+        """Добавление строк, загруженных load_rows() от текущего ключа after"""
+        if expenses:
+            if self._first is None:
+                self._first = (expenses[0][0], expenses[0][5])
+            last = expenses[-1]
+            self._after = (last[0], last[5])
+            self.rows.extend(self.format_row(expense) for expense in expenses)
+            self.ids.extend(expense[5] for expense in expenses)
+        self.exhausted = self.exhausted or exhausted
+
+    def fetch_page(self) -> int:
+        """Загрузка следующей страницы; возвращает число новых строк"""
+        if self.exhausted:
+            return 0
+        expenses, exhausted = self.load_rows(self._after, 1)
+        self.add_rows(expenses, exhausted)
+        return len(expenses)
+
+    def ensure(self, count: int):
+        """Подгрузка страниц, пока не загружено count строк или данные не закончились"""
+        if len(self.rows) < count and not self.exhausted:
+            self.add_rows(*self.load_rows(self._after, count - len(self.rows)))
+
+    def prepend(self, expense: Tuple) -> bool:
+        """Добавление нового расхода в начало без перезагрузки.
+
+        Возвращает False, если расход не новее первой строки и таблицу
+        нужно перезагрузить.
+        """
+        key = (expense[0], expense[5])
+        if self._first is not None and key < self._first:
+            return False
+        if self._first is None and not self.exhausted:
+            return False
+        self._first = key
+        self.rows.insert(0, self.format_row(expense))
+        self.ids.insert(0, expense[5])
+        return True
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+class VirtualExpenseTable(ttk.Frame):
+    """Treeview с фиксированным пулом строк поверх ExpenseTableModel.
+
+    Элементы Treeview создаются один раз (по числу видимых строк), при
+    прокрутке у них меняются только значения; полоса прокрутки управляется
+    вручную по индексу первой видимой строки. С executor
+    (TkBackgroundExecutor) недостающие страницы запрашиваются в фоне, а
+    до их прихода в окне показываются строки-заглушки.
+    """
+
+    def __init__(self, parent, model: ExpenseTableModel, columns: Tuple[str, ...],
+                 height: int = 15, prefetch: int = PREFETCH_MARGIN, executor=None):
+        super().__init__(parent)
+        self.model = model
+        self.height = height
+        self.prefetch = prefetch
+        self.executor = executor
+        self.top = 0
+        self._loading = False
+        self._placeholder = (LOADING_TEXT,) + ("",) * (len(columns) - 1)
+
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", height=height,
+                                 selectmode='browse')
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=150, anchor='center')
+
+        self.scrollbar = ttk.Scrollbar(self, orient='vertical', command=self._on_scroll)
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+
+        self._pool = [self.tree.insert("", "end", values=()) for _ in range(height)]
+        self._shown: List[Tuple] = [()] * height
+
+        for widget in (self.tree, self.scrollbar):
+            widget.bind('<MouseWheel>', self._on_mousewheel)
+            widget.bind('<Button-4>', lambda event: self.scroll_by(-3))
+            widget.bind('<Button-5>', lambda event: self.scroll_by(3))
+        self.tree.bind('<Prior>', lambda event: self.scroll_by(-self.height))
+        self.tree.bind('<Next>', lambda event: self.scroll_by(self.height))
+        self.tree.bind('<Home>', lambda event: self.scroll_to(0))
+
+    def refresh(self):
+        """Перезагрузка с первой страницы"""
+        self.model.reset()
+        self.top = 0
+        self.render()
+
+    def set_model(self, model: ExpenseTableModel):
+        """Замена модели (например, загруженной в фоновом потоке)"""
+        self.model = model
+        self.top = 0
+        self.render()
+
+    def render(self):
+        """Заполнение пула строк значениями окна [top, top + height)"""
+        needed = self.top + self.height + self.prefetch
+        if len(self.model) < needed and not self.model.exhausted:
+            if self.executor is None:
+                self.model.ensure(needed)
+            else:
+                self._request_rows(needed)
+        self.top = max(0, min(self.top, self._virtual_length() - self.height))
+
+        # Обновляем только изменившиеся строки пула
+        missing = () if self.model.exhausted else self._placeholder
+        for offset, item in enumerate(self._pool):
+            index = self.top + offset
+            values = self.model.rows[index] if index < len(self.model) else missing
+            if values != self._shown[offset]:
+                self.tree.item(item, values=values)
+                self._shown[offset] = values
+
+        total = self._virtual_length()
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.height) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _request_rows(self, needed: int):
+        """Фоновая подгрузка строк до needed; одновременно выполняется один запрос"""
+        if self._loading:
+            return
+        self._loading = True
+        model, after = self.model, self.model.after
+
+        def on_loaded(result: Tuple[List[Tuple], bool]):
+            self._loading = False
+            # Модель заменена или перезагружена, пока шел запрос, — результат устарел
+            if model is self.model and model.after == after:
+                model.add_rows(*result)
+            self.render()
+
+        def on_error(error: Exception):
+            self._loading = False
+            logger.error(f"Ошибка подгрузки расходов: {error}")
+
+        self.executor.submit('table_page', model.load_rows, after, needed - len(model),
+                             on_success=on_loaded, on_error=on_error)
+
+    def _virtual_length(self) -> int:
+        # Пока данные не закончились, оставляем запас, чтобы ползунок не упирался в конец
+        total = len(self.model)
+        return total if self.model.exhausted else total + self.prefetch
+
+    def scroll_to(self, index: int):
+        self.top = max(0, index)
+        self.render()
+
+    def scroll_by(self, rows: int):
+        self.scroll_to(self.top + rows)
+
+    def _on_scroll(self, action, value=None, unit=None):
+        if action == 'moveto':
+            self.scroll_to(int(float(value) * self._virtual_length()))
+        elif action == 'scroll':
+            step = self.height if unit == 'pages' else 1
+            self.scroll_by(int(value) * step)
+
+    def _on_mousewheel(self, event):
+        self.scroll_by(-3 if event.delta > 0 else 3)
+        return "break"
@@ -0,0 +1,154 @@
+"""
+Потоковый экспорт расходов в CSV/JSON Lines со сжатием
+"""
+
+import csv
+import gzip
+import io
+import json
+import sqlite3
+import time
+from typing import Callable, Dict, Optional, TextIO, Tuple
+import logging
+from database import LazyInstance, db_manager
+
+try:
+    import zstandard
+except ImportError:  # сжатие zstd доступно только с пакетом zstandard
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ('id', 'date', 'amount', 'category', 'payment_method', 'description', 'user_id')
+FORMATS = ('csv', 'jsonl')
+COMPRESSIONS = ('gzip', 'zstd')
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def compression_from_filename(filename: str) -> Optional[str]:
+    """Сжатие по расширению файла (.gz, .zst)"""
+    if filename.endswith('.gz'):
+        return 'gzip'
+    if filename.endswith('.zst'):
+        return 'zstd'
+    return None
+
+
+class ExportError(Exception):
+    """Прерванная выгрузка; last_key — ключ последней записанной порции"""
+
+    def __init__(self, message: str, rows: int, last_key: Optional[Tuple[str, int]]):
+        super().__init__(message)
+        self.rows = rows
+        self.last_key = last_key
+
+
+class ExpenseExporter:
+    """Выгрузка расходов порциями прямо из курсора БД.
+
+    В памяти одновременно находится не больше chunk_size строк, поэтому
+    объем выгрузки не ограничен памятью. Строки идут в порядке (date, id),
+    и ключ последней записанной строки передается в progress, возвращается
+    в статистике и в ExportError при сбое, что позволяет продолжить
+    прерванную выгрузку (after=...).
+    """
+
+    def __init__(self, db=None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.db_manager = db or db_manager
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def open_output(filename: str, compression: Optional[str] = None,
+                    append: bool = False) -> TextIO:
+        """Текстовый поток для записи с учетом сжатия"""
+        mode = 'a' if append else 'w'
+        if compression == 'gzip':
+            # При дозаписи добавляется новый gzip-член, что допустимо форматом
+            return gzip.open(filename, mode + 't', encoding='utf-8', newline='')
+        if compression == 'zstd':
+            if zstandard is None:
+                raise ValueError("Для сжатия zstd требуется пакет zstandard")
+            raw = open(filename, mode + 'b')
+            writer = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+            return io.TextIOWrapper(writer, encoding='utf-8', newline='')
+        if compression:
+            raise ValueError(f"Неподдерживаемое сжатие: {compression}")
+        return open(filename, mode, encoding='utf-8', newline='')
+
+    def write(self, stream: TextIO, fmt: str = 'csv', header: bool = True,
+              user_id: Optional[int] = None,
+              start_date: Optional[str] = None,
+              end_date: Optional[str] = None,
+              category_id: Optional[int] = None,
+              after: Optional[Tuple[str, int]] = None,
+              progress: Optional[Callable[[int, float, Tuple[str, int]], None]] = None) -> Dict:
+        """Запись расходов в открытый текстовый поток; возвращает статистику.
+
+        progress(rows, seconds, last_key) вызывается после каждой порции.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Неподдерживаемый формат: {fmt}")
+
+        started = time.perf_counter()
+        rows = 0
+        last_key = after
+        writer = csv.writer(stream) if fmt == 'csv' else None
+        if writer and header:
+            writer.writerow(EXPORT_COLUMNS)
+
+        try:
+            for chunk in self.db_manager.iter_expenses(user_id, start_date, end_date, category_id,
+                                                       after=after, chunk_size=self.chunk_size):
+                if writer:
+                    writer.writerows(chunk)
+                else:
+                    stream.write("".join(
+                        json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n"
+                        for row in chunk
+                    ))
+                rows += len(chunk)
+                last_key = (chunk[-1][1], chunk[-1][0])
+                if progress:
+                    progress(rows, time.perf_counter() - started, last_key)
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Ошибка экспорта после {rows} записей (ключ {last_key}): {e}")
+            raise ExportError(f"Экспорт прерван после {rows} записей: {e}", rows, last_key) from e
+
+        seconds = time.perf_counter() - started
+        return {
+            'rows': rows,
+            'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds > 0 else 0.0,
+            'last_key': last_key
+        }
+
+    def export(self, filename: str, fmt: Optional[str] = None,
+               compression: Optional[str] = None,
+               user_id: Optional[int] = None,
+               start_date: Optional[str] = None,
+               end_date: Optional[str] = None,
+               category_id: Optional[int] = None,
+               after: Optional[Tuple[str, int]] = None,
+               progress: Optional[Callable[[int, float, Tuple[str, int]], None]] = None) -> Dict:
+        """Экспорт в файл; формат и сжатие по умолчанию определяются по имени.
+
+        При указании after данные дописываются в существующий файл (без
+        повторного заголовка CSV).
+        """
+        compression = compression or compression_from_filename(filename)
+        if fmt is None:
+            fmt = 'jsonl' if '.jsonl' in filename else 'csv'
+
+        with self.open_output(filename, compression, append=after is not None) as stream:
+            stats = self.write(stream, fmt, header=after is None, user_id=user_id,
+                               start_date=start_date, end_date=end_date,
+                               category_id=category_id, after=after, progress=progress)
+
+        stats.update({'filename': filename, 'format': fmt, 'compression': compression})
+        logger.info(f"Экспортировано {stats['rows']} записей в {filename} "
+                    f"({stats['rows_per_second']:.0f} строк/с)")
+        return stats
+
+
+# Создаем глобальный экземпляр экспортера
+expense_exporter = LazyInstance(ExpenseExporter)
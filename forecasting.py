@@ -0,0 +1,339 @@
+"""
+Прогноз расходов по истории: экспоненциальное сглаживание с недельной сезонностью
+"""
+
+import calendar
+import json
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+from changes import ChangeJournal
+from database import LazyInstance, db_manager
+
+logger = logging.getLogger(__name__)
+
+SEASON_LENGTH = 7  # недельная сезонность
+
+
+class SeriesModel:
+    """Состояние аддитивной модели Холта-Уинтерса (уровень + сезонность) для одного ряда"""
+
+    def __init__(self, level: float = 0.0, seasonal: Optional[List[float]] = None,
+                 last_day: Optional[int] = None, n_days: int = 0):
+        self.level = level
+        self.seasonal = seasonal or [0.0] * SEASON_LENGTH
+        self.last_day = last_day  # порядковый номер последнего учтенного дня
+        self.n_days = n_days
+
+    def update(self, day: int, value: float, alpha: float, gamma: float):
+        """Учет одного дня ряда"""
+        weekday = (day - 1) % SEASON_LENGTH
+        if self.n_days == 0:
+            self.level = value
+        else:
+            self.level = alpha * (value - self.seasonal[weekday]) + (1 - alpha) * self.level
+            self.seasonal[weekday] = gamma * (value - self.level) + (1 - gamma) * self.seasonal[weekday]
+        self.last_day = day
+        self.n_days += 1
+
+    def predict(self, day: int) -> float:
+        """Прогноз на день (неотрицательный)"""
+        return max(0.0, self.level + self.seasonal[(day - 1) % SEASON_LENGTH])
+
+
+class ForecastEngine:
+    """Модели по пользователям и категориям с кэшированием состояния.
+
+    Состояние хранится в таблице forecast_models; update() догоняет модели
+    только по новым завершенным дням одним сгруппированным запросом,
+    без повторного обучения на всей истории. Расходы, добавленные,
+    измененные или удаленные задним числом (в уже учтенные дни), update()
+    находит по журналу изменений (потребитель 'forecast') и переобучает
+    только затронутые модели пользователь/категория. Модели, обучаемые
+    заново, учитывают и дни, перенесенные в архив (archive.py).
+    """
+
+    CONSUMER = 'forecast'
+    JOURNAL_CHECK_INTERVAL = 1.0  # секунд
+
+    def __init__(self, db=None, alpha: float = 0.1, gamma: float = 0.2):
+        self.db_manager = db or db_manager
+        self.journal = ChangeJournal(self.db_manager)
+        self.alpha = alpha
+        self.gamma = gamma
+        self._lock = threading.Lock()
+        self._models: Dict[Tuple[int, int], SeriesModel] = {}
+        self._models_by_user: Dict[int, List[Tuple[Tuple[int, int], SeriesModel]]] = {}
+        self._updated_for: Optional[date] = None
+        self._journal_checked = float('-inf')
+        self.read_only = False
+        self._reset_keys: set = set()
+        self._category_names: Dict[int, str] = {}
+        self._ensure_tables()
+
+    def _ensure_tables(self):
+        """Создание таблицы состояния моделей"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS forecast_models (
+                        user_id INTEGER NOT NULL,
+                        category_id INTEGER NOT NULL,
+                        level REAL NOT NULL,
+                        seasonal TEXT NOT NULL,
+                        last_day TEXT NOT NULL,
+                        n_days INTEGER NOT NULL,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (user_id, category_id)
+                    )
+                ''')
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка создания таблицы прогнозных моделей: {e}")
+            raise
+
+    def _load_models(self, cursor: sqlite3.Cursor) -> Dict[Tuple[int, int], SeriesModel]:
+        cursor.execute('SELECT user_id, category_id, level, seasonal, last_day, n_days FROM forecast_models')
+        return {
+            (row[0], row[1]): SeriesModel(row[2], json.loads(row[3]),
+                                          date.fromisoformat(row[4]).toordinal(), row[5])
+            for row in cursor.fetchall()
+        }
+
+    def update(self, as_of: Optional[date] = None) -> int:
+        """Дообучение моделей на завершенных днях до as_of (не включая). Возвращает число обработанных дней"""
+        as_of = as_of or date.today()
+        last_complete = as_of.toordinal() - 1
+
+        with self._lock:
+            self._reset_keys = set()
+            self.journal.apply(self.CONSUMER, self._reset_backdated)
+            try:
+                with self.db_manager.connect_db() as conn:
+                    cursor = conn.cursor()
+                    models = self._load_models(cursor)
+
+                    query = '''
+                        SELECT user_id, category_id, DATE(date), SUM(amount)
+                        FROM expenses
+                        WHERE DATE(date) < ?
+                    '''
+                    params = [as_of.isoformat()]
+                    if models:
+                        # Новые и сброшенные модели обучаются на всей истории
+                        since = min(model.last_day for model in models.values())
+                        query += '''
+                            AND (DATE(date) > ? OR (user_id, category_id) NOT IN
+                                 (SELECT user_id, category_id FROM forecast_models))
+                        '''
+                        params.append(date.fromordinal(since).isoformat())
+                    query += " GROUP BY 1, 2, 3"
+                    cursor.execute(query, params)
+
+                    observed = defaultdict(dict)
+                    for user_id, category_id, day, total in cursor.fetchall():
+                        observed[(user_id, category_id)][date.fromisoformat(day).toordinal()] = total
+
+                    # История до границы архива нужна моделям, обучаемым заново
+                    # (первое обучение, refit, сброс после правки задним числом)
+                    if not models or self._reset_keys:
+                        for key, days in self._archived_days(cursor, as_of).items():
+                            if key not in models:
+                                values = observed[key]
+                                for day, total in days.items():
+                                    values[day] = values.get(day, 0.0) + total
+
+                    processed = 0
+                    changed = set()
+                    for key in set(models) | set(observed):
+                        model = models.get(key)
+                        values = observed.get(key, {})
+                        if model is None:
+                            model = models[key] = SeriesModel()
+                            start = min(values)
+                        else:
+                            start = model.last_day + 1
+                        for day in range(start, last_complete + 1):
+                            model.update(day, values.get(day, 0.0), self.alpha, self.gamma)
+                            processed += 1
+                            changed.add(key)
+
+                    # Сохраняются только дообученные модели (без новых дней запись не нужна)
+                    if changed:
+                        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        cursor.executemany('''
+                            INSERT OR REPLACE INTO forecast_models
+                                (user_id, category_id, level, seasonal, last_day, n_days, updated_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ''', [
+                            (user_id, category_id, model.level, json.dumps(model.seasonal),
+                             date.fromordinal(model.last_day).isoformat(), model.n_days, now)
+                            for (user_id, category_id), model in models.items()
+                            if (user_id, category_id) in changed
+                        ])
+                        conn.commit()
+                    self._set_models(models)
+                    self._updated_for = as_of
+                    return processed
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка обновления прогнозных моделей: {e}")
+                raise
+
+    def _archived_days(self, cursor: sqlite3.Cursor, as_of: date) -> Dict[Tuple[int, int], Dict[int, float]]:
+        """Суммы архивных расходов по (пользователь, категория) и дням до as_of"""
+        before = self.db_manager.archived_before(cursor)
+        if not before:
+            return {}
+        days: Dict[Tuple[int, int], Dict[int, float]] = defaultdict(lambda: defaultdict(float))
+        last_day = date.fromordinal(as_of.toordinal() - 1).isoformat()
+        for row in self.db_manager.archive.get_rows(end_date=last_day, before=before):
+            days[(row[1], row[2])][date.fromisoformat(row[6][:10]).toordinal()] += row[4]
+        return days
+
+    def _reset_backdated(self, cursor: sqlite3.Cursor, changes: List[Dict]):
+        """Сброс моделей, в уже учтенные дни которых попали изменения журнала.
+
+        Перенос в архив модели не затрагивает: дни давно учтены.
+        """
+        cursor.execute('SELECT user_id, category_id, last_day FROM forecast_models')
+        last_days = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+        stale = set()
+        for change in changes:
+            if change['op'] == 'archive':
+                continue
+            for expense in (change['old'], change['new']):
+                if expense:
+                    key = (expense['user_id'], expense['category_id'])
+                    if key in last_days and expense['date'][:10] <= last_days[key]:
+                        stale.add(key)
+        if stale:
+            self._reset_keys.update(stale)
+            cursor.executemany('DELETE FROM forecast_models WHERE user_id = ? AND category_id = ?',
+                               sorted(stale))
+            logger.info(f"Сброшены модели с изменениями задним числом: {len(stale)}")
+
+    def _journal_pending(self) -> bool:
+        """Новые изменения журнала; проверяется не чаще JOURNAL_CHECK_INTERVAL
+        (forecast_month вызывается для каждого пользователя подряд)"""
+        checked = time.monotonic()
+        if checked - self._journal_checked < self.JOURNAL_CHECK_INTERVAL:
+            return False
+        self._journal_checked = checked
+        return self.journal.has_pending(self.CONSUMER)
+
+    def load(self, as_of: date):
+        """Прогноз только по сохраненным моделям, без дообучения и записи.
+
+        Для процессов пула пакетной проверки: модели на as_of уже обновил
+        родительский процесс, а update() в каждом процессе конкурировал бы
+        за блокировку записи.
+        """
+        with self._lock:
+            try:
+                with self.db_manager.connect_db() as conn:
+                    self._set_models(self._load_models(conn.cursor()))
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка загрузки прогнозных моделей: {e}")
+                raise
+            self._updated_for = as_of
+            self.read_only = True
+
+    def refit(self, as_of: Optional[date] = None) -> int:
+        """Полное переобучение (например, после правки старых расходов)"""
+        with self._lock:
+            with self.db_manager.connect_db() as conn:
+                conn.execute('DELETE FROM forecast_models')
+                conn.commit()
+            self._set_models({})
+            self._updated_for = None
+        return self.update(as_of)
+
+    def _set_models(self, models: Dict[Tuple[int, int], SeriesModel]):
+        """Кэш моделей с индексом по пользователю"""
+        by_user = defaultdict(list)
+        for key, model in models.items():
+            by_user[key[0]].append((key, model))
+        self._models = models
+        self._models_by_user = dict(by_user)
+
+    def _user_models(self, user_id: Optional[int]) -> List[Tuple[Tuple[int, int], SeriesModel]]:
+        if user_id:
+            return self._models_by_user.get(user_id, [])
+        return list(self._models.items())
+
+    def _category_name(self, cursor: sqlite3.Cursor, category_id: int) -> str:
+        if category_id not in self._category_names:
+            cursor.execute('SELECT id, name FROM categories')
+            self._category_names = {row[0]: row[1] for row in cursor.fetchall()}
+        return self._category_names.get(category_id, str(category_id))
+
+    def forecast_month(self, user_id: Optional[int] = None,
+                       as_of: Optional[date] = None,
+                       spent: Optional[Dict[str, float]] = None) -> Dict:
+        """Прогноз расходов на текущий месяц по категориям.
+
+        spent — уже посчитанные траты месяца по категориям (например, из
+        снимка NotificationManager); без него они запрашиваются из БД.
+        Модели дообучаются при смене дня или новых записях журнала
+        (журнал проверяется не чаще раза в JOURNAL_CHECK_INTERVAL секунд).
+        """
+        as_of = as_of or date.today()
+        if not self.read_only and (self._updated_for != as_of or self._journal_pending()):
+            self.update(as_of)
+
+        days_in_month = calendar.monthrange(as_of.year, as_of.month)[1]
+        month_start = as_of.replace(day=1)
+        remaining = range(as_of.toordinal() + 1, as_of.toordinal() + days_in_month - as_of.day + 1)
+
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                if spent is None:
+                    query = '''
+                        SELECT c.name, SUM(e.amount)
+                        FROM expenses e
+                        JOIN categories c ON e.category_id = c.id
+                    '''
+                    conditions, params = self.db_manager.build_expense_filters(
+                        user_id, month_start.isoformat(), as_of.isoformat(), alias='e'
+                    )
+                    query += " WHERE " + " AND ".join(conditions) + " GROUP BY c.name"
+                    cursor.execute(query, params)
+                    spent = {name: total for name, total in cursor.fetchall()}
+
+                expected = defaultdict(float)
+                for (model_user_id, category_id), model in self._user_models(user_id):
+                    expected[self._category_name(cursor, category_id)] += sum(
+                        model.predict(day) for day in remaining
+                    )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка расчета прогноза: {e}")
+            raise
+
+        by_category = {}
+        for category in set(spent) | set(expected):
+            category_spent = spent.get(category, 0.0)
+            by_category[category] = {
+                'spent': category_spent,
+                'forecast': category_spent + expected.get(category, 0.0)
+            }
+
+        total_spent = sum(spent.values())
+        return {
+            'total_spent': total_spent,
+            'forecast': sum(item['forecast'] for item in by_category.values()),
+            'daily_average': total_spent / as_of.day,
+            'days_passed': as_of.day,
+            'days_remaining': days_in_month - as_of.day,
+            'days_in_month': days_in_month,
+            'by_category': by_category
+        }
+
+
+# Создаем глобальный экземпляр движка прогнозов
+forecast_engine = LazyInstance(ForecastEngine)
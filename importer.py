@@ -0,0 +1,392 @@
+"""
+Импорт банковских выписок (CSV и OFX) с параллельным разбором и дедупликацией
+"""
+
+import csv
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+from config import IMPORT_CONFIG, VALIDATION_CONFIG
+from database import LazyInstance, db_manager
+from utils import validate_amount, validate_category
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'ofx')
+MAX_REPORTED_ERRORS = 100
+HASH_QUERY_BATCH = 500
+
+OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|$)', re.S | re.I)
+OFX_FIELD = re.compile(r'<(TRNTYPE|DTPOSTED|TRNAMT|NAME|MEMO)>([^<\r\n]*)', re.I)
+
+
+def _parse_date(value: str, formats: List[str], cache: Dict[str, Optional[str]]) -> Optional[str]:
+    """Дата операции в формате БД; результаты кэшируются в пределах порции"""
+    if value in cache:
+        return cache[value]
+    result = None
+    text = value.strip()
+    try:
+        result = datetime.fromisoformat(text).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        # OFX: 20240115120000[-3:MSK]
+        text = text.split('[', 1)[0]
+        for fmt in formats:
+            try:
+                result = datetime.strptime(text, fmt).strftime("%Y-%m-%d %H:%M:%S")
+                break
+            except ValueError:
+                continue
+    cache[value] = result
+    return result
+
+
+def _match_category(description: str, settings: Dict, cache: Dict) -> str:
+    key = ('category', description)
+    if key not in cache:
+        lowered = description.lower()
+        cache[key] = next((category for keyword, category in settings['merchants'] if keyword in lowered),
+                          settings['default_category'])
+    return cache[key]
+
+
+def _row_hash(user_id: int, row: Tuple) -> bytes:
+    """Хэш содержимого операции (без номера повтора)"""
+    date, amount, description, _ = row
+    key = f"{user_id}|{date}|{amount:.2f}|{description.lower()}"
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+
+def _amount_text(amount_raw: str) -> str:
+    return (amount_raw or '').replace('\xa0', '').replace(' ', '').replace(',', '.')
+
+
+def _is_number(text: str) -> bool:
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _normalize_row(line_no: int, date_raw: str, amount_raw: str, description: str,
+                   category: str, settings: Dict, cache: Dict,
+                   direction: Optional[str] = None) -> Tuple[Optional[Tuple], Optional[str]]:
+    """Проверка одной операции: (date, amount, description, category) или текст ошибки.
+
+    Поступления пропускаются (None, None) до проверки полей: по колонке
+    направления, если она есть, иначе в выписке со знаком
+    (settings['signed']) — положительные суммы.
+    """
+    amount_text = _amount_text(amount_raw)
+    if direction is not None:
+        if direction.strip().lower() in settings['credit_types']:
+            return None, None
+    elif settings.get('signed') and not amount_text.startswith('-') and _is_number(amount_text):
+        return None, None
+
+    date = _parse_date(date_raw or '', settings['date_formats'], cache)
+    if date is None:
+        return None, f"Строка {line_no}: некорректная дата '{date_raw}'"
+
+    # В выписках списания отрицательные; расход хранится положительной суммой
+    ok, amount, message = validate_amount(amount_text.lstrip('-+'))
+    if not ok:
+        return None, f"Строка {line_no}: {message}"
+
+    description = (description or '').strip()[:settings['max_description_length']]
+    category = (category or '').strip() or _match_category(description, settings, cache)
+    ok, message = validate_category(category)
+    if not ok:
+        return None, f"Строка {line_no}: {message}"
+    return (date, round(amount, 2), description, category), None
+
+
+def _parse_csv_chunk(text: str, start_line: int, delimiter: str, columns: Dict[str, int],
+                     settings: Dict) -> Tuple[List[Tuple], List[bytes], List[str], List[int], bool]:
+    """Разбор и проверка порции CSV (выполняется в пуле).
+
+    Возвращает операции, их хэши, ошибки, номера ошибок в строках с
+    положительной суммой и признак отрицательных сумм в порции. Без колонки
+    направления знак определяется по порции: если в ней есть отрицательные
+    суммы, положительные — поступления. Порцию без отрицательных сумм
+    родитель сверяет с остальными (см. StatementImporter.parse_file).
+    """
+    rows, hashes, errors, positive_errors, cache = [], [], [], [], {}
+    indexes = [columns.get(name) for name in ('date', 'amount', 'description', 'category')]
+    direction_index = columns.get('direction')
+    width = max(index for index in indexes + [direction_index] if index is not None) + 1
+    records = []
+    for offset, record in enumerate(csv.reader(text.splitlines(), delimiter=delimiter)):
+        if record:
+            records.append((offset, record + [''] * (width - len(record))))
+
+    detect_sign = direction_index is None
+    has_negative = detect_sign and any(
+        _amount_text(record[columns['amount']]).startswith('-') for _, record in records)
+    if detect_sign:
+        settings = dict(settings, signed=has_negative)
+    for offset, record in records:
+        date_raw, amount_raw, description, category = (
+            record[index] if index is not None else '' for index in indexes)
+
+        row, error = _normalize_row(start_line + offset, date_raw, amount_raw, description, category,
+                                    settings, cache,
+                                    record[direction_index] if direction_index is not None else None)
+        if row:
+            rows.append(row)
+            hashes.append(_row_hash(settings['user_id'], row))
+        elif error:
+            if detect_sign and not has_negative and _is_number(_amount_text(amount_raw)):
+                positive_errors.append(len(errors))
+            errors.append(error)
+    return rows, hashes, errors, positive_errors, has_negative
+
+
+def _parse_ofx_chunk(blocks: List[str], start_index: int,
+                     settings: Dict) -> Tuple[List[Tuple], List[bytes], List[str], List[int], bool]:
+    """Разбор порции операций OFX (выполняется в пуле): операции, их хэши и
+    ошибки; направление задает TRNTYPE, знак сумм не сверяется"""
+    rows, hashes, errors, cache = [], [], [], {}
+    for offset, block in enumerate(blocks):
+        fields = {name.upper(): value.strip() for name, value in OFX_FIELD.findall(block)}
+        description = fields.get('NAME') or fields.get('MEMO', '')
+        row, error = _normalize_row(start_index + offset, fields.get('DTPOSTED', ''),
+                                    fields.get('TRNAMT', ''), description, '', settings, cache,
+                                    fields.get('TRNTYPE', ''))
+        if row:
+            rows.append(row)
+            hashes.append(_row_hash(settings['user_id'], row))
+        elif error:
+            errors.append(error)
+    return rows, hashes, errors, [], False
+
+
+class StatementImporter:
+    """Импорт выписок: параллельный разбор порциями, пакетная проверка и запись.
+
+    Файл читается порциями по chunk_size строк (операций), которые
+    разбираются, проверяются и хэшируются в пуле процессов (при одном
+    процессоре — в текущем процессе). Каждой операции
+    сопоставляется хэш содержимого (пользователь, дата, сумма, описание и
+    номер повтора в файле); хэши хранятся в таблице import_hashes, поэтому
+    повторный импорт того же файла не создает дубликатов. Запись расходов и
+    хэшей выполняется одной транзакцией.
+    """
+
+    def __init__(self, db=None, workers: int = None, executor: str = 'process',
+                 chunk_size: int = None):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Неподдерживаемый тип исполнителя: {executor}")
+        self.db_manager = db or db_manager
+        self.workers = workers or min(IMPORT_CONFIG['workers'], os.cpu_count() or 1)
+        self.executor = executor
+        self.chunk_size = chunk_size or IMPORT_CONFIG['chunk_size']
+        self._ensure_tables()
+
+    def _ensure_tables(self):
+        """Создание индекса хэшей импортированных операций"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS import_hashes (
+                        hash BLOB PRIMARY KEY,
+                        user_id INTEGER NOT NULL,
+                        source TEXT,
+                        imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    ) WITHOUT ROWID
+                ''')
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка создания таблицы хэшей импорта: {e}")
+            raise
+
+    @staticmethod
+    def _settings(user_id: int) -> Dict:
+        merchants = sorted(((keyword.lower(), category)
+                            for keyword, category in IMPORT_CONFIG['merchant_categories'].items()),
+                           key=lambda item: len(item[0]), reverse=True)
+        return {
+            'user_id': user_id,
+            'merchants': merchants,
+            'default_category': IMPORT_CONFIG['default_category'],
+            'credit_types': set(IMPORT_CONFIG['credit_types']),
+            'date_formats': IMPORT_CONFIG['date_formats'],
+            'max_description_length': VALIDATION_CONFIG['max_description_length']
+        }
+
+    @staticmethod
+    def detect_format(filename: str) -> str:
+        lowered = filename.lower()
+        return 'ofx' if lowered.endswith(('.ofx', '.qfx')) else 'csv'
+
+    def parse_file(self, filename: str, fmt: Optional[str] = None,
+                   user_id: int = 0) -> Tuple[List[Tuple], List[bytes], List[str], int]:
+        """Разбор файла: (операции, хэши операций, ошибки, прочитано записей)"""
+        fmt = fmt or self.detect_format(filename)
+        if fmt not in FORMATS:
+            raise ValueError(f"Неподдерживаемый формат: {fmt}")
+        settings = self._settings(user_id)
+
+        with open(filename, encoding='utf-8-sig', newline='') as f:
+            if fmt == 'ofx':
+                blocks = OFX_TRANSACTION.findall(f.read())
+                results = self._map_chunks(
+                    (_parse_ofx_chunk, blocks[i:i + self.chunk_size], i + 1, settings)
+                    for i in range(0, len(blocks), self.chunk_size))
+                read = len(blocks)
+            else:
+                header_line = f.readline()
+                if not header_line:
+                    return [], [], [], 0
+                delimiter = csv.Sniffer().sniff(header_line, delimiters=',;\t').delimiter
+                header = [name.strip().lower() for name in next(csv.reader([header_line], delimiter=delimiter))]
+                columns = {}
+                for name, aliases in IMPORT_CONFIG['csv_columns'].items():
+                    for alias in aliases:
+                        if alias in header:
+                            columns[name] = header.index(alias)
+                            break
+                missing = [name for name in ('date', 'amount') if name not in columns]
+                if missing:
+                    raise ValueError(f"В файле нет колонок: {', '.join(missing)}")
+
+                # Порции читаются из файла по строкам (многострочные поля в кавычках
+                # в выписках не используются) и передаются в пул одной строкой
+                read = 0
+
+                def chunks() -> Iterator[Tuple]:
+                    nonlocal read
+                    while True:
+                        lines = list(islice(f, self.chunk_size))
+                        if not lines:
+                            return
+                        yield (_parse_csv_chunk, "".join(lines), read + 2, delimiter, columns, settings)
+                        read += len(lines)
+
+                results = self._map_chunks(chunks())
+
+        # Без колонки направления: если в выписке есть отрицательные суммы,
+        # списания — отрицательные, а положительные суммы — поступления, в том
+        # числе в порциях, где отрицательных сумм не было. Выгрузка только
+        # расходов (все суммы положительные) импортируется целиком
+        signed = any(has_negative for *_, has_negative in results)
+        rows, hashes, errors = [], [], []
+        for chunk_rows, chunk_hashes, chunk_errors, positive_errors, has_negative in results:
+            if signed and not has_negative:
+                skipped = set(positive_errors)
+                errors.extend(error for i, error in enumerate(chunk_errors) if i not in skipped)
+                continue
+            rows.extend(chunk_rows)
+            hashes.extend(chunk_hashes)
+            errors.extend(chunk_errors)
+        return rows, self.number_repeats(hashes), errors, read
+
+    def _map_chunks(self, tasks: Iterable[Tuple]) -> List[Tuple]:
+        """Разбор порций по порядку; в пуле одновременно не больше 2 * workers порций.
+
+        Одна порция или один исполнитель — разбор в текущем процессе.
+        """
+        tasks = iter(tasks)
+        head = list(islice(tasks, 2))
+        if len(head) <= 1 or self.workers <= 1:
+            return [task[0](*task[1:]) for task in chain(head, tasks)]
+
+        pool_class = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+        results = []
+        with pool_class(max_workers=self.workers) as pool:
+            pending = deque()
+            for task in chain(head, tasks):
+                pending.append(pool.submit(*task))
+                if len(pending) >= 2 * self.workers:
+                    results.append(pending.popleft().result())
+            results.extend(future.result() for future in pending)
+        return results
+
+    @staticmethod
+    def number_repeats(hashes: List[bytes]) -> List[bytes]:
+        """Различение одинаковых операций в одном файле по номеру повтора"""
+        seen = Counter()
+        numbered = []
+        for row_hash in hashes:
+            seen[row_hash] += 1
+            count = seen[row_hash]
+            numbered.append(row_hash if count == 1 else hashlib.blake2b(
+                row_hash + count.to_bytes(4, 'big'), digest_size=16).digest())
+        return numbered
+
+    def import_file(self, filename: str, user_id: Optional[int] = None,
+                    fmt: Optional[str] = None,
+                    payment_method: Optional[str] = None) -> Dict:
+        """Импорт выписки; повторный запуск пропускает уже импортированные операции"""
+        started = time.perf_counter()
+        user_id = user_id or self.db_manager.get_user_id("default_user") or \
+            self.db_manager.add_user("default_user")
+        payment_method = payment_method or IMPORT_CONFIG['default_payment_method']
+
+        rows, hashes, errors, read = self.parse_file(filename, fmt, user_id)
+        parsed = time.perf_counter()
+
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                existing = set()
+                for i in range(0, len(hashes), HASH_QUERY_BATCH):
+                    batch = hashes[i:i + HASH_QUERY_BATCH]
+                    cursor.execute(
+                        f"SELECT hash FROM import_hashes WHERE hash IN ({','.join('?' * len(batch))})", batch)
+                    existing.update(row[0] for row in cursor.fetchall())
+
+                new = [(row, row_hash) for row, row_hash in zip(rows, hashes) if row_hash not in existing]
+
+                cursor.executemany('INSERT OR IGNORE INTO categories (name) VALUES (?)',
+                                   [(name,) for name in {row[3] for row, _ in new}])
+                cursor.execute('INSERT OR IGNORE INTO payment_methods (method_name) VALUES (?)',
+                               (payment_method,))
+                cursor.execute('SELECT name, id FROM categories')
+                category_ids = {name: category_id for name, category_id in cursor.fetchall()}
+                cursor.execute('SELECT id FROM payment_methods WHERE method_name = ?', (payment_method,))
+                payment_method_id = cursor.fetchone()[0]
+
+                imported = self.db_manager._insert_expenses_bulk(cursor, [
+                    (user_id, category_ids[category], payment_method_id, amount, description, date)
+                    for (date, amount, description, category), _ in new
+                ])
+                # Вставка в порядке ключа быстрее случайной
+                cursor.executemany('INSERT OR IGNORE INTO import_hashes (hash, user_id, source) VALUES (?, ?, ?)',
+                                   [(row_hash, user_id, filename) for row_hash in sorted(h for _, h in new)])
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи импортированных операций: {e}")
+            raise
+
+        finished = time.perf_counter()
+        seconds = finished - started
+        result = {
+            'filename': filename,
+            'read': read,
+            'imported': imported,
+            'duplicates': len(rows) - len(new),
+            'invalid': len(errors),
+            'errors': errors[:MAX_REPORTED_ERRORS],
+            'parse_seconds': parsed - started,
+            'write_seconds': finished - parsed,
+            'seconds': seconds,
+            'rows_per_second': read / seconds if seconds > 0 else 0.0
+        }
+        logger.info(f"Импорт {filename}: добавлено {imported}, дубликатов {result['duplicates']}, "
+                    f"ошибок {len(errors)} за {seconds:.2f} с")
+        return result
+
+
+# Создаем глобальный экземпляр импортера
+statement_importer = LazyInstance(StatementImporter)
@@ -0,0 +1,167 @@
+"""
+Инкрементальная проверка лимитов расходов при каждом изменении
+"""
+
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+import logging
+from database import LazyInstance, db_manager
+from dates import period_key
+from notifications import notification_manager, NotificationManager
+
+logger = logging.getLogger(__name__)
+
+
+class LimitTracker:
+    """Счетчики расходов текущего месяца по категориям, дням и неделям.
+
+    Счетчики загружаются одним сгруппированным запросом и затем
+    обновляются за O(1) на каждый add_expense/delete_expense. Наружу
+    выдаются только впервые пересеченные пороги; при смене месяца
+    состояние сбрасывается.
+    """
+
+    def __init__(self, db=None, limits: Dict[str, float] = None,
+                 daily_limit: float = None, weekly_limit: float = None,
+                 user_id: Optional[int] = None):
+        self.db_manager = db or db_manager
+        self.limits = limits or notification_manager.default_limits
+        self.daily_limit = daily_limit or notification_manager.daily_limit
+        self.weekly_limit = weekly_limit or notification_manager.weekly_limit
+        self.user_id = user_id
+
+        self._lock = threading.Lock()
+        self._category_names: Dict[int, str] = {}
+        self._pending: List[str] = []
+        self.period: Optional[str] = None
+        self._reset(datetime.now().strftime("%Y-%m"))
+
+        self.db_manager.add_listener(self._on_expense_change)
+
+    def _reset(self, period: str):
+        """Загрузка счетчиков за период (YYYY-MM) одним запросом"""
+        self.period = period
+        self.category_totals = defaultdict(float)
+        self.daily_totals = defaultdict(float)
+        self.weekly_totals = defaultdict(float)
+        self._levels: Dict[tuple, int] = {}
+
+        query = '''
+            SELECT c.name, DATE(e.date), SUM(e.amount)
+            FROM expenses e
+            JOIN categories c ON e.category_id = c.id
+        '''
+        conditions, params = self.db_manager.build_expense_filters(
+            self.user_id, f"{period}-01", f"{period}-31", alias='e'
+        )
+        query += " WHERE " + " AND ".join(conditions) + " GROUP BY 1, 2"
+
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                for category, day, total in cursor.fetchall():
+                    self.category_totals[category] += total
+                    self.daily_totals[day] += total
+                    self.weekly_totals[self._week_key(day)] += total
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка загрузки счетчиков лимитов: {e}")
+            raise
+
+        # Уже пересеченные пороги считаются сообщенными
+        for category, total in self.category_totals.items():
+            self._levels[('category', category)] = self._category_level(category, total)
+        for day, total in self.daily_totals.items():
+            self._levels[('day', day)] = int(total > self.daily_limit)
+        for week, total in self.weekly_totals.items():
+            self._levels[('week', week)] = int(total > self.weekly_limit)
+
+    @staticmethod
+    def _week_key(day: str) -> str:
+        return period_key(day, "week")
+
+    def _category_level(self, category: str, total: float) -> int:
+        limit = self.limits.get(category)
+        return NotificationManager.limit_level(total, limit) if limit else 0
+
+    def _category_name(self, category_id: int, cursor: sqlite3.Cursor) -> str:
+        if category_id not in self._category_names:
+            cursor.execute('SELECT name FROM categories WHERE id = ?', (category_id,))
+            row = cursor.fetchone()
+            self._category_names[category_id] = row[0] if row else ''
+        return self._category_names[category_id]
+
+    def _on_expense_change(self, event: str, expenses: List[Dict], cursor: sqlite3.Cursor):
+        """Обработка вставки или удаления расходов"""
+        with self._lock:
+            for expense in expenses:
+                if not self.user_id or expense['user_id'] == self.user_id:
+                    self._apply(event, expense, cursor)
+
+    def _apply(self, event: str, expense: Dict, cursor: sqlite3.Cursor):
+        date = expense['date']
+        period, day = date[:7], date[:10]
+        if period > self.period and event == 'insert':
+            # Незафиксированная запись не видна при загрузке и учитывается ниже
+            self._pending.clear()
+            self._reset(period)
+        if period != self.period:
+            return
+
+        category = self._category_name(expense['category_id'], cursor)
+        week = self._week_key(day)
+        sign = 1 if event == 'insert' else -1
+        amount = sign * expense['amount']
+
+        self.category_totals[category] += amount
+        self.daily_totals[day] += amount
+        self.weekly_totals[week] += amount
+
+        self._update_level(('category', category),
+                           self._category_level(category, self.category_totals[category]),
+                           lambda: NotificationManager.format_limit_warning(
+                               category, self.category_totals[category], self.limits[category]))
+        self._update_level(('day', day), int(self.daily_totals[day] > self.daily_limit),
+                           lambda: NotificationManager.format_daily_warning(
+                               day, self.daily_totals[day]))
+        self._update_level(('week', week), int(self.weekly_totals[week] > self.weekly_limit),
+                           lambda: NotificationManager.format_weekly_warning(
+                               week, self.weekly_totals[week]))
+
+    def _update_level(self, key: tuple, level: int, message):
+        """Фиксация уровня; сообщение только при повышении"""
+        previous = self._levels.get(key, 0)
+        self._levels[key] = level
+        if level > previous:
+            self._pending.append(message())
+
+    def pop_new_warnings(self) -> List[str]:
+        """Новые предупреждения с момента последнего вызова"""
+        with self._lock:
+            current_period = datetime.now().strftime("%Y-%m")
+            if current_period != self.period:
+                self._pending.clear()
+                self._reset(current_period)
+            warnings, self._pending = self._pending, []
+            return warnings
+
+    def current_warnings(self) -> List[str]:
+        """Все активные предупреждения периода по текущим счетчикам"""
+        with self._lock:
+            warnings = []
+            for category, total in self.category_totals.items():
+                if self._category_level(category, total):
+                    warnings.append(NotificationManager.format_limit_warning(
+                        category, total, self.limits[category]))
+            warnings.extend(NotificationManager.format_daily_warning(day, total)
+                            for day, total in self.daily_totals.items() if total > self.daily_limit)
+            warnings.extend(NotificationManager.format_weekly_warning(week, total)
+                            for week, total in self.weekly_totals.items() if total > self.weekly_limit)
+            return warnings
+
+
+# Создаем глобальный экземпляр счетчиков лимитов
+limit_tracker = LazyInstance(LimitTracker)
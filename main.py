@@ -1,17 +1,43 @@
 import tkinter as tk
 from tkinter import messagebox, ttk, font
-from datetime import datetime
+import argparse
+import time
+import logging
 import tkinter.font as tkFont
 from database import (
-    create_tables, add_user, add_category, add_payment_method,
+    add_user, add_category, add_payment_method,
     get_user_id, get_category_id, get_payment_method_id,
-    add_expense_to_db, get_expenses, get_all_payment_methods
+    add_expense_to_db, get_all_payment_methods
 )
-from notifications import check_spending_limits
-from reports import generate_monthly_report
+from expense_table import ExpenseTableModel, VirtualExpenseTable
+from background import RefreshScheduler, TkBackgroundExecutor
+from store import expense_store
+from config import REPORT_CONFIG
+from metrics import configure_logging, metrics
+from profiling import profiled, profiler
+
+logger = logging.getLogger(__name__)
+
+# Отложенный запуск фоновых сервисов после показа окна (мс)
+SERVICES_START_DELAY_MS = 500
+
+
+def load_services():
+    """Импорт модулей уведомлений, лимитов и отчетов.
+    
+    Модули регистрируют слушателей изменений расходов, поэтому импорт
+    должен произойти до первой вставки; повторный вызов ничего не стоит.
+    """
+    import limits
+    import anomalies
+    import scheduler
+    return limits.limit_tracker, anomalies.anomaly_detector, scheduler.report_scheduler
+
 
 class ModernExpenseTracker:
     def __init__(self, root):
+        self.started_at = time.perf_counter()
+        self.startup_timings = {}
         self.root = root
         self.root.title("💰 Трекер расходов")
         self.root.geometry("900x700")
@@ -19,15 +45,53 @@ class ModernExpenseTracker:
         
         # Настройка стилей
         self.setup_styles()
+        self._mark_startup('styles')
         
         # Инициализация базы данных
         self.init_database()
-        
-        # Создание интерфейса
+        self._mark_startup('database')
+        
+        # Фоновое выполнение запросов к БД и генерации отчетов
+        self.executor = TkBackgroundExecutor(self.root)
+        self.executor.on_busy_change = self.on_busy_change
+        
+        # Объединение обновлений виджетов; скрытые вкладки обновляются при показе
+        self.refresher = RefreshScheduler(self.root, is_visible=lambda tab: self.notebook.select() == tab)
+        self._table_reload = False
+        
+        # Агрегаты расходов, обновляемые по каждому изменению
+        self.store = expense_store
+        self.store.subscribe(
+            lambda event, expense: self.executor.call_in_main(self.on_store_change, event, expense)
+        )
+        
+        # Создание интерфейса (содержимое вкладок строится при первом показе)
+        self.expenses_table = None
+        self.stats_text = None
+        self.general_stats_text = None
         self.create_widgets()
+        self._mark_startup('widgets')
         
         # Загрузка данных
-        self.load_expenses()
+        self.refresh_stats()
+        
+        # Сервисы уведомлений и отчетов загружаются после показа окна
+        self.root.after(SERVICES_START_DELAY_MS, self.start_services)
+
+    def _mark_startup(self, phase):
+        """Фиксация длительности этапа запуска (секунды от начала)"""
+        self.startup_timings[phase] = time.perf_counter() - self.started_at
+        metrics.observe(f"startup.{phase}", self.startup_timings[phase])
+
+    def start_services(self):
+        """Фоновая загрузка модулей уведомлений и запуск планировщика отчетов"""
+        def on_loaded(services):
+            self._mark_startup('services')
+            # Фоновая генерация отчетов
+            if REPORT_CONFIG.get('auto_generate_monthly'):
+                services[2].start()
+        
+        self.executor.submit('services', load_services, on_success=on_loaded)
 
     def setup_styles(self):
         """Настройка стилей для приложения"""
@@ -59,14 +123,16 @@ class ModernExpenseTracker:
                            padding=(10, 5))
 
     def init_database(self):
-        """Инициализация базы данных"""
-        create_tables()
-        add_user("default_user")
+        """Инициализация базы данных (таблицы создаются при импорте database)"""
+        if get_user_id("default_user") is None:
+            add_user("default_user")
         
-        # Добавляем предустановленные способы оплаты
+        # Добавляем только отсутствующие предустановленные способы оплаты
         payment_methods = ["💳 Банковская карта", "💵 Наличные", "📱 Онлайн-платеж", "🏦 Перевод"]
+        existing = set(get_all_payment_methods())
         for method in payment_methods:
-            add_payment_method(method)
+            if method not in existing:
+                add_payment_method(method)
 
     def create_widgets(self):
         """Создание виджетов интерфейса"""
@@ -82,19 +148,63 @@ class ModernExpenseTracker:
         self.notebook = ttk.Notebook(main_frame)
         self.notebook.pack(fill='both', expand=True)
         
-        # Вкладка добавления расходов
-        self.create_add_expense_tab()
-        
-        # Вкладка просмотра расходов
-        self.create_view_expenses_tab()
-        
-        # Вкладка статистики
-        self.create_statistics_tab()
+        # Вкладки: содержимое строится при первом показе
+        self._tab_builders = {}
+        tabs = {}
+        for name, text, builder in (('add', "➕ Добавить расход", self.create_add_expense_tab),
+                                    ('view', "📋 Все расходы", self.create_view_expenses_tab),
+                                    ('stats', "📈 Статистика", self.create_statistics_tab)):
+            frame = ttk.Frame(self.notebook, style='Card.TFrame', padding=20)
+            self.notebook.add(frame, text=text)
+            self._tab_builders[str(frame)] = (builder, frame)
+            tabs[name] = str(frame)
+        
+        self.refresher.register('table', self.refresh_table, tab=tabs['view'])
+        self.refresher.register('category_stats', self.update_category_stats, tab=tabs['add'])
+        self.refresher.register('general_stats', self.update_general_stats, tab=tabs['stats'])
+        
+        self.notebook.bind('<<NotebookTabChanged>>', self._on_tab_changed)
+        self._on_tab_changed()
+        
+        # Строка состояния с индикатором фоновой работы
+        status_frame = ttk.Frame(main_frame)
+        status_frame.pack(fill='x', pady=(10, 0))
+        
+        self.status_label = ttk.Label(status_frame, text="Готово")
+        self.status_label.pack(side='left')
+        
+        self.progress = ttk.Progressbar(status_frame, mode='indeterminate', length=150)
+        self.progress.pack(side='right')
+
+    def _on_tab_changed(self, event=None):
+        """Построение вкладки при первом показе"""
+        tab = self.notebook.select()
+        pending = self._tab_builders.pop(tab, None)
+        if pending:
+            builder, frame = pending
+            builder(frame)
+            # Только что построенная вкладка уже загружает актуальные данные
+            self.refresher.discard(tab)
+        self.refresher.flush()
+
+    def on_busy_change(self, busy, tasks):
+        """Обновление индикатора выполнения фоновых задач"""
+        task_names = {
+            'add_expense': "сохранение расхода",
+            'load_expenses': "загрузка расходов",
+            'store': "загрузка статистики",
+            'services': "загрузка модулей",
+            'report': "создание отчета"
+        }
+        if busy:
+            self.status_label.config(text="⏳ " + ", ".join(task_names.get(task, task) for task in sorted(tasks)))
+            self.progress.start(10)
+        else:
+            self.status_label.config(text="Готово")
+            self.progress.stop()
 
-    def create_add_expense_tab(self):
+    def create_add_expense_tab(self, add_frame):
         """Создание вкладки для добавления расходов"""
-        add_frame = ttk.Frame(self.notebook, style='Card.TFrame', padding=20)
-        self.notebook.add(add_frame, text="➕ Добавить расход")
         
         # Форма добавления
         form_frame = ttk.LabelFrame(add_frame, text="Новый расход", padding=15)
@@ -145,13 +255,10 @@ class ModernExpenseTracker:
                                 bg='#f8f9fa', relief='flat')
         self.stats_text.pack(fill='both', expand=True)
         
-        # Обновляем статистику
         self.update_category_stats()
 
-    def create_view_expenses_tab(self):
+    def create_view_expenses_tab(self, view_frame):
         """Создание вкладки для просмотра расходов"""
-        view_frame = ttk.Frame(self.notebook, style='Card.TFrame', padding=20)
-        self.notebook.add(view_frame, text="📋 Все расходы")
         
         # Панель управления
         control_frame = ttk.Frame(view_frame)
@@ -167,26 +274,18 @@ class ModernExpenseTracker:
         table_frame = ttk.Frame(view_frame)
         table_frame.pack(fill='both', expand=True)
         
-        # Создание Treeview с прокруткой
+        # Виртуализированная таблица: строки подгружаются страницами при прокрутке
         columns = ("Дата", "Сумма", "Категория", "Способ оплаты")
-        self.expenses_tree = ttk.Treeview(table_frame, columns=columns, show="headings", height=15)
-        
-        # Настройка заголовков
-        for col in columns:
-            self.expenses_tree.heading(col, text=col)
-            self.expenses_tree.column(col, width=150, anchor='center')
-        
-        # Добавление прокрутки
-        scrollbar = ttk.Scrollbar(table_frame, orient='vertical', command=self.expenses_tree.yview)
-        self.expenses_tree.configure(yscrollcommand=scrollbar.set)
+        self.expenses_model = ExpenseTableModel()
+        self.expenses_table = VirtualExpenseTable(table_frame, self.expenses_model, columns, height=15,
+                                                  executor=self.executor)
+        self.expenses_table.pack(fill='both', expand=True)
+        self.expenses_tree = self.expenses_table.tree
         
-        self.expenses_tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
+        self.load_expenses()
 
-    def create_statistics_tab(self):
+    def create_statistics_tab(self, stats_frame):
         """Создание вкладки статистики"""
-        stats_frame = ttk.Frame(self.notebook, style='Card.TFrame', padding=20)
-        self.notebook.add(stats_frame, text="📈 Статистика")
         
         # Общая статистика
         general_stats = ttk.LabelFrame(stats_frame, text="📊 Общая статистика", padding=15)
@@ -198,9 +297,8 @@ class ModernExpenseTracker:
         
         # Кнопка обновления статистики
         ttk.Button(stats_frame, text="🔄 Обновить статистику", 
-                  command=self.update_general_stats, style='Modern.TButton').pack(pady=10)
+                  command=self.refresh_stats, style='Modern.TButton').pack(pady=10)
         
-        # Обновляем статистику
         self.update_general_stats()
 
     def add_expense(self):
@@ -222,32 +320,40 @@ class ModernExpenseTracker:
             messagebox.showerror("❌ Ошибка", f"Некорректная сумма: {e}")
             return
 
-        try:
-            # Добавляем в базу данных
-            add_category(category)
-            user_id = get_user_id("default_user")
-            category_id = get_category_id(category)
-            payment_method_id = get_payment_method_id(payment_method)
-
-            add_expense_to_db(user_id, category_id, payment_method_id, amount)
-            
-            # Очищаем форму
-            self.clear_form()
-            
-            # Обновляем данные
-            self.load_expenses()
-            self.update_category_stats()
-            self.update_general_stats()
-            
-            messagebox.showinfo("✅ Успех", f"Расход на сумму {amount:.2f} руб. добавлен!")
-            
-            # Проверяем лимиты
-            warnings = check_spending_limits()
-            if warnings:
-                messagebox.showwarning("⚠️ Уведомление", "\n".join(warnings))
-                
-        except Exception as e:
-            messagebox.showerror("❌ Ошибка", f"Ошибка при добавлении расхода: {e}")
+        # Сохранение выполняется в фоне, окно остается отзывчивым
+        self.executor.submit('add_expense', self._save_expense, amount, category, payment_method,
+                             on_success=self._on_expense_saved, replace=False,
+                             on_error=lambda e: messagebox.showerror("❌ Ошибка", f"Ошибка при добавлении расхода: {e}"))
+
+    @profiled("gui.add_expense")
+    def _save_expense(self, amount, category, payment_method):
+        """Запись расхода в БД (фоновый поток); возвращает сумму и уведомления"""
+        limit_tracker, anomaly_detector, _ = load_services()
+        
+        add_category(category)
+        user_id = get_user_id("default_user")
+        category_id = get_category_id(category)
+        payment_method_id = get_payment_method_id(payment_method)
+        
+        add_expense_to_db(user_id, category_id, payment_method_id, amount)
+        
+        # Проверяем лимиты: только впервые пересеченные пороги
+        warnings = limit_tracker.pop_new_warnings()
+        warnings.extend(anomaly_detector.format_anomaly(anomaly)
+                        for anomaly in anomaly_detector.pop_new_anomalies())
+        return amount, warnings
+
+    def _on_expense_saved(self, result):
+        """Обновление интерфейса после сохранения расхода"""
+        amount, warnings = result
+        
+        # Очищаем форму (таблица и статистика обновляются через хранилище)
+        self.clear_form()
+        
+        messagebox.showinfo("✅ Успех", f"Расход на сумму {amount:.2f} руб. добавлен!")
+        
+        if warnings:
+            messagebox.showwarning("⚠️ Уведомление", "\n".join(warnings))
 
     def clear_form(self):
         """Очистка формы"""
@@ -256,107 +362,118 @@ class ModernExpenseTracker:
         self.payment_combobox.set("")
 
     def load_expenses(self):
-        """Загрузка расходов в таблицу"""
-        # Очищаем таблицу
-        for item in self.expenses_tree.get_children():
-            self.expenses_tree.delete(item)
-        
-        try:
-            expenses = get_expenses()
-            for expense in expenses:
-                # Обрабатываем как кортеж с 6 элементами
-                if len(expense) >= 4:
-                    date, amount, category, payment_method = expense[0], expense[1], expense[2], expense[3]
-                    # Форматируем дату
-                    formatted_date = datetime.strptime(date, "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M")
-                    # Форматируем сумму
-                    formatted_amount = f"{amount:.2f} ₽"
-                    
-                    self.expenses_tree.insert("", "end", values=(
-                        formatted_date, formatted_amount, category, payment_method
-                    ))
-        except Exception as e:
-            messagebox.showerror("❌ Ошибка", f"Ошибка при загрузке расходов: {e}")
+        """Загрузка первой страницы расходов в таблицу (в фоне)"""
+        if self.expenses_table is None:
+            return
+        self.executor.submit('load_expenses', self._fetch_expenses_model,
+                             on_success=self.expenses_table.set_model,
+                             on_error=lambda e: messagebox.showerror("❌ Ошибка", f"Ошибка при загрузке расходов: {e}"))
+
+    @profiled("gui.load_expenses")
+    def _fetch_expenses_model(self):
+        """Загрузка первой страницы в новую модель (фоновый поток)"""
+        model = ExpenseTableModel()
+        model.ensure(self.expenses_table.height + self.expenses_table.prefetch)
+        return model
+
+    def refresh_stats(self):
+        """Полная перезагрузка агрегатов (в фоне)"""
+        self.executor.submit('store', self.store.load,
+                             on_success=lambda _: self.refresher.request('category_stats', 'general_stats'),
+                             on_error=lambda e: messagebox.showerror("❌ Ошибка", f"Ошибка загрузки статистики: {e}"))
+
+    def on_store_change(self, event, expense):
+        """Учет изменения; перерисовка объединяется через refresher"""
+        if self.expenses_table is not None:
+            if not (event == 'insert' and self.expenses_table.model.prepend(expense)):
+                self._table_reload = True
+            self.refresher.request('table')
+        self.refresher.request('category_stats', 'general_stats')
+
+    def refresh_table(self):
+        """Перерисовка таблицы или ее перезагрузка после удаления/старых записей"""
+        if self.expenses_table is None:
+            return
+        if self._table_reload:
+            self._table_reload = False
+            self.load_expenses()
+        else:
+            self.expenses_table.render()
 
     def update_category_stats(self):
         """Обновление статистики по категориям"""
-        try:
-            expenses = get_expenses()
-            category_totals = {}
-            
-            for expense in expenses:
-                # Обрабатываем как кортеж с 6 элементами (date, amount, category, payment_method, description, id)
-                if len(expense) >= 4:
-                    date, amount, category, payment_method = expense[0], expense[1], expense[2], expense[3]
-                    if category not in category_totals:
-                        category_totals[category] = 0
-                    category_totals[category] += amount
-            
-            # Очищаем и заполняем статистику
-            self.stats_text.delete(1.0, tk.END)
-            if category_totals:
-                total = sum(category_totals.values())
-                self.stats_text.insert(tk.END, f"Общая сумма: {total:.2f} ₽\n\n")
-                
-                # Сортируем по убыванию суммы
-                sorted_categories = sorted(category_totals.items(), key=lambda x: x[1], reverse=True)
-                
-                for category, amount in sorted_categories:
-                    percentage = (amount / total) * 100
-                    self.stats_text.insert(tk.END, f"{category}: {amount:.2f} ₽ ({percentage:.1f}%)\n")
-            else:
-                self.stats_text.insert(tk.END, "Нет данных о расходах")
-                
-        except Exception as e:
-            self.stats_text.delete(1.0, tk.END)
-            self.stats_text.insert(tk.END, f"Ошибка загрузки статистики: {e}")
+        if self.store.loaded and self.stats_text is not None:
+            self._render_category_stats(self.store.category_summary())
+
+    def _render_category_stats(self, sorted_categories):
+        """Вывод статистики по категориям (отсортированы по убыванию суммы)"""
+        if not sorted_categories:
+            self._show_text(self.stats_text, "Нет данных о расходах")
+            return
+        
+        total = sum(amount for _, amount in sorted_categories)
+        lines = [f"Общая сумма: {total:.2f} ₽", ""]
+        
+        for category, amount in sorted_categories:
+            percentage = (amount / total) * 100
+            lines.append(f"{category}: {amount:.2f} ₽ ({percentage:.1f}%)")
+        self._show_text(self.stats_text, "\n".join(lines) + "\n")
 
     def update_general_stats(self):
         """Обновление общей статистики"""
-        try:
-            expenses = get_expenses()
-            current_month = datetime.now().strftime("%Y-%m")
-            
-            monthly_total = 0
-            total_expenses = 0
-            category_count = set()
-            payment_methods = set()
-            
-            for expense in expenses:
-                # Обрабатываем как кортеж с 6 элементами
-                if len(expense) >= 4:
-                    date, amount, category, payment_method = expense[0], expense[1], expense[2], expense[3]
-                    total_expenses += amount
-                    category_count.add(category)
-                    payment_methods.add(payment_method)
-                    
-                    if date.startswith(current_month):
-                        monthly_total += amount
-            
-            # Очищаем и заполняем статистику
-            self.general_stats_text.delete(1.0, tk.END)
-            self.general_stats_text.insert(tk.END, f"📅 Текущий месяц ({current_month}): {monthly_total:.2f} ₽\n")
-            self.general_stats_text.insert(tk.END, f"💰 Общая сумма расходов: {total_expenses:.2f} ₽\n")
-            self.general_stats_text.insert(tk.END, f"📂 Количество категорий: {len(category_count)}\n")
-            self.general_stats_text.insert(tk.END, f"💳 Способов оплаты: {len(payment_methods)}\n")
-            self.general_stats_text.insert(tk.END, f"📊 Всего записей: {len(expenses)}\n")
-            
-        except Exception as e:
-            self.general_stats_text.delete(1.0, tk.END)
-            self.general_stats_text.insert(tk.END, f"Ошибка загрузки статистики: {e}")
+        if self.store.loaded and self.general_stats_text is not None:
+            self._render_general_stats(self.store.general_stats())
+
+    def _render_general_stats(self, stats):
+        """Вывод общей статистики"""
+        self._show_text(self.general_stats_text,
+                        f"📅 Текущий месяц ({stats['current_month']}): {stats['monthly_total']:.2f} ₽\n"
+                        f"💰 Общая сумма расходов: {stats['total_expenses']:.2f} ₽\n"
+                        f"📂 Количество категорий: {stats['categories']}\n"
+                        f"💳 Способов оплаты: {stats['payment_methods']}\n"
+                        f"📊 Всего записей: {stats['count']}\n")
+
+    @staticmethod
+    def _show_text(widget, text):
+        """Замена содержимого текстового поля одной вставкой (без изменений — пропуск)"""
+        if widget.get(1.0, 'end-1c') == text:
+            return
+        widget.delete(1.0, tk.END)
+        widget.insert(tk.END, text)
 
     def show_report(self):
         """Показ отчета"""
+        # Если фоновый планировщик уже обновил отчет, повторно не генерируем
+        self.executor.submit('report', self._generate_report,
+                             on_success=lambda message: messagebox.showinfo("📊 Отчет", message),
+                             on_error=lambda e: messagebox.showerror("❌ Ошибка", f"Ошибка при создании отчета: {e}"))
+
+    @profiled("gui.show_report")
+    def _generate_report(self):
+        """Генерация месячного отчета (фоновый поток)"""
+        return load_services()[2].ensure_monthly_report()
+
+    def close(self):
+        """Закрытие окна с остановкой фоновых задач и сохранением метрик"""
+        self.executor.shutdown()
         try:
-            message = generate_monthly_report()
-            messagebox.showinfo("📊 Отчет", message)
-        except Exception as e:
-            messagebox.showerror("❌ Ошибка", f"Ошибка при создании отчета: {e}")
+            metrics.dump()
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить метрики: {e}")
+        self.root.destroy()
 
 def main():
-    """Главная функция приложения"""
+    """Главная функция приложения (--profile [каталог] — режим профилирования)"""
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Трекер расходов")
+    parser.add_argument('--profile', nargs='?', const='', metavar='КАТАЛОГ',
+                        help="профилировать действия (cProfile и tracemalloc)")
+    args, _ = parser.parse_known_args()
+    if args.profile is not None:
+        profiler.enable(args.profile or None)
     root = tk.Tk()
     app = ModernExpenseTracker(root)
+    root.protocol("WM_DELETE_WINDOW", app.close)
     
     # Центрирование окна
     root.update_idletasks()
@@ -366,6 +483,9 @@ def main():
     y = (root.winfo_screenheight() // 2) - (height // 2)
     root.geometry(f'{width}x{height}+{x}+{y}')
     
+    # Время до первого показа окна
+    root.after_idle(lambda: app._mark_startup('first_window'))
+    
     root.mainloop()
 
 if __name__ == "__main__":
@@ -1,34 +1,39 @@
 # -*- mode: python ; coding: utf-8 -*-
 
+# Сборка в папку (onedir): без распаковки архива во временный каталог при
+# каждом запуске и без UPX, распаковка которого замедляет старт.
+
+# Модули, импортируемые приложением лениво (после показа окна)
+lazy_modules = [
+    'limits', 'anomalies', 'scheduler', 'reports', 'notifications',
+    'sketches', 'forecasting', 'pivot', 'utils', 'dates',
+]
 
 a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    hiddenimports=lazy_modules,
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['unittest', 'doctest', 'pydoc', 'test', 'lib2to3', 'xmlrpc', 'pytest'],
     noarchive=False,
-    optimize=0,
+    optimize=1,
 )
 pyz = PYZ(a.pure)
 
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='main',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
+    upx=False,
     console=False,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -36,3 +41,13 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='main',
+)
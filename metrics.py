@@ -0,0 +1,262 @@
+"""
+Метрики производительности: гистограммы задержек, журнал медленных запросов
+"""
+
+import argparse
+import json
+import logging
+import logging.handlers
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from typing import Callable, Dict, List, Optional
+from config import LOGGING_CONFIG
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("expense_tracker.slow_queries")
+
+# Верхние границы корзин гистограммы, мс
+BUCKET_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+STATEMENT_PATTERN = re.compile(
+    r'^\s*(SELECT|INSERT(?:\s+OR\s+\w+)?|UPDATE|DELETE|CREATE|DROP|PRAGMA|WITH|REPLACE)\b'
+    r'.*?\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+NOT\s+EXISTS)?|INDEX(?:\s+IF\s+NOT\s+EXISTS)?)\s+(\w+)',
+    re.I | re.S
+)
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными логарифмическими корзинами"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        self.buckets[bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.min_ms = ms if self.min_ms is None else min(self.min_ms, ms)
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, q: float) -> float:
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return BUCKET_BOUNDS_MS[index] if index < len(BUCKET_BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'total_ms': self.total_ms,
+            'avg_ms': self.total_ms / self.count if self.count else 0.0,
+            'min_ms': self.min_ms or 0.0,
+            'max_ms': self.max_ms,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'buckets': dict(zip([str(bound) for bound in BUCKET_BOUNDS_MS] + ['inf'], self.buckets))
+        }
+
+
+class MetricsRegistry:
+    """Потокобезопасный реестр гистограмм по именам операций"""
+
+    def __init__(self, slow_query_ms: float = None, slow_query_file: Optional[str] = None):
+        self.slow_query_ms = (slow_query_ms if slow_query_ms is not None
+                              else LOGGING_CONFIG.get('slow_query_ms', 100))
+        # Пустая строка — без отдельного файла (только общий журнал)
+        self.slow_query_file = (slow_query_file if slow_query_file is not None
+                                else LOGGING_CONFIG.get('slow_query_file'))
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._slow_handler_ready = False
+
+    def observe(self, name: str, seconds: float):
+        ms = seconds * 1000
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = LatencyHistogram()
+            histogram.observe(ms)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Замер блока кода: with metrics.timer("report.monthly"): ..."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def timed(self, name: str) -> Callable:
+        """Декоратор замера длительности вызовов"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def record_query(self, sql: str, seconds: float, params=None):
+        """Учет SQL-запроса; медленные пишутся в журнал медленных запросов"""
+        self.observe(f"sql.{statement_key(sql)}", seconds)
+        ms = seconds * 1000
+        if ms >= self.slow_query_ms:
+            self._ensure_slow_log()
+            params_text = f" params={params!r}"[:500] if params else ""
+            slow_query_logger.warning(f"{ms:.1f} мс: {' '.join(sql.split())}{params_text}")
+
+    def _ensure_slow_log(self):
+        if self._slow_handler_ready:
+            return
+        self._slow_handler_ready = True
+        filename = self.slow_query_file
+        if filename and not slow_query_logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                filename, maxBytes=LOGGING_CONFIG['max_size'],
+                backupCount=LOGGING_CONFIG['backup_count'], encoding='utf-8', delay=True)
+            handler.setFormatter(logging.Formatter(LOGGING_CONFIG['format']))
+            slow_query_logger.addHandler(handler)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Текущие значения всех гистограмм"""
+        with self._lock:
+            return {name: histogram.to_dict() for name, histogram in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def dump(self, filename: Optional[str] = None) -> str:
+        """Запись снимка метрик в JSON"""
+        filename = filename or LOGGING_CONFIG.get('metrics_file', 'metrics.json')
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({'created_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+                       'metrics': self.snapshot()}, f, ensure_ascii=False, indent=2)
+        return filename
+
+
+@lru_cache(maxsize=1024)
+def statement_key(sql: str) -> str:
+    """Имя операции по тексту запроса: 'SELECT expenses', 'INSERT categories' и т.п."""
+    match = STATEMENT_PATTERN.match(sql)
+    if match:
+        verb = match.group(1).split()[0].upper()
+        return f"{verb} {match.group(2)}"
+    words = sql.split()
+    return words[0].upper() if words else "EMPTY"
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий execute/executemany/executescript"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.record_query(sql, time.perf_counter() - started, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.record_query(sql, time.perf_counter() - started)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            metrics.record_query(sql_script, time.perf_counter() - started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Подключение, все курсоры которого замеряют запросы"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def configure_logging():
+    """Настройка журнала приложения по LOGGING_CONFIG (с ротацией файла)"""
+    root = logging.getLogger()
+    root.setLevel(LOGGING_CONFIG['level'])
+    if any(isinstance(handler, logging.handlers.RotatingFileHandler) for handler in root.handlers):
+        return
+    handler = logging.handlers.RotatingFileHandler(
+        LOGGING_CONFIG['file'], maxBytes=LOGGING_CONFIG['max_size'],
+        backupCount=LOGGING_CONFIG['backup_count'], encoding='utf-8', delay=True)
+    handler.setFormatter(logging.Formatter(LOGGING_CONFIG['format']))
+    root.addHandler(handler)
+
+
+def format_snapshot(snapshot: Dict[str, Dict], sort_by: str = 'total_ms', limit: int = 50) -> str:
+    """Текстовая таблица метрик"""
+    lines = [f"{'Операция':<40} {'Кол-во':>8} {'Всего, мс':>11} {'Сред.':>8} "
+             f"{'p50':>8} {'p95':>8} {'p99':>8} {'Макс.':>9}"]
+    items = sorted(snapshot.items(), key=lambda item: item[1].get(sort_by, 0), reverse=True)
+    for name, values in items[:limit]:
+        lines.append(f"{name[:40]:<40} {values['count']:>8} {values['total_ms']:>11.1f} "
+                     f"{values['avg_ms']:>8.2f} {values['p50_ms']:>8.2f} {values['p95_ms']:>8.2f} "
+                     f"{values['p99_ms']:>8.2f} {values['max_ms']:>9.2f}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Вывод сохраненного снимка метрик: python metrics.py [файл] [--sort count]"""
+    parser = argparse.ArgumentParser(description="Метрики производительности трекера расходов")
+    parser.add_argument('file', nargs='?', default=LOGGING_CONFIG.get('metrics_file', 'metrics.json'))
+    parser.add_argument('--sort', default='total_ms', choices=['total_ms', 'count', 'avg_ms', 'p95_ms', 'max_ms'])
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--json', action='store_true', help="вывести снимок как JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.file, encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        print(f"Файл метрик не найден: {args.file}")
+        return 1
+
+    if args.json:
+        print(json.dumps(data, ensure_ascii=False, indent=2))
+    else:
+        print(f"Снимок от {data.get('created_at', '?')}")
+        print(format_snapshot(data['metrics'], args.sort, args.limit))
+    return 0
+
+
+# Создаем глобальный реестр метрик
+metrics = MetricsRegistry()
+
+if __name__ == "__main__":
+    raise SystemExit(main())
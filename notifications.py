@@ -1,124 +1,208 @@
 import sqlite3
+import calendar
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import List, Dict, Tuple
 import logging
-from database import db_manager
+from config import NOTIFICATION_CONFIG
+from database import LazyInstance, db_manager
+from dates import period_key
+from sketches import SketchStore, sketch_store, DEFAULT_QUANTILES
+from forecasting import ForecastEngine, forecast_engine
+from metrics import metrics
+from profiling import profiled
 
 logger = logging.getLogger(__name__)
 
+class AnalysisSnapshot:
+    """Агрегаты расходов за текущий месяц, загружаемые одним запросом.
+    
+    Передается во все методы анализа NotificationManager, чтобы проверка
+    лимитов, инсайты, прогноз и рекомендации не запрашивали одни и те же
+    данные повторно.
+    """
+    
+    def __init__(self, db_manager, user_id: int = None, now: datetime = None,
+                 rows: List[Tuple] = None):
+        """rows — готовые агрегаты (категория, день, сумма, количество); без них выполняется запрос"""
+        self.user_id = user_id
+        self.now = now or datetime.now()
+        self.period = self.now.strftime("%Y-%m")
+        self.category_totals = defaultdict(float)
+        self.category_counts = defaultdict(int)
+        self.daily_totals = defaultdict(float)
+        self.weekly_totals = defaultdict(float)
+        self.category_daily_totals = defaultdict(float)
+        
+        if rows is None:
+            query = '''
+                SELECT c.name, DATE(e.date), SUM(e.amount), COUNT(*)
+                FROM expenses e
+                JOIN categories c ON e.category_id = c.id
+                JOIN payment_methods pm ON e.payment_method_id = pm.id
+            '''
+            conditions, params = db_manager.build_expense_filters(
+                user_id, f"{self.period}-01", f"{self.period}-31", alias='e'
+            )
+            query += " WHERE " + " AND ".join(conditions) + " GROUP BY 1, 2"
+            
+            with db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+        
+        for category, day, total, count in rows:
+            self.category_totals[category] += total
+            self.category_counts[category] += count
+            self.daily_totals[day] += total
+            self.category_daily_totals[(category, day)] += total
+        
+        # Недели считаются по дням, а не по строкам
+        for day, total in self.daily_totals.items():
+            self.weekly_totals[period_key(day, "week")] += total
+        
+        self.total_spent = sum(self.category_totals.values())
+        self.count = sum(self.category_counts.values())
+
 class NotificationManager:
     """Класс для управления уведомлениями и лимитами расходов"""
     
-    def __init__(self):
-        self.db_manager = db_manager
-        self.default_limits = {
-            "Кофе": 1000,
-            "Еда": 5000,
-            "Развлечения": 2000,
-            "Транспорт": 3000,
-            "Покупки": 10000,
-            "Здоровье": 2000,
-            "Образование": 5000
+    def __init__(self, db=None):
+        self.db_manager = db or db_manager
+        # Модели прогноза хранятся в той же БД, что и расходы
+        self.forecast_engine = ForecastEngine(db) if db else forecast_engine
+        self.default_limits = dict(NOTIFICATION_CONFIG['default_limits'])
+        self.daily_limit = NOTIFICATION_CONFIG['daily_limit']
+        self.weekly_limit = NOTIFICATION_CONFIG['weekly_limit']
+        self.monthly_limit = NOTIFICATION_CONFIG['monthly_limit']
+        self._alert_rule_engine = None
+        self._sketch_store = None
+    
+    @property
+    def sketch_store(self) -> SketchStore:
+        """Скетчи распределения сумм в той же БД (создаются при первом обращении)"""
+        if self._sketch_store is None:
+            self._sketch_store = (sketch_store if self.db_manager is db_manager
+                                  else SketchStore(self.db_manager))
+        return self._sketch_store
+    
+    @property
+    def alert_rule_engine(self):
+        """Движок правил на той же БД (alert_rules импортирует этот модуль, поэтому импорт ленивый)"""
+        if self._alert_rule_engine is None:
+            from alert_rules import AlertRuleEngine, alert_rule_engine
+            self._alert_rule_engine = (alert_rule_engine if self.db_manager is db_manager
+                                       else AlertRuleEngine(self.db_manager))
+        return self._alert_rule_engine
+    
+    def limit_config(self, custom_limits: Dict[str, float] = None) -> Dict:
+        """Лимиты экземпляра в формате NOTIFICATION_CONFIG для правил"""
+        return {
+            'default_limits': custom_limits or self.default_limits,
+            'daily_limit': self.daily_limit,
+            'weekly_limit': self.weekly_limit,
+            'monthly_limit': self.monthly_limit
+        }
+    
+    @metrics.timed("notifications.snapshot")
+    @profiled("notifications.snapshot")
+    def create_snapshot(self, user_id: int = None) -> AnalysisSnapshot:
+        """Загрузка данных текущего месяца для серии проверок"""
+        return AnalysisSnapshot(self.db_manager, user_id)
+    
+    @metrics.timed("notifications.analyze")
+    @profiled("notifications.analyze")
+    def analyze(self, user_id: int = None,
+                custom_limits: Dict[str, float] = None) -> Dict:
+        """Лимиты, инсайты, прогноз и рекомендации по одному снимку данных"""
+        try:
+            snapshot = self.create_snapshot(user_id)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки данных для анализа: {e}")
+            return {}
+        
+        return {
+            'warnings': self.check_spending_limits(user_id, custom_limits, snapshot=snapshot),
+            'insights': self.get_category_insights(user_id, snapshot=snapshot),
+            'forecast': self.get_spending_forecast(user_id, snapshot=snapshot),
+            'recommendations': self.get_budget_recommendations(user_id, snapshot=snapshot)
         }
     
+    @metrics.timed("notifications.check_spending_limits")
+    @profiled("notifications.check_spending_limits")
     def check_spending_limits(self, user_id: int = None, 
-                            custom_limits: Dict[str, float] = None) -> List[str]:
-        """Проверка превышения лимитов расходов"""
+                            custom_limits: Dict[str, float] = None,
+                            snapshot: AnalysisSnapshot = None) -> List[str]:
+        """Проверка превышения лимитов расходов по правилам (alert_rules).
+        
+        Лимиты экземпляра (или custom_limits вместо лимитов категорий) и
+        правила из БД проверяются по агрегатам снимка, без повторного
+        запроса расходов; без user_id — по сумме расходов всех
+        пользователей.
+        """
         try:
-            limits = custom_limits or self.default_limits
-            current_month = datetime.now().strftime("%Y-%m")
-            
-            # Получаем расходы за текущий месяц
-            expenses = self.db_manager.get_expenses(
-                user_id=user_id,
-                start_date=f"{current_month}-01",
-                end_date=f"{current_month}-31"
-            )
-            
-            # Группируем расходы по категориям
-            spending = defaultdict(float)
-            for date, amount, category, payment_method, description, expense_id in expenses:
-                spending[category] += amount
-            
-            # Проверяем лимиты
-            warnings = []
-            for category, limit in limits.items():
-                if spending[category] > limit:
-                    overage = spending[category] - limit
-                    percentage = (spending[category] / limit) * 100
-                    
-                    if percentage > 200:  # Превышение более чем в 2 раза
-                        message = f"🚨 КРИТИЧЕСКОЕ превышение! Категория '{category}': {spending[category]:.2f} ₽ (лимит: {limit} ₽, превышение на {overage:.2f} ₽)"
-                    elif percentage > 150:  # Превышение более чем в 1.5 раза
-                        message = f"⚠️ Серьезное превышение! Категория '{category}': {spending[category]:.2f} ₽ (лимит: {limit} ₽, превышение на {overage:.2f} ₽)"
-                    else:
-                        message = f"⚠️ Превышен лимит по категории '{category}': {spending[category]:.2f} ₽ (лимит: {limit} ₽, превышение на {overage:.2f} ₽)"
-                    
-                    warnings.append(message)
-            
-            # Дополнительные проверки
-            warnings.extend(self._check_daily_spending(expenses))
-            warnings.extend(self._check_weekly_trends(expenses))
-            
-            return warnings
+            snapshot = snapshot or self.create_snapshot(user_id)
+            engine = self.alert_rule_engine
+            rules = engine.load_rules(self.limit_config(custom_limits))
+            return [alert['message'] for alert in engine.evaluate_snapshot(rules, snapshot)]
             
         except Exception as e:
             logger.error(f"Ошибка проверки лимитов: {e}")
             return [f"Ошибка проверки лимитов: {e}"]
     
-    def _check_daily_spending(self, expenses: List[Tuple]) -> List[str]:
-        """Проверка дневных расходов"""
-        warnings = []
-        daily_totals = defaultdict(float)
-        
-        for date, amount, category, payment_method, description, expense_id in expenses:
-            day = date.split(' ')[0]
-            daily_totals[day] += amount
-        
-        # Проверяем, если в какой-то день потрачено больше 5000 рублей
-        for day, total in daily_totals.items():
-            if total > 5000:
-                warnings.append(f"💸 Высокие дневные расходы {day}: {total:.2f} ₽")
-        
-        return warnings
+    @staticmethod
+    def limit_level(spent: float, limit: float) -> int:
+        """Уровень превышения лимита: 0 — нет, 1 — превышен, 2 — более 150%, 3 — более 200%"""
+        if spent <= limit:
+            return 0
+        percentage = (spent / limit) * 100
+        if percentage > 200:  # Превышение более чем в 2 раза
+            return 3
+        if percentage > 150:  # Превышение более чем в 1.5 раза
+            return 2
+        return 1
     
-    def _check_weekly_trends(self, expenses: List[Tuple]) -> List[str]:
-        """Проверка недельных трендов"""
-        warnings = []
+    @classmethod
+    def format_limit_warning(cls, category: str, spent: float, limit: float) -> str:
+        """Текст предупреждения о превышении лимита категории"""
+        overage = spent - limit
+        level = cls.limit_level(spent, limit)
+        details = f"{spent:.2f} ₽ (лимит: {limit} ₽, превышение на {overage:.2f} ₽)"
         
-        # Группируем по неделям
-        weekly_totals = defaultdict(float)
-        for date, amount, category, payment_method, description, expense_id in expenses:
-            date_obj = datetime.strptime(date.split(' ')[0], "%Y-%m-%d")
-            week_start = date_obj - timedelta(days=date_obj.weekday())
-            week_key = week_start.strftime("%Y-%m-%d")
-            weekly_totals[week_key] += amount
-        
-        # Проверяем, если недельные расходы превышают 20000 рублей
-        for week, total in weekly_totals.items():
-            if total > 20000:
-                warnings.append(f"📈 Высокие недельные расходы ({week}): {total:.2f} ₽")
-        
-        return warnings
+        if level == 3:
+            return f"🚨 КРИТИЧЕСКОЕ превышение! Категория '{category}': {details}"
+        if level == 2:
+            return f"⚠️ Серьезное превышение! Категория '{category}': {details}"
+        return f"⚠️ Превышен лимит по категории '{category}': {details}"
+    
+    @staticmethod
+    def format_daily_warning(day: str, total: float) -> str:
+        """Текст предупреждения о высоких дневных расходах"""
+        return f"💸 Высокие дневные расходы {day}: {total:.2f} ₽"
+    
+    @staticmethod
+    def format_weekly_warning(week: str, total: float) -> str:
+        """Текст предупреждения о высоких недельных расходах"""
+        return f"📈 Высокие недельные расходы ({week}): {total:.2f} ₽"
+    
+    @staticmethod
+    def format_monthly_warning(month: str, total: float) -> str:
+        """Текст предупреждения о высоких месячных расходах"""
+        return f"📅 Высокие месячные расходы ({month}): {total:.2f} ₽"
     
-    def get_spending_forecast(self, user_id: int = None) -> Dict:
+    @metrics.timed("notifications.forecast")
+    @profiled("notifications.forecast")
+    def get_spending_forecast(self, user_id: int = None,
+                              snapshot: AnalysisSnapshot = None) -> Dict:
         """Прогноз расходов на основе текущих данных"""
         try:
-            current_month = datetime.now().strftime("%Y-%m")
-            current_day = datetime.now().day
-            
-            # Получаем расходы за текущий месяц
-            expenses = self.db_manager.get_expenses(
-                user_id=user_id,
-                start_date=f"{current_month}-01",
-                end_date=f"{current_month}-31"
-            )
-            
-            total_spent = sum(amount for date, amount, category, payment_method, description, expense_id in expenses)
+            snapshot = snapshot or self.create_snapshot(user_id)
+            now = snapshot.now
+            current_day = now.day
+            total_spent = snapshot.total_spent
             
             # Рассчитываем прогноз
-            days_in_month = 30  # Упрощенный расчет
+            days_in_month = calendar.monthrange(now.year, now.month)[1]
             daily_average = total_spent / current_day if current_day > 0 else 0
             forecast = daily_average * days_in_month
             
@@ -134,24 +218,17 @@ class NotificationManager:
             logger.error(f"Ошибка расчета прогноза: {e}")
             return {}
     
-    def get_category_insights(self, user_id: int = None) -> Dict:
+    @metrics.timed("notifications.category_insights")
+    @profiled("notifications.category_insights")
+    def get_category_insights(self, user_id: int = None,
+                              snapshot: AnalysisSnapshot = None) -> Dict:
         """Анализ расходов по категориям с инсайтами"""
         try:
-            current_month = datetime.now().strftime("%Y-%m")
-            expenses = self.db_manager.get_expenses(
-                user_id=user_id,
-                start_date=f"{current_month}-01",
-                end_date=f"{current_month}-31"
-            )
-            
-            category_totals = defaultdict(float)
-            category_counts = defaultdict(int)
-            
-            for date, amount, category, payment_method, description, expense_id in expenses:
-                category_totals[category] += amount
-                category_counts[category] += 1
+            snapshot = snapshot or self.create_snapshot(user_id)
+            category_totals = snapshot.category_totals
+            category_counts = snapshot.category_counts
             
-            total_spent = sum(category_totals.values())
+            total_spent = snapshot.total_spent
             insights = {}
             
             for category, total in category_totals.items():
@@ -176,11 +253,29 @@ class NotificationManager:
             logger.error(f"Ошибка анализа категорий: {e}")
             return {}
     
-    def get_budget_recommendations(self, user_id: int = None) -> List[str]:
+    def get_spend_distribution(self, category: str = None,
+                               quantiles: Tuple[float, ...] = DEFAULT_QUANTILES,
+                               user_id: int = None) -> Dict:
+        """Распределение сумм расходов (медиана, p90 и т.д.) по всей истории"""
+        try:
+            return self.sketch_store.get_spend_distribution(category, quantiles, user_id)
+        except Exception as e:
+            logger.error(f"Ошибка получения распределения расходов: {e}")
+            return {}
+    
+    @metrics.timed("notifications.budget_recommendations")
+    @profiled("notifications.budget_recommendations")
+    def get_budget_recommendations(self, user_id: int = None,
+                                   snapshot: AnalysisSnapshot = None,
+                                   forecast: Dict = None) -> List[str]:
         """Рекомендации по бюджету на основе анализа расходов"""
         try:
-            insights = self.get_category_insights(user_id)
-            forecast = self.get_spending_forecast(user_id)
+            snapshot = snapshot or self.create_snapshot(user_id)
+            insights = self.get_category_insights(user_id, snapshot=snapshot)
+            # Прогноз по истории с недельной сезонностью (модели кэшируются)
+            if forecast is None:
+                forecast = self.forecast_engine.forecast_month(user_id, snapshot.now.date(),
+                                                               spent=dict(snapshot.category_totals))
             
             recommendations = []
             
@@ -188,8 +283,13 @@ class NotificationManager:
                 return ["Недостаточно данных для рекомендаций"]
             
             # Анализ прогноза
-            if forecast['forecast'] > 50000:
-                recommendations.append("💡 Рекомендация: Ваши расходы могут превысить 50,000 ₽ в месяц. Рассмотрите возможность сокращения трат.")
+            if forecast['forecast'] > self.monthly_limit:
+                recommendations.append(f"💡 Рекомендация: Ваши расходы могут превысить {self.monthly_limit:,.0f} ₽ в месяц. Рассмотрите возможность сокращения трат.")
+            
+            for category, data in forecast['by_category'].items():
+                limit = self.default_limits.get(category)
+                if limit and data['spent'] <= limit < data['forecast']:
+                    recommendations.append(f"💡 По прогнозу расходы в категории '{category}' составят {data['forecast']:.2f} ₽ при лимите {limit} ₽.")
             
             # Анализ категорий
             for category, data in insights['insights'].items():
@@ -212,7 +312,7 @@ class NotificationManager:
             return [f"Ошибка генерации рекомендаций: {e}"]
 
 # Создаем глобальный экземпляр менеджера уведомлений
-notification_manager = NotificationManager()
+notification_manager = LazyInstance(NotificationManager)
 
 # Функции для обратной совместимости
 def check_spending_limits():
@@ -0,0 +1,216 @@
+"""
+Сводные таблицы (кубы) расходов: категории × периоды и т.п.
+"""
+
+import sqlite3
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+import logging
+from database import LazyInstance, db_manager
+from dates import sql_period_key
+
+logger = logging.getLogger(__name__)
+
+# SQL-выражения для измерений куба
+DIMENSIONS = {
+    'category': "c.name",
+    'payment_method': "pm.method_name",
+    'user': "e.user_id",
+    'day': sql_period_key("e.date", "day"),
+    'week': sql_period_key("e.date", "week"),
+    'month': sql_period_key("e.date", "month"),
+    'year': sql_period_key("e.date", "year"),
+}
+
+MEASURES = ('sum', 'count', 'average')
+
+
+def _label_key(label) -> Tuple[bool, object]:
+    """Ключ сортировки меток: None (например, период некорректной даты) — в конце"""
+    return (label is None, label if label is not None else 0)
+
+
+class PivotTable:
+    """Плотная сводная таблица с метками по осям.
+
+    Суммы и количества хранятся в плоских массивах array в порядке
+    row-major; ячейка без расходов содержит 0. Смещения непустых ячеек
+    запоминаются, и свертки обходят только их, а не весь куб.
+    """
+
+    def __init__(self, dimensions: Sequence[str], labels: Sequence[List],
+                 measure: str = 'sum'):
+        self.dimensions = list(dimensions)
+        self.labels = [list(axis) for axis in labels]
+        self.measure = measure
+        self.shape = tuple(len(axis) for axis in self.labels)
+        self._index = [{label: i for i, label in enumerate(axis)} for axis in self.labels]
+
+        size = 1
+        for length in self.shape:
+            size *= length
+        self.sums = array('d', bytes(8 * size))
+        self.counts = array('q', bytes(8 * size))
+        self._filled = set()
+
+    @property
+    def row_labels(self) -> List:
+        return self.labels[0]
+
+    @property
+    def column_labels(self) -> List:
+        return self.labels[1] if len(self.labels) > 1 else []
+
+    def _offset(self, indexes: Sequence[int]) -> int:
+        offset = 0
+        for index, length in zip(indexes, self.shape):
+            offset = offset * length + index
+        return offset
+
+    def _indexes(self, offset: int) -> List[int]:
+        indexes = []
+        for length in reversed(self.shape):
+            offset, index = divmod(offset, length)
+            indexes.append(index)
+        return indexes[::-1]
+
+    def _add(self, labels: Sequence, total: float, count: int):
+        offset = self._offset([axis[label] for axis, label in zip(self._index, labels)])
+        self.sums[offset] += total
+        self.counts[offset] += count
+        self._filled.add(offset)
+
+    def _value(self, offset: int) -> float:
+        if self.measure == 'count':
+            return self.counts[offset]
+        if self.measure == 'average':
+            count = self.counts[offset]
+            return self.sums[offset] / count if count else 0.0
+        return self.sums[offset]
+
+    def get(self, *labels) -> float:
+        """Значение ячейки по меткам (0 для отсутствующих меток)"""
+        try:
+            indexes = [axis[label] for axis, label in zip(self._index, labels)]
+        except KeyError:
+            return 0.0
+        return self._value(self._offset(indexes))
+
+    def values(self) -> List:
+        """Значения в виде вложенных списков по осям"""
+        flat = [self._value(offset) for offset in range(len(self.sums))]
+        for length in reversed(self.shape[1:]):
+            flat = [flat[i:i + length] for i in range(0, len(flat), length)]
+        return flat
+
+    def subtotal(self, keep: Sequence[str]) -> 'PivotTable':
+        """Промежуточные итоги: свертка куба по всем осям, кроме keep"""
+        keep_axes = [self.dimensions.index(name) for name in keep]
+        result = PivotTable([self.dimensions[a] for a in keep_axes],
+                            [self.labels[a] for a in keep_axes], self.measure)
+
+        for offset in sorted(self._filled):
+            indexes = self._indexes(offset)
+            target = result._offset([indexes[a] for a in keep_axes])
+            result.sums[target] += self.sums[offset]
+            result.counts[target] += self.counts[offset]
+            result._filled.add(target)
+        return result
+
+    def totals(self, dimension: str) -> Dict:
+        """Итоги по одному измерению: {метка: значение}"""
+        reduced = self.subtotal([dimension])
+        return {label: reduced._value(i) for i, label in enumerate(reduced.labels[0])}
+
+    @property
+    def grand_total(self) -> float:
+        total, count = sum(self.sums), sum(self.counts)
+        if self.measure == 'count':
+            return count
+        if self.measure == 'average':
+            return total / count if count else 0.0
+        return total
+
+    def to_dict(self, totals: Sequence[str] = ()) -> Dict:
+        """Сериализация для отчетов и API; итоги — только по измерениям totals"""
+        return {
+            'dimensions': self.dimensions,
+            'labels': self.labels,
+            'measure': self.measure,
+            'values': self.values(),
+            'totals': {name: self.totals(name) for name in totals},
+            'grand_total': self.grand_total
+        }
+
+
+class PivotEngine:
+    """Построение сводных таблиц одним сгруппированным запросом"""
+
+    def __init__(self, db=None):
+        self.db_manager = db or db_manager
+
+    def pivot(self, rows: str = 'category', columns: str = 'month',
+              layers: Optional[str] = None, measure: str = 'sum',
+              user_id: Optional[int] = None,
+              start_date: Optional[str] = None,
+              end_date: Optional[str] = None,
+              category_id: Optional[int] = None) -> PivotTable:
+        """Сводная таблица rows × columns (× layers)"""
+        dimensions = [rows, columns] + ([layers] if layers else [])
+        unknown = [name for name in dimensions if name not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"Неподдерживаемые измерения: {', '.join(unknown)}")
+        if len(set(dimensions)) != len(dimensions):
+            raise ValueError("Измерения сводной таблицы не должны повторяться")
+        if measure not in MEASURES:
+            raise ValueError(f"Неподдерживаемая метрика: {measure}")
+
+        try:
+            cells = self._query_cells(dimensions, user_id, start_date, end_date, category_id)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка построения сводной таблицы: {e}")
+            raise
+
+        labels: List[set] = [set() for _ in dimensions]
+        for cell in cells:
+            for axis, label in zip(labels, cell[:len(dimensions)]):
+                axis.add(label)
+
+        table = PivotTable(dimensions, [sorted(axis, key=_label_key) for axis in labels], measure)
+        for cell in cells:
+            table._add(cell[:len(dimensions)], cell[-2], cell[-1])
+        return table
+
+    def _query_cells(self, dimensions: List[str], user_id, start_date,
+                     end_date, category_id) -> List[Tuple]:
+        select = ", ".join(DIMENSIONS[name] for name in dimensions)
+        group_by = ", ".join(str(i + 1) for i in range(len(dimensions)))
+        query = f'''
+            SELECT {select}, SUM(e.amount), COUNT(*)
+            FROM expenses e
+            JOIN categories c ON e.category_id = c.id
+            JOIN payment_methods pm ON e.payment_method_id = pm.id
+        '''
+        conditions, params = self.db_manager.build_expense_filters(
+            user_id, start_date, end_date, category_id, alias='e'
+        )
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" GROUP BY {group_by}"
+
+        with self.db_manager.connect_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            cells = {tuple(row[:-2]): [row[-2], row[-1]] for row in cursor.fetchall()}
+
+        # Архивные расходы, если период доходит до границы архива
+        archived = self.db_manager.archive.aggregate(dimensions, user_id, start_date, end_date, category_id)
+        for labels, (total, count) in archived.items():
+            cell = cells.setdefault(labels, [0.0, 0])
+            cell[0] += total
+            cell[1] += count
+        return [(*labels, total, count) for labels, (total, count) in cells.items()]
+
+
+# Создаем глобальный экземпляр движка сводных таблиц
+pivot_engine = LazyInstance(PivotEngine)
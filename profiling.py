@@ -0,0 +1,144 @@
+"""
+Режим профилирования: cProfile и tracemalloc для действий интерфейса, отчетов и проверок
+"""
+
+import io
+import itertools
+import os
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Optional
+import logging
+from config import PROFILING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class Profiler:
+    """Профилирование отдельных действий без изменения кода вызывающей стороны.
+
+    Методы, помеченные @profiler.profile("имя"), в обычном режиме
+    вызываются напрямую. После enable() (переменная окружения из
+    PROFILING_CONFIG['env_var'] или флаг --profile) каждый вызов пишет в
+    output_dir файлы <имя>-<время>-<n>.pstats (cProfile), .tracemalloc
+    (снимок памяти) и .txt со сводкой самых затратных функций и мест
+    выделения памяти. Вложенные помеченные вызовы входят в профиль
+    внешнего. tracemalloc общий для процесса, поэтому в сводку памяти
+    попадают и выделения параллельных действий.
+    """
+
+    def __init__(self, output_dir: Optional[str] = None):
+        self.output_dir = output_dir or PROFILING_CONFIG['output_dir']
+        self.enabled = False
+        self._local = threading.local()
+        self._counter = itertools.count(1)
+
+    def enable(self, output_dir: Optional[str] = None):
+        """Включение профилирования; профили пишутся в output_dir"""
+        import tracemalloc
+
+        if output_dir:
+            self.output_dir = output_dir
+        os.makedirs(self.output_dir, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILING_CONFIG['tracemalloc_frames'])
+        self.enabled = True
+        logger.info(f"Профилирование включено, каталог: {os.path.abspath(self.output_dir)}")
+
+    def enable_from_env(self) -> bool:
+        """Включение по переменной окружения ("1"/"true" или путь к каталогу)"""
+        value = os.environ.get(PROFILING_CONFIG['env_var'], '').strip()
+        if not value or value.lower() in ('0', 'false', 'no', 'off'):
+            return False
+        self.enable(None if value.lower() in ('1', 'true', 'yes', 'on') else value)
+        return True
+
+    def disable(self):
+        import tracemalloc
+
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def profile(self, name: str) -> Callable:
+        """Декоратор профилирования действия name"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or getattr(self._local, 'active', False):
+                    return func(*args, **kwargs)
+                return self.run(name, func, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    def run(self, name: str, func: Callable, *args, **kwargs):
+        """Выполнение func под cProfile и tracemalloc с записью результатов"""
+        import cProfile
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILING_CONFIG['tracemalloc_frames'])
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        self._local.active = True
+        started = time.perf_counter()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            self._local.active = False
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            try:
+                self._write(name, profile, before, after, seconds, peak)
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить профиль {name}: {e}")
+
+    def _write(self, name: str, profile, before, after, seconds: float, peak: int) -> Dict[str, str]:
+        import pstats
+        import tracemalloc
+
+        base = os.path.join(self.output_dir,
+                            f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{next(self._counter)}")
+        files = {'pstats': base + '.pstats', 'memory': base + '.tracemalloc', 'summary': base + '.txt'}
+        profile.dump_stats(files['pstats'])
+        after.dump(files['memory'])
+
+        stats_text = io.StringIO()
+        pstats.Stats(profile, stream=stats_text).sort_stats('cumulative').print_stats(
+            PROFILING_CONFIG['top_functions'])
+
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        allocations = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+        top = sorted(allocations, key=lambda stat: stat.size_diff, reverse=True)[:PROFILING_CONFIG['top_allocators']]
+
+        lines = [f"Действие: {name}",
+                 f"Длительность: {seconds * 1000:.1f} мс",
+                 f"Пик памяти: {peak / 1024:.1f} КиБ",
+                 "",
+                 "Места выделения памяти (прирост):"]
+        for stat in top:
+            frame = stat.traceback[0]
+            lines.append(f"  {frame.filename}:{frame.lineno}: {stat.size_diff / 1024:+.1f} КиБ "
+                         f"({stat.count_diff:+d} блоков)")
+        lines += ["", "Функции (по накопленному времени):", stats_text.getvalue()]
+
+        with open(files['summary'], 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines))
+        logger.info(f"Профиль {name}: {seconds * 1000:.1f} мс, пик памяти {peak / 1024:.1f} КиБ, {base}.*")
+        return files
+
+
+# Создаем глобальный профилировщик
+profiler = Profiler()
+
+
+def profiled(name: str) -> Callable:
+    """Декоратор профилирования через глобальный профилировщик"""
+    return profiler.profile(name)
+
+
+# Включение без изменения кода: EXPENSE_TRACKER_PROFILE=1 python main.py
+profiler.enable_from_env()
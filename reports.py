@@ -1,9 +1,11 @@
-import sqlite3
 from collections import defaultdict
 from datetime import datetime, timedelta
 from typing import List, Dict, Tuple
 import logging
-from database import db_manager
+from database import LazyInstance, db_manager
+from pivot import PivotEngine
+from metrics import metrics
+from profiling import profiled
 
 logger = logging.getLogger(__name__)
 
@@ -12,9 +14,11 @@ REPORT_FILE = "monthly_report.txt"
 class ReportGenerator:
     """Класс для генерации различных отчетов"""
     
-    def __init__(self):
-        self.db_manager = db_manager
+    def __init__(self, db=None):
+        self.db_manager = db or db_manager
     
+    @metrics.timed("report.monthly")
+    @profiled("report.monthly")
     def generate_monthly_report(self, year: int = None, month: int = None) -> str:
         """Генерация месячного отчета"""
         try:
@@ -33,14 +37,22 @@ class ReportGenerator:
             report_content = self._format_monthly_report(year, month, analysis)
             
             # Сохраняем в файл
-            self._save_report_to_file(report_content, f"monthly_report_{year}_{month:02d}.txt")
+            filename = self.monthly_report_filename(year, month)
+            self._save_report_to_file(report_content, filename)
             
-            return f"Отчет за {year}-{month:02d} создан: monthly_report_{year}_{month:02d}.txt"
+            return f"Отчет за {year}-{month:02d} создан: {filename}"
             
         except Exception as e:
             logger.error(f"Ошибка генерации месячного отчета: {e}")
             raise
     
+    @staticmethod
+    def monthly_report_filename(year: int, month: int) -> str:
+        """Имя файла месячного отчета"""
+        return f"monthly_report_{year}_{month:02d}.txt"
+    
+    @metrics.timed("report.weekly")
+    @profiled("report.weekly")
     def generate_weekly_report(self, start_date: str = None) -> str:
         """Генерация недельного отчета"""
         try:
@@ -61,6 +73,8 @@ class ReportGenerator:
             logger.error(f"Ошибка генерации недельного отчета: {e}")
             raise
     
+    @metrics.timed("report.category_analysis")
+    @profiled("report.category_analysis")
     def generate_category_analysis(self, start_date: str = None, end_date: str = None) -> Dict:
         """Анализ расходов по категориям"""
         try:
@@ -71,6 +85,8 @@ class ReportGenerator:
             logger.error(f"Ошибка анализа по категориям: {e}")
             raise
     
+    @metrics.timed("report.payment_method_analysis")
+    @profiled("report.payment_method_analysis")
     def generate_payment_method_analysis(self, start_date: str = None, end_date: str = None) -> Dict:
         """Анализ расходов по способам оплаты"""
         try:
@@ -93,18 +109,24 @@ class ReportGenerator:
             logger.error(f"Ошибка анализа по способам оплаты: {e}")
             raise
     
+    @metrics.timed("report.daily_breakdown")
+    @profiled("report.daily_breakdown")
     def generate_daily_breakdown(self, start_date: str = None, end_date: str = None) -> Dict:
         """Разбивка расходов по дням"""
         try:
-            expenses = self.db_manager.get_expenses(start_date=start_date, end_date=end_date)
-            
-            daily_totals = defaultdict(float)
-            daily_categories = defaultdict(lambda: defaultdict(float))
-            
-            for date, amount, category, payment_method, description, expense_id in expenses:
-                day = date.split(' ')[0]  # Берем только дату без времени
-                daily_totals[day] += amount
-                daily_categories[day][category] += amount
+            # Один сгруппированный запрос день × категория вместо выборки всех строк
+            table = PivotEngine(self.db_manager).pivot(
+                rows='day', columns='category', start_date=start_date, end_date=end_date
+            )
+            
+            daily_totals = table.totals('day')
+            daily_categories = {}
+            for day in table.row_labels:
+                daily_categories[day] = {
+                    category: table.get(day, category)
+                    for category in table.column_labels
+                    if table.get(day, category)
+                }
             
             return {
                 'daily_totals': dict(daily_totals),
@@ -220,7 +242,7 @@ class ReportGenerator:
             raise
 
 # Создаем глобальный экземпляр генератора отчетов
-report_generator = ReportGenerator()
+report_generator = LazyInstance(ReportGenerator)
 
 # Функции для обратной совместимости
 def generate_monthly_report():
@@ -0,0 +1,283 @@
+"""
+Фоновый планировщик отчетов на основе REPORT_CONFIG
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+from config import REPORT_CONFIG
+from database import LazyInstance
+from reports import report_generator
+from utils import create_backup
+
+logger = logging.getLogger(__name__)
+
+REPORT_BACKUP_DIR = os.path.join("backups", "reports")
+
+
+class ReportJob:
+    """Задание на генерацию месячного отчета"""
+
+    def __init__(self, year: int, month: int, force: bool = False):
+        self.year = year
+        self.month = month
+        self.force = force
+        self.attempts = 0
+        self.run_at = time.time()
+        self.last_error: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        return f"monthly_{self.year}_{self.month:02d}"
+
+    def to_dict(self) -> Dict:
+        return {
+            'key': self.key,
+            'year': self.year,
+            'month': self.month,
+            'attempts': self.attempts,
+            'run_at': datetime.fromtimestamp(self.run_at).strftime("%Y-%m-%d %H:%M:%S"),
+            'last_error': self.last_error
+        }
+
+
+class ReportScheduler:
+    """Генерация отчетов в фоновом потоке.
+
+    Отчет считается актуальным, если отпечаток данных месяца (количество,
+    сумма и максимальный id расходов) совпадает с сохраненным в report_runs
+    и файл отчета существует. Неудачные задания повторяются с
+    экспоненциальной задержкой.
+    """
+
+    def __init__(self, generator=None, config: Dict = None,
+                 check_interval: float = 3600, max_retries: int = 3,
+                 retry_delay: float = 30):
+        self.report_generator = generator or report_generator
+        self.db_manager = self.report_generator.db_manager
+        self.config = config or REPORT_CONFIG
+        self.check_interval = check_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._queue: List[ReportJob] = []
+        self._last_runs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_check = 0.0
+
+        self._ensure_tables()
+
+    def _ensure_tables(self):
+        """Создание таблицы истории генерации отчетов"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS report_runs (
+                        report_key TEXT PRIMARY KEY,
+                        fingerprint TEXT NOT NULL,
+                        filename TEXT NOT NULL,
+                        generated_at TIMESTAMP,
+                        duration REAL
+                    )
+                ''')
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка создания таблицы report_runs: {e}")
+            raise
+
+    # Управление потоком
+
+    def start(self):
+        """Запуск фонового потока планировщика"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="report-scheduler", daemon=True)
+        self._thread.start()
+        logger.info("Планировщик отчетов запущен")
+
+    def stop(self, timeout: float = 5.0):
+        """Остановка планировщика"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info("Планировщик отчетов остановлен")
+
+    def _run(self):
+        while not self._stop.is_set():
+            if time.time() >= self._next_check:
+                self.schedule_due_reports()
+                self._next_check = time.time() + self.check_interval
+
+            job = self._pop_ready_job()
+            if job:
+                self._execute(job)
+                continue
+
+            self._wakeup.wait(self._seconds_until_next_event())
+            self._wakeup.clear()
+
+    def _seconds_until_next_event(self) -> float:
+        with self._lock:
+            next_event = min([job.run_at for job in self._queue] + [self._next_check])
+        return max(0.1, next_event - time.time())
+
+    # Очередь
+
+    def enqueue(self, year: int, month: int, force: bool = False) -> bool:
+        """Постановка месячного отчета в очередь (без дублей)"""
+        job = ReportJob(year, month, force)
+        with self._lock:
+            if any(queued.key == job.key for queued in self._queue):
+                return False
+            self._queue.append(job)
+        self._wakeup.set()
+        return True
+
+    def _pop_ready_job(self) -> Optional[ReportJob]:
+        now = time.time()
+        with self._lock:
+            ready = [job for job in self._queue if job.run_at <= now]
+            if not ready:
+                return None
+            job = min(ready, key=lambda j: j.run_at)
+            self._queue.remove(job)
+            return job
+
+    def schedule_due_reports(self) -> int:
+        """Постановка в очередь отчетов, которые пора сгенерировать"""
+        if not self.config.get('auto_generate_monthly'):
+            return 0
+
+        now = datetime.now()
+        previous = (now.year - 1, 12) if now.month == 1 else (now.year, now.month - 1)
+        scheduled = 0
+        for year, month in (previous, (now.year, now.month)):
+            if not self.is_up_to_date(year, month) and self.enqueue(year, month):
+                scheduled += 1
+        return scheduled
+
+    def get_queue(self) -> List[Dict]:
+        """Текущая очередь заданий"""
+        with self._lock:
+            return [job.to_dict() for job in sorted(self._queue, key=lambda j: j.run_at)]
+
+    def get_last_runs(self) -> Dict[str, Dict]:
+        """Результаты и длительность последних запусков"""
+        with self._lock:
+            return {key: dict(run) for key, run in self._last_runs.items()}
+
+    # Генерация
+
+    def _month_range(self, year: int, month: int) -> Tuple[str, str]:
+        start_date = f"{year:04d}-{month:02d}-01"
+        end_date = f"{year + 1:04d}-01-01" if month == 12 else f"{year:04d}-{month + 1:02d}-01"
+        return start_date, end_date
+
+    def _fingerprint(self, year: int, month: int) -> str:
+        """Отпечаток данных месяца, в том же диапазоне, что и get_monthly_expenses"""
+        start_date, end_date = self._month_range(year, month)
+        with self.db_manager.connect_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*), COALESCE(SUM(amount), 0), COALESCE(MAX(id), 0)
+                FROM expenses
+                WHERE DATE(date) >= ? AND DATE(date) <= ?
+            ''', (start_date, end_date))
+            count, total, max_id = cursor.fetchone()
+            return f"{count}:{total:.2f}:{max_id}"
+
+    def is_up_to_date(self, year: int, month: int) -> bool:
+        """Проверка, что отчет существует и соответствует данным"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT fingerprint, filename FROM report_runs WHERE report_key = ?',
+                               (f"monthly_{year}_{month:02d}",))
+                row = cursor.fetchone()
+            if not row or not os.path.exists(row['filename']):
+                return False
+            return row['fingerprint'] == self._fingerprint(year, month)
+        except sqlite3.Error as e:
+            logger.warning(f"Ошибка проверки актуальности отчета: {e}")
+            return False
+
+    def ensure_monthly_report(self, year: int = None, month: int = None) -> str:
+        """Синхронное получение отчета: генерация только если он устарел"""
+        if year is None or month is None:
+            now = datetime.now()
+            year, month = now.year, now.month
+
+        if self.is_up_to_date(year, month):
+            filename = self.report_generator.monthly_report_filename(year, month)
+            return f"Отчет за {year}-{month:02d} актуален: {filename}"
+
+        job = ReportJob(year, month, force=True)
+        return self._generate(job)
+
+    def _generate(self, job: ReportJob) -> str:
+        fingerprint = self._fingerprint(job.year, job.month)
+        started = time.time()
+        message = self.report_generator.generate_monthly_report(job.year, job.month)
+        duration = time.time() - started
+        filename = self.report_generator.monthly_report_filename(job.year, job.month)
+
+        if self.config.get('backup_reports'):
+            create_backup(filename, REPORT_BACKUP_DIR)
+
+        with self.db_manager.connect_db() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO report_runs (report_key, fingerprint, filename, generated_at, duration)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (job.key, fingerprint, filename,
+                  datetime.now().strftime("%Y-%m-%d %H:%M:%S"), duration))
+            conn.commit()
+
+        self._record_run(job, 'generated', started, duration)
+        return message
+
+    def _execute(self, job: ReportJob):
+        """Выполнение задания с повтором при ошибке"""
+        started = time.time()
+        job.attempts += 1
+        try:
+            if not job.force and self.is_up_to_date(job.year, job.month):
+                self._record_run(job, 'skipped', started, time.time() - started)
+                return
+            self._generate(job)
+            logger.info(f"Фоновый отчет {job.key} создан")
+        except Exception as e:
+            job.last_error = str(e)
+            if job.attempts < self.max_retries:
+                job.run_at = time.time() + self.retry_delay * 2 ** (job.attempts - 1)
+                with self._lock:
+                    self._queue.append(job)
+                logger.warning(f"Ошибка генерации отчета {job.key} (попытка {job.attempts}): {e}")
+                self._record_run(job, 'retrying', started, time.time() - started)
+            else:
+                logger.error(f"Отчет {job.key} не создан после {job.attempts} попыток: {e}")
+                self._record_run(job, 'failed', started, time.time() - started)
+
+    def _record_run(self, job: ReportJob, status: str, started: float, duration: float):
+        with self._lock:
+            self._last_runs[job.key] = {
+                'status': status,
+                'attempts': job.attempts,
+                'started_at': datetime.fromtimestamp(started).strftime("%Y-%m-%d %H:%M:%S"),
+                'duration': duration,
+                'error': job.last_error
+            }
+
+
+# Создаем глобальный экземпляр планировщика
+report_scheduler = LazyInstance(ReportScheduler)
@@ -0,0 +1,562 @@
+"""
+Локальный HTTP/JSON API трекера расходов на asyncio (только стандартная библиотека)
+
+Маршруты:
+    GET    /health
+    GET    /expenses?from=&to=&category=&user=&limit=&after_date=&after_id=
+    POST   /expenses             {"amount", "category", "payment_method", "description", "date", "user"}
+    DELETE /expenses/<id>
+    GET    /aggregates?from=&to=&user=
+    GET    /reports/<categories|methods|daily>?from=&to=
+    GET    /notifications?user=
+    GET    /metrics
+"""
+
+import argparse
+import asyncio
+import json
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http import HTTPStatus
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+import logging
+from config import IMPORT_CONFIG, SERVER_CONFIG
+from database import DB_NAME, DatabaseManager
+from metrics import TimedConnection, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    """Ошибка запроса с кодом ответа"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class PooledConnection(sqlite3.Connection):
+    """Подключение из пула: close() из кода DatabaseManager его не закрывает"""
+
+    def close(self):
+        pass
+
+    def close_pooled(self):
+        super().close()
+
+
+class TimedPooledConnection(TimedConnection, PooledConnection):
+    """Подключение из пула с замером запросов"""
+
+
+class ConnectionPool:
+    """Ограниченный пул подключений к SQLite в режиме WAL.
+
+    В WAL читатели не блокируются писателем, поэтому чтения продолжаются
+    во время записи. Подключения создаются по мере надобности, но не
+    больше size; при исчерпании пула acquire ждет timeout секунд.
+    """
+
+    def __init__(self, db_name: str, size: int = SERVER_CONFIG['pool_size'],
+                 instrumented: bool = True, busy_timeout_ms: int = SERVER_CONFIG['busy_timeout_ms']):
+        self.db_name = db_name
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.factory = TimedPooledConnection if instrumented else PooledConnection
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+        # Режим журнала сохраняется в файле БД
+        conn = sqlite3.connect(db_name)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка включения WAL: {e}")
+            raise
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_name, factory=self.factory, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def acquire(self, timeout: float = 5.0) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("Пул подключений закрыт")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except sqlite3.Error:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "Нет свободных подключений к БД")
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close_pooled()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close_pooled()
+            except queue.Empty:
+                break
+
+
+class PooledDatabaseManager(DatabaseManager):
+    """DatabaseManager, методы которого работают через подключение из пула.
+
+    Подключение закрепляется за потоком на время обработки запроса
+    (bind()); вне запроса connect_db() открывает обычное подключение.
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self._local = threading.local()
+        super().__init__(pool.db_name, instrumented=pool.factory is TimedPooledConnection)
+
+    @contextmanager
+    def bind(self):
+        with self.pool.connection() as conn:
+            self._local.conn = conn
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+
+    def connect_db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        return conn if conn is not None else super().connect_db()
+
+
+class ExpenseAPI:
+    """Обработчики маршрутов: синхронные функции, выполняемые в пуле потоков"""
+
+    def __init__(self, db: PooledDatabaseManager):
+        self.db_manager = db
+        self._write_lock = threading.Lock()
+        self._reports = None
+        self._notifications = None
+
+    @staticmethod
+    def _param(query: Dict, name: str, default=None):
+        values = query.get(name)
+        return values[0] if values else default
+
+    def _int_param(self, query: Dict, name: str, default: Optional[int] = None) -> Optional[int]:
+        value = self._param(query, name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Параметр {name} должен быть числом")
+
+    def _user_id(self, name: Optional[str], create: bool = False) -> Optional[int]:
+        if not name:
+            return None
+        user_id = self.db_manager.get_user_id(name)
+        if user_id is None:
+            if not create:
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"Пользователь не найден: {name}")
+            user_id = self.db_manager.add_user(name)
+        return user_id
+
+    def _category_id(self, name: Optional[str]) -> Optional[int]:
+        if not name:
+            return None
+        category_id = self.db_manager.get_category_id(name)
+        if category_id is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Категория не найдена: {name}")
+        return category_id
+
+    def _filters(self, query: Dict) -> Dict:
+        return {
+            'user_id': self._user_id(self._param(query, 'user')),
+            'start_date': self._param(query, 'from'),
+            'end_date': self._param(query, 'to'),
+        }
+
+    def health(self, query: Dict, body=None) -> Dict:
+        return {'status': 'ok'}
+
+    def list_expenses(self, query: Dict, body=None) -> Dict:
+        """Страница расходов (новые первыми) с курсором на следующую"""
+        limit = max(1, min(self._int_param(query, 'limit', SERVER_CONFIG['page_size']),
+                           SERVER_CONFIG['max_page_size']))
+        after_date, after_id = self._param(query, 'after_date'), self._int_param(query, 'after_id')
+        after = (after_date, after_id) if after_date and after_id is not None else None
+        rows = self.db_manager.get_expenses_page(after, limit, category_id=self._category_id(
+            self._param(query, 'category')), **self._filters(query))
+        items = [{'id': row[5], 'date': row[0], 'amount': row[1], 'category': row[2],
+                  'payment_method': row[3], 'description': row[4]} for row in rows]
+        next_cursor = {'after_date': rows[-1][0], 'after_id': rows[-1][5]} if len(rows) == limit else None
+        return {'items': items, 'next': next_cursor}
+
+    def add_expense(self, query: Dict, body: Optional[Dict]) -> Tuple[int, Dict]:
+        """Добавление расхода; категория и способ оплаты создаются при необходимости"""
+        from utils import validate_amount, validate_category, validate_date
+
+        if body is not None and not isinstance(body, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Тело запроса должно быть JSON-объектом")
+        body = body or {}
+        valid, amount, error = validate_amount(str(body.get('amount', '')))
+        category = str(body.get('category', '')).strip()
+        category_ok, category_error = validate_category(category)
+        if not valid or not category_ok:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, error or category_error)
+        date = None
+        if body.get('date'):
+            date_ok, date, date_error = validate_date(str(body['date']))
+            if not date_ok:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, date_error)
+        method = str(body.get('payment_method') or IMPORT_CONFIG['default_payment_method']).strip()
+
+        # Запись одна за раз: в SQLite писатель и так один, а так не ждем busy_timeout
+        with self._write_lock:
+            user_id = self._user_id(body.get('user') or 'default_user', create=True)
+            expense_id = self.db_manager.add_expense(
+                user_id, self.db_manager.add_category(category), self.db_manager.add_payment_method(method),
+                amount, str(body.get('description', '')), date)
+        return HTTPStatus.CREATED, {'id': expense_id}
+
+    def delete_expense(self, query: Dict, body=None, expense_id: str = '') -> Dict:
+        try:
+            expense_id = int(expense_id)
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Некорректный id")
+        with self._write_lock:
+            if not self.db_manager.delete_expense(expense_id):
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"Расход {expense_id} не найден")
+        return {'deleted': expense_id}
+
+    def aggregates(self, query: Dict, body=None) -> Dict:
+        """Итоги и суммы по категориям одним сгруппированным запросом (с архивом)"""
+        filters = self._filters(query)
+        conditions, params = self.db_manager.build_expense_filters(alias='e', **filters)
+        sql = '''
+            SELECT c.name, SUM(e.amount), COUNT(*)
+            FROM expenses e JOIN categories c ON e.category_id = c.id
+        '''
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " GROUP BY c.name ORDER BY 2 DESC"
+        with self.db_manager.connect_db() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        categories = {row[0]: {'total': row[1], 'count': row[2]} for row in rows}
+        archived = self.db_manager.archive.aggregate(['category'], **filters)
+        for (category,), (total, count) in archived.items():
+            item = categories.setdefault(category, {'total': 0.0, 'count': 0})
+            item['total'] += total
+            item['count'] += count
+        if archived:
+            categories = dict(sorted(categories.items(), key=lambda item: item[1]['total'], reverse=True))
+        return {
+            'total': sum(item['total'] for item in categories.values()),
+            'count': sum(item['count'] for item in categories.values()),
+            'categories': categories
+        }
+
+    def report(self, query: Dict, body=None, kind: str = '') -> Dict:
+        from reports import ReportGenerator
+
+        if self._reports is None:
+            self._reports = ReportGenerator(self.db_manager)
+        builders = {
+            'categories': self._reports.generate_category_analysis,
+            'methods': self._reports.generate_payment_method_analysis,
+            'daily': self._reports.generate_daily_breakdown,
+        }
+        if kind not in builders:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"Неизвестный отчет: {kind}")
+        return builders[kind](self._param(query, 'from'), self._param(query, 'to'))
+
+    def notifications(self, query: Dict, body=None) -> Dict:
+        from notifications import NotificationManager
+
+        if self._notifications is None:
+            self._notifications = NotificationManager(self.db_manager)
+        return self._notifications.analyze(self._user_id(self._param(query, 'user')))
+
+    def metrics(self, query: Dict, body=None) -> Dict:
+        return metrics.snapshot()
+
+
+# (метод, первый сегмент пути) -> (обработчик, кэшируется ли ответ, есть ли параметр в пути)
+ROUTES = {
+    ('GET', 'health'): ('health', False, False),
+    ('GET', 'expenses'): ('list_expenses', True, False),
+    ('POST', 'expenses'): ('add_expense', False, False),
+    ('DELETE', 'expenses'): ('delete_expense', False, True),
+    ('GET', 'aggregates'): ('aggregates', True, False),
+    ('GET', 'reports'): ('report', True, True),
+    ('GET', 'notifications'): ('notifications', True, False),
+    ('GET', 'metrics'): ('metrics', False, False),
+}
+
+
+class ExpenseServer:
+    """Асинхронный HTTP-сервер с кэшем ответов по поколению данных.
+
+    Поколение — PRAGMA data_version отдельного подключения, которое
+    ничего не пишет: значение меняется после любой фиксации изменений
+    другим подключением (пул сервера, настольное приложение, CLI), — и
+    счетчик записей самого сервера. ETag ответа GET строится из
+    поколения, поэтому повторные чтения без изменений отдаются из кэша
+    или кодом 304 без обращения к БД, а одинаковые одновременные промахи
+    кэша выполняют запрос один раз.
+    """
+
+    def __init__(self, db_name: str = DB_NAME, host: str = SERVER_CONFIG['host'],
+                 port: int = SERVER_CONFIG['port'], pool_size: int = SERVER_CONFIG['pool_size'],
+                 cache_entries: int = SERVER_CONFIG['cache_entries']):
+        self.host = host
+        self.port = port
+        self.pool = ConnectionPool(db_name, pool_size)
+        self.db_manager = PooledDatabaseManager(self.pool)
+        self.api = ExpenseAPI(self.db_manager)
+        self.cache_entries = cache_entries
+        self._cache: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="api-worker")
+        self._watch = sqlite3.connect(db_name, check_same_thread=False)
+        self._watch_lock = threading.Lock()
+        self._instance = uuid.uuid4().hex[:8]
+        self.writes = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def generation(self) -> str:
+        with self._watch_lock:
+            data_version = self._watch.execute('PRAGMA data_version').fetchone()[0]
+        return f"{self._instance}-{data_version}-{self.writes}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"API запущен: http://{self.host}:{self.port}")
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+        self._watch.close()
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._send(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                                     {'error': "Слишком большие заголовки"}, keep_alive=False)
+                    break
+
+                lines = head.decode('latin-1').split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    await self._send(writer, HTTPStatus.BAD_REQUEST, {'error': "Некорректный запрос"},
+                                     keep_alive=False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length') or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self._send(writer, HTTPStatus.BAD_REQUEST,
+                                     {'error': "Некорректный заголовок Content-Length"}, keep_alive=False)
+                    break
+                if length > SERVER_CONFIG['max_body_bytes']:
+                    await self._send(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                     {'error': "Слишком большое тело запроса"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version.upper() == 'HTTP/1.1')
+                await self._dispatch(writer, method.upper(), target, headers, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, writer, method: str, target: str, headers: Dict, body: bytes, keep_alive: bool):
+        started = time.perf_counter()
+        url = urlsplit(target)
+        segments = [segment for segment in url.path.split("/") if segment]
+        route = ROUTES.get((method, segments[0] if segments else ''))
+        route_name = f"{method} /{segments[0]}" if route else "unknown"
+        status = HTTPStatus.OK
+        try:
+            if route is None or len(segments) != (2 if route[2] else 1):
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"Маршрут не найден: {method} {url.path}")
+            handler_name, cacheable, _ = route
+            query = parse_qs(url.query)
+            payload = None
+            if body:
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, "Тело запроса должно быть JSON")
+            handler = getattr(self.api, handler_name)
+            call = lambda: handler(query, payload, *segments[1:2])
+
+            if cacheable:
+                status, etag, data = await self._cached(target, call, headers.get('if-none-match'))
+                await self._write(writer, status, data, keep_alive, etag)
+            else:
+                result = await self._run(call)
+                if isinstance(result, tuple):
+                    status, result = result
+                if method != 'GET':
+                    self.writes += 1
+                await self._send(writer, status, result, keep_alive)
+        except HTTPError as e:
+            status = e.status
+            await self._send(writer, status, {'error': str(e)}, keep_alive)
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Ошибка обработки {method} {target}: {e}")
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            await self._send(writer, status, {'error': str(e)}, keep_alive)
+        except ConnectionError:
+            raise
+        except Exception:
+            # Ошибка обработчика не должна обрывать соединение без ответа
+            logger.exception(f"Необработанная ошибка {method} {target}")
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            await self._send(writer, status, {'error': "Внутренняя ошибка сервера"}, keep_alive)
+        finally:
+            seconds = time.perf_counter() - started
+            metrics.observe(f"http.{route_name}", seconds)
+            logger.debug(f"{method} {target} {int(status)} {seconds * 1000:.1f} мс")
+
+    async def _run(self, call: Callable):
+        """Выполнение обработчика в пуле потоков с подключением из пула"""
+        def bound():
+            with self.db_manager.bind():
+                return call()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, bound)
+
+    async def _cached(self, key: str, call: Callable, if_none_match: Optional[str]) -> Tuple[int, str, bytes]:
+        generation = self.generation()
+        etag = f'"{generation}-{hash(key) & 0xffffffff:08x}"'
+        if if_none_match == etag:
+            return HTTPStatus.NOT_MODIFIED, etag, b""
+
+        cached = self._cache.get(key)
+        if cached and cached[0] == generation:
+            self._cache.move_to_end(key)
+            return HTTPStatus.OK, etag, cached[1]
+
+        # Одинаковые одновременные промахи ждут один и тот же запрос
+        inflight_key = f"{generation} {key}"
+        future = self._inflight.get(inflight_key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(call))
+            self._inflight[inflight_key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(inflight_key, None))
+        data = self._encode(await asyncio.shield(future))
+
+        self._cache[key] = (generation, data)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+        return HTTPStatus.OK, etag, data
+
+    @staticmethod
+    def _encode(payload) -> bytes:
+        return json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+
+    async def _send(self, writer, status: int, payload, keep_alive: bool):
+        await self._write(writer, status, self._encode(payload), keep_alive)
+
+    @staticmethod
+    async def _write(writer, status: int, data: bytes, keep_alive: bool, etag: Optional[str] = None):
+        status = HTTPStatus(status)
+        headers = [f"HTTP/1.1 {status.value} {status.phrase}",
+                   "Content-Type: application/json; charset=utf-8",
+                   f"Content-Length: {len(data)}",
+                   f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if etag:
+            headers.append(f"ETag: {etag}")
+            headers.append("Cache-Control: no-cache")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode('latin-1') + data)
+        await writer.drain()
+
+
+def main(argv=None) -> int:
+    """python server.py --port 8765 --db expenses.db"""
+    from metrics import configure_logging
+
+    parser = argparse.ArgumentParser(description="HTTP API трекера расходов")
+    parser.add_argument('--host', default=SERVER_CONFIG['host'])
+    parser.add_argument('--port', type=int, default=SERVER_CONFIG['port'])
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--pool-size', type=int, default=SERVER_CONFIG['pool_size'])
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    server = ExpenseServer(args.db, args.host, args.port, args.pool_size)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        metrics.dump()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,366 @@
+"""
+Потоковые квантильные скетчи (t-digest) для распределения расходов
+"""
+
+import json
+import math
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+from changes import ChangeJournal
+from config import SKETCH_CONFIG
+from database import LazyInstance, db_manager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMPRESSION = SKETCH_CONFIG['compression']
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+class TDigest:
+    """Сливаемый t-digest: приближенные квантили в памяти O(compression)"""
+
+    def __init__(self, compression: float = DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.centroids: List[List[float]] = []  # [среднее, вес], по возрастанию среднего
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer: List[Tuple[float, float]] = []
+        self._buffer_limit = int(compression * 5)
+
+    def add(self, value: float, weight: float = 1.0):
+        """Добавление значения"""
+        self._buffer.append((value, weight))
+        self.count += weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self._buffer) >= self._buffer_limit:
+            self._compress()
+
+    def merge(self, other: 'TDigest'):
+        """Слияние с другим скетчем (например, из другой партиции)"""
+        if other.count == 0:
+            return
+        other._compress()
+        self._buffer.extend((mean, weight) for mean, weight in other.centroids)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def _k(self, q: float) -> float:
+        """Масштабирующая функция k1: мельче центроиды на хвостах"""
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _compress(self):
+        """Слияние буфера с центроидами"""
+        if not self._buffer:
+            return
+        points = sorted(
+            [(mean, weight) for mean, weight in self.centroids] + self._buffer
+        )
+        self._buffer = []
+
+        total = sum(weight for _, weight in points)
+        merged = [list(points[0])]
+        cumulative = 0.0
+        k_left = self._k(0.0)
+
+        for mean, weight in points[1:]:
+            current = merged[-1]
+            q_right = (cumulative + current[1] + weight) / total
+            if self._k(min(q_right, 1.0)) - k_left <= 1.0:
+                new_weight = current[1] + weight
+                current[0] += (mean - current[0]) * weight / new_weight
+                current[1] = new_weight
+            else:
+                cumulative += current[1]
+                k_left = self._k(cumulative / total)
+                merged.append([mean, weight])
+
+        self.centroids = merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Приближенное значение квантиля q (0..1)"""
+        self._compress()
+        if not self.centroids:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+
+        target = q * self.count
+        cumulative = 0.0
+        left_position, left_value = 0.0, self.min
+
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target < center:
+                span = center - left_position
+                fraction = (target - left_position) / span if span > 0 else 0.0
+                return left_value + fraction * (mean - left_value)
+            left_position, left_value = center, mean
+            cumulative += weight
+
+        span = self.count - left_position
+        fraction = (target - left_position) / span if span > 0 else 1.0
+        return left_value + fraction * (self.max - left_value)
+
+    def to_dict(self) -> Dict:
+        """Сериализация для хранения в БД"""
+        self._compress()
+        return {
+            'compression': self.compression,
+            'count': self.count,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'centroids': [[round(mean, 6), weight] for mean, weight in self.centroids]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TDigest':
+        """Восстановление скетча из сериализованного вида"""
+        digest = cls(data.get('compression', DEFAULT_COMPRESSION))
+        digest.centroids = [list(pair) for pair in data.get('centroids', [])]
+        digest.count = data.get('count', 0.0)
+        if digest.count:
+            digest.min = data['min']
+            digest.max = data['max']
+        return digest
+
+
+class SketchStore:
+    """Хранилище скетчей по пользователям и категориям.
+
+    Скетчи хранятся в таблице spend_sketches рядом с расходами и
+    обновляются по журналу изменений (changes.py) с контрольной точкой
+    потребителя 'sketches': sync() перед каждым чтением применяет
+    изменения из любого процесса (GUI, CLI, HTTP API) ровно один раз.
+    Удаление из t-digest невозможно, поэтому удаленные расходы
+    увеличивают stale_count скетча; когда их доля превышает
+    SKETCH_CONFIG['stale_ratio'], get_sketch() пересчитывает эту пару
+    пользователь/категория по таблице расходов и архиву. Перенос в архив
+    скетчи не меняет: пересчеты тоже учитывают архивные расходы.
+    """
+
+    CONSUMER = 'sketches'
+
+    def __init__(self, db=None, compression: float = DEFAULT_COMPRESSION):
+        self.db_manager = db or db_manager
+        self.compression = compression
+        self.journal = ChangeJournal(self.db_manager)
+        self._ensure_tables()
+
+    def _ensure_tables(self):
+        """Создание таблицы скетчей и первичное заполнение"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS spend_sketches (
+                        user_id INTEGER NOT NULL,
+                        category_id INTEGER NOT NULL,
+                        sketch TEXT NOT NULL,
+                        stale_count INTEGER DEFAULT 0,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (user_id, category_id)
+                    )
+                ''')
+                conn.commit()
+
+            # Без контрольной точки (новая БД или скетчи до журнала) — пересчет
+            if not self.journal.has_consumer(self.CONSUMER):
+                self.rebuild()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка создания таблицы скетчей: {e}")
+            raise
+
+    def _load(self, cursor: sqlite3.Cursor, user_id: int, category_id: int) -> TDigest:
+        cursor.execute('SELECT sketch FROM spend_sketches WHERE user_id = ? AND category_id = ?',
+                       (user_id, category_id))
+        row = cursor.fetchone()
+        if row:
+            return TDigest.from_dict(json.loads(row[0]))
+        return TDigest(self.compression)
+
+    def _save(self, cursor: sqlite3.Cursor, user_id: int, category_id: int, digest: TDigest):
+        cursor.execute('''
+            INSERT INTO spend_sketches (user_id, category_id, sketch, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, category_id) DO UPDATE SET
+                sketch = excluded.sketch, updated_at = excluded.updated_at
+        ''', (user_id, category_id, json.dumps(digest.to_dict()),
+              datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+    def sync(self) -> int:
+        """Применение новых изменений журнала; возвращает их число"""
+        return self.journal.apply(self.CONSUMER, self._apply_changes)
+
+    def _apply_changes(self, cursor: sqlite3.Cursor, changes: List[Dict]):
+        """Обновление скетчей порцией журнала (один раз на пару
+        пользователь/категория в порции)"""
+        amounts: Dict[Tuple[int, int], List[float]] = defaultdict(list)
+        stale: Dict[Tuple[int, int], int] = defaultdict(int)
+        for change in changes:
+            old, new = change['old'], change['new']
+            if change['op'] == 'update' and all(old[field] == new[field]
+                                                for field in ('user_id', 'category_id', 'amount')):
+                continue
+            if change['op'] in ('insert', 'update'):
+                amounts[(new['user_id'], new['category_id'])].append(new['amount'])
+            if change['op'] in ('update', 'delete'):
+                stale[(old['user_id'], old['category_id'])] += 1
+
+        for (user_id, category_id), values in amounts.items():
+            digest = self._load(cursor, user_id, category_id)
+            for value in values:
+                digest.add(value)
+            self._save(cursor, user_id, category_id, digest)
+        cursor.executemany('''
+            UPDATE spend_sketches SET stale_count = stale_count + ?
+            WHERE user_id = ? AND category_id = ?
+        ''', [(count, user_id, category_id) for (user_id, category_id), count in stale.items()])
+
+    def _archived_amounts(self, cursor: sqlite3.Cursor) -> List[Tuple[int, int, float]]:
+        """Архивные расходы (user_id, category_id, amount) на текущую границу архива"""
+        before = self.db_manager.archived_before(cursor)
+        if not before:
+            return []
+        return [(row[1], row[2], row[4]) for row in self.db_manager.archive.get_rows(before=before)]
+
+    def _rebuild_partitions(self, cursor: sqlite3.Cursor, keys: List[Tuple[int, int]]):
+        """Пересчет скетчей отдельных пар пользователь/категория (архив, затем таблица расходов)"""
+        digests = {key: TDigest(self.compression) for key in keys}
+        for user_id, category_id, amount in self._archived_amounts(cursor):
+            digest = digests.get((user_id, category_id))
+            if digest is not None:
+                digest.add(amount)
+        pairs = ", ".join("(?, ?)" for _ in keys)
+        params = [value for key in keys for value in key]
+        cursor.execute(f'''
+            SELECT user_id, category_id, amount FROM expenses
+            WHERE (user_id, category_id) IN (VALUES {pairs})
+        ''', params)
+        for user_id, category_id, amount in cursor.fetchall():
+            digests[(user_id, category_id)].add(amount)
+
+        cursor.execute(f'DELETE FROM spend_sketches WHERE (user_id, category_id) IN (VALUES {pairs})', params)
+        for (user_id, category_id), digest in digests.items():
+            if digest.count:
+                self._save(cursor, user_id, category_id, digest)
+        logger.info(f"Пересчитаны устаревшие скетчи: {len(keys)}")
+
+    def rebuild(self):
+        """Полный пересчет скетчей по архиву и таблице расходов.
+
+        Выполняется в транзакции BEGIN IMMEDIATE и сдвигает контрольную
+        точку на конец журнала, поэтому учтенные изменения не применяются
+        повторно.
+        """
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                digests: Dict[Tuple[int, int], TDigest] = {}
+                for user_id, category_id, amount in self._archived_amounts(cursor):
+                    key = (user_id, category_id)
+                    if key not in digests:
+                        digests[key] = TDigest(self.compression)
+                    digests[key].add(amount)
+                cursor.execute('SELECT user_id, category_id, amount FROM expenses')
+                while True:
+                    rows = cursor.fetchmany(5000)
+                    if not rows:
+                        break
+                    for user_id, category_id, amount in rows:
+                        key = (user_id, category_id)
+                        if key not in digests:
+                            digests[key] = TDigest(self.compression)
+                        digests[key].add(amount)
+
+                cursor.execute('DELETE FROM spend_sketches')
+                for (user_id, category_id), digest in digests.items():
+                    self._save(cursor, user_id, category_id, digest)
+                self.journal.commit(self.CONSUMER, self.journal.latest_seq(cursor), cursor)
+                conn.commit()
+                logger.info(f"Скетчи пересчитаны: {len(digests)}")
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка пересчета скетчей: {e}")
+            raise
+
+    def get_sketch(self, category_id: Optional[int] = None,
+                   user_id: Optional[int] = None) -> TDigest:
+        """Скетч по категории и/или пользователю (слияние партиций)"""
+        self.sync()
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                query = 'SELECT sketch, user_id, category_id, stale_count FROM spend_sketches'
+                conditions = []
+                params = []
+
+                if user_id:
+                    conditions.append("user_id = ?")
+                    params.append(user_id)
+
+                if category_id:
+                    conditions.append("category_id = ?")
+                    params.append(category_id)
+
+                if conditions:
+                    query += " WHERE " + " AND ".join(conditions)
+
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                stale = [(row[1], row[2]) for row in rows
+                         if row[3] > json.loads(row[0])['count'] * SKETCH_CONFIG['stale_ratio']]
+                if stale:
+                    self._rebuild_partitions(cursor, stale)
+                    conn.commit()
+                    cursor.execute(query, params)
+                    rows = cursor.fetchall()
+                return merge_sketches(
+                    TDigest.from_dict(json.loads(row[0])) for row in rows
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка получения скетча: {e}")
+            raise
+
+    def get_spend_distribution(self, category: Optional[str] = None,
+                               quantiles: Iterable[float] = DEFAULT_QUANTILES,
+                               user_id: Optional[int] = None) -> Dict:
+        """Квантили сумм расходов по категории (None — по всем категориям)"""
+        category_id = None
+        if category:
+            category_id = self.db_manager.get_category_id(category)
+            if category_id is None:
+                return {'count': 0, 'quantiles': {}}
+
+        digest = self.get_sketch(category_id, user_id)
+        return {
+            'count': int(digest.count),
+            'min': digest.min if digest.count else None,
+            'max': digest.max if digest.count else None,
+            'quantiles': {q: digest.quantile(q) for q in quantiles} if digest.count else {}
+        }
+
+
+def merge_sketches(digests: Iterable[TDigest],
+                   compression: float = DEFAULT_COMPRESSION) -> TDigest:
+    """Слияние нескольких скетчей в один"""
+    result = TDigest(compression)
+    for digest in digests:
+        result.merge(digest)
+    return result
+
+
+# Создаем глобальный экземпляр хранилища скетчей
+sketch_store = LazyInstance(SketchStore)
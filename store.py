@@ -0,0 +1,165 @@
+"""
+Наблюдаемое хранилище агрегатов расходов для интерфейса
+"""
+
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+from database import LazyInstance, db_manager
+
+logger = logging.getLogger(__name__)
+
+# Пакеты больше этого размера передаются подписчикам одним событием 'reload'
+SUBSCRIBER_BATCH_LIMIT = 100
+
+
+class ExpenseStore:
+    """Текущие агрегаты расходов с обновлением по изменениям.
+
+    Агрегаты (общая сумма, суммы и количества по категориям, количества
+    по способам оплаты, суммы по месяцам) загружаются одним
+    сгруппированным запросом, а затем обновляются за O(1) на каждую
+    вставку/удаление через слушатель DatabaseManager. Подписчики получают
+    изменение в виде строки в формате get_expenses().
+    """
+
+    def __init__(self, db=None, user_id: Optional[int] = None):
+        self.db_manager = db or db_manager
+        self.user_id = user_id
+        self._lock = threading.Lock()
+        self._subscribers: List[Callable[[str, Tuple], None]] = []
+        self._names: Dict[Tuple[str, int], str] = {}
+        self.loaded = False
+        self._clear()
+        self.db_manager.add_listener(self._on_expense_change)
+
+    def _clear(self):
+        self.total = 0.0
+        self.count = 0
+        self.category_totals: Dict[str, float] = defaultdict(float)
+        self.category_counts: Dict[str, int] = defaultdict(int)
+        self.method_counts: Dict[str, int] = defaultdict(int)
+        self.month_totals: Dict[str, float] = defaultdict(float)
+
+    def load(self):
+        """Загрузка агрегатов одним запросом"""
+        query = '''
+            SELECT c.name, pm.method_name, strftime('%Y-%m', e.date), SUM(e.amount), COUNT(*)
+            FROM expenses e
+            JOIN categories c ON e.category_id = c.id
+            JOIN payment_methods pm ON e.payment_method_id = pm.id
+        '''
+        conditions, params = self.db_manager.build_expense_filters(self.user_id, alias='e')
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " GROUP BY 1, 2, 3"
+
+        # Итоги месяцев, перенесенных в архив
+        query += '''
+            UNION ALL
+            SELECT c.name, pm.method_name, r.month, SUM(r.total), SUM(r.count)
+            FROM expense_rollups r
+            JOIN categories c ON r.category_id = c.id
+            JOIN payment_methods pm ON r.payment_method_id = pm.id
+        '''
+        if self.user_id:
+            query += " WHERE r.user_id = ?"
+            params.append(self.user_id)
+        query += " GROUP BY 1, 2, 3"
+
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка загрузки агрегатов расходов: {e}")
+            raise
+
+        with self._lock:
+            self._clear()
+            for category, method, month, total, count in rows:
+                self._apply(category, method, month, total, count)
+            self.loaded = True
+
+    def _apply(self, category: str, method: str, month: str, amount: float, count: int):
+        self.total += amount
+        self.count += count
+        self.category_totals[category] += amount
+        self.category_counts[category] += count
+        self.method_counts[method] += count
+        self.month_totals[month] += amount
+        for counts, key in ((self.category_counts, category), (self.method_counts, method)):
+            if counts[key] <= 0:
+                del counts[key]
+                if counts is self.category_counts:
+                    del self.category_totals[key]
+
+    def _name(self, cursor: sqlite3.Cursor, table: str, column: str, row_id: int) -> str:
+        key = (table, row_id)
+        if key not in self._names:
+            cursor.execute(f'SELECT {column} FROM {table} WHERE id = ?', (row_id,))
+            row = cursor.fetchone()
+            self._names[key] = row[0] if row else ''
+        return self._names[key]
+
+    def _on_expense_change(self, event: str, expenses: List[Dict], cursor: sqlite3.Cursor):
+        """Применение изменений к агрегатам и оповещение подписчиков"""
+        if not self.loaded:
+            return
+        if self.user_id:
+            expenses = [expense for expense in expenses if expense['user_id'] == self.user_id]
+
+        rows = []
+        sign = 1 if event == 'insert' else -1
+        for expense in expenses:
+            category = self._name(cursor, 'categories', 'name', expense['category_id'])
+            method = self._name(cursor, 'payment_methods', 'method_name', expense['payment_method_id'])
+            rows.append((expense['date'], expense['amount'], category, method,
+                         expense.get('description', ''), expense['id']))
+        with self._lock:
+            for row in rows:
+                self._apply(row[2], row[3], row[0][:7], sign * row[1], sign)
+
+        # Большой пакет (импорт) — одно событие 'reload' вместо события на строку
+        events = [(event, row) for row in rows] if len(rows) <= SUBSCRIBER_BATCH_LIMIT else [('reload', None)]
+        for callback in list(self._subscribers):
+            for change in events:
+                try:
+                    callback(*change)
+                except Exception as e:
+                    logger.warning(f"Ошибка подписчика хранилища: {e}")
+
+    def subscribe(self, callback: Callable[[str, Tuple], None]) -> Callable[[], None]:
+        """Подписка на изменения; возвращает функцию отписки.
+
+        callback(event, row) вызывается в потоке, выполнившем изменение;
+        после большой пакетной вставки — один раз с ('reload', None).
+        """
+        self._subscribers.append(callback)
+        return lambda: self._subscribers.remove(callback)
+
+    def category_summary(self) -> List[Tuple[str, float]]:
+        """Суммы по категориям по убыванию"""
+        with self._lock:
+            return sorted(self.category_totals.items(), key=lambda item: item[1], reverse=True)
+
+    def general_stats(self, month: Optional[str] = None) -> Dict:
+        """Общая статистика (текущий месяц, итоги, число категорий и способов оплаты)"""
+        month = month or datetime.now().strftime("%Y-%m")
+        with self._lock:
+            return {
+                'current_month': month,
+                'monthly_total': self.month_totals.get(month, 0.0),
+                'total_expenses': self.total,
+                'categories': len(self.category_counts),
+                'payment_methods': len(self.method_counts),
+                'count': self.count
+            }
+
+
+# Создаем глобальный экземпляр хранилища
+expense_store = LazyInstance(ExpenseStore)
@@ -0,0 +1,233 @@
+"""
+Пакетная проверка лимитов и рекомендаций для всех пользователей
+"""
+
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+from database import DatabaseManager, LazyInstance, db_manager
+from metrics import metrics
+from notifications import AnalysisSnapshot, NotificationManager
+
+logger = logging.getLogger(__name__)
+
+
+# Менеджер уведомлений процесса пула (executor='process'), см. _init_worker
+_worker_manager: Optional[NotificationManager] = None
+
+
+def _init_worker(db_name: str, as_of: date):
+    """Инициализация процесса пула: менеджер и модели прогноза на БД проверки.
+
+    Процесс заново импортирует модули; глобальные экземпляры создаются
+    лениво, поэтому ./expenses.db не открывается. Модели, обновленные
+    родителем на as_of, только читаются (без журнала и записи в БД).
+    """
+    global _worker_manager
+    _worker_manager = NotificationManager(DatabaseManager(db_name))
+    _worker_manager.forecast_engine.load(as_of)
+
+
+def _evaluate_shard(shard: List[Tuple], now: datetime,
+                    manager: Optional[NotificationManager] = None) -> List[Tuple[int, str, str]]:
+    """Прогноз и рекомендации для группы пользователей по готовым агрегатам.
+
+    Прогноз читает только модели, дообученные перед запуском пула.
+    """
+    manager = manager or _worker_manager
+    results = []
+    for user_id, rows in shard:
+        snapshot = AnalysisSnapshot(None, user_id, now, rows)
+        for message in manager.get_budget_recommendations(user_id, snapshot=snapshot):
+            results.append((user_id, 'recommendation', message))
+    return results
+
+
+class NotificationSweep:
+    """Проверка всех пользователей: один запрос, пул исполнителей, запись в outbox.
+
+    Лимиты всех пользователей проверяются одним запросом правил
+    (AlertRuleEngine.evaluate). Агрегаты (пользователь, категория, день)
+    за месяц для рекомендаций загружаются одним запросом, модели прогноза
+    дообучаются один раз, пользователи делятся на группы по shard_size, и
+    прогноз с рекомендациями считаются параллельно в пуле потоков или
+    процессов, а результаты пишутся в таблицу notifications_outbox одной
+    транзакцией.
+    """
+
+    def __init__(self, db=None, workers: int = 4, executor: str = 'thread',
+                 shard_size: int = 200):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Неподдерживаемый тип исполнителя: {executor}")
+        self.db_manager = db or db_manager
+        self.notification_manager = NotificationManager(db)
+        self.forecast_engine = self.notification_manager.forecast_engine
+        self.workers = workers
+        self.executor = executor
+        self.shard_size = shard_size
+        self.last_metrics: Dict = {}
+        self._ensure_tables()
+
+    def _ensure_tables(self):
+        """Создание таблицы исходящих уведомлений"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS notifications_outbox (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        sweep_id TEXT NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        kind TEXT NOT NULL,
+                        message TEXT NOT NULL,
+                        delivered INTEGER DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                    )
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_outbox_pending
+                    ON notifications_outbox(delivered, user_id)
+                ''')
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка создания таблицы outbox: {e}")
+            raise
+
+    def _fetch_aggregates(self, now: datetime) -> Dict[int, List[Tuple]]:
+        """Агрегаты текущего месяца для всех пользователей одним запросом"""
+        period = now.strftime("%Y-%m")
+        with self.db_manager.connect_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT e.user_id, c.name, DATE(e.date), SUM(e.amount), COUNT(*)
+                FROM expenses e
+                JOIN categories c ON e.category_id = c.id
+                JOIN payment_methods pm ON e.payment_method_id = pm.id
+                WHERE DATE(e.date) >= ? AND DATE(e.date) <= ?
+                GROUP BY 1, 2, 3
+            ''', (f"{period}-01", f"{period}-31"))
+            by_user = defaultdict(list)
+            for user_id, category, day, total, count in cursor.fetchall():
+                by_user[user_id].append((category, day, total, count))
+            return by_user
+
+    def run(self, custom_limits: Optional[Dict[str, float]] = None,
+            now: Optional[datetime] = None) -> Dict:
+        """Проверка всех пользователей; возвращает метрики прогона"""
+        now = now or datetime.now()
+        sweep_id = now.strftime("%Y%m%d%H%M%S%f")
+        started = time.perf_counter()
+
+        try:
+            by_user = self._fetch_aggregates(now)
+            engine = self.notification_manager.alert_rule_engine
+            rules = engine.load_rules(self.notification_manager.limit_config(custom_limits))
+            alerts = engine.evaluate(rules, as_of=now)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка загрузки агрегатов для проверки: {e}")
+            raise
+        fetched = time.perf_counter()
+
+        # Модели дообучаются один раз; прогноз по пользователям считается в пуле
+        self.forecast_engine.update(now.date())
+        work = list(by_user.items())
+        shards = [work[i:i + self.shard_size] for i in range(0, len(work), self.shard_size)]
+        prepared = time.perf_counter()
+
+        results = [(alert['user_id'], 'warning', alert['message']) for alert in alerts]
+        if shards:
+            if self.executor == 'thread':
+                pool = ThreadPoolExecutor(max_workers=self.workers)
+                manager = self.notification_manager
+            else:
+                pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                           initargs=(self.db_manager.db_name, now.date()))
+                manager = None
+            with pool:
+                futures = [pool.submit(_evaluate_shard, shard, now, manager) for shard in shards]
+                for future in futures:
+                    results.extend(future.result())
+        evaluated = time.perf_counter()
+
+        try:
+            with self.db_manager.connect_db() as conn:
+                conn.executemany('''
+                    INSERT INTO notifications_outbox (sweep_id, user_id, kind, message, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', [(sweep_id, user_id, kind, message, now.strftime("%Y-%m-%d %H:%M:%S"))
+                      for user_id, kind, message in results])
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи уведомлений в outbox: {e}")
+            raise
+        finished = time.perf_counter()
+
+        total_seconds = finished - started
+        for phase, seconds in (('query', fetched - started), ('prepare', prepared - fetched),
+                               ('evaluate', evaluated - prepared), ('write', finished - evaluated)):
+            metrics.observe(f"sweep.{phase}", seconds)
+        self.last_metrics = {
+            'sweep_id': sweep_id,
+            'users': len(work),
+            'shards': len(shards),
+            'messages': len(results),
+            'query_seconds': fetched - started,
+            'prepare_seconds': prepared - fetched,
+            'evaluate_seconds': evaluated - prepared,
+            'write_seconds': finished - evaluated,
+            'total_seconds': total_seconds,
+            'users_per_second': len(work) / total_seconds if total_seconds > 0 else 0.0
+        }
+        logger.info(f"Проверка пользователей: {len(work)} за {total_seconds:.3f} с, "
+                    f"уведомлений: {len(results)}")
+        return self.last_metrics
+
+    def get_outbox(self, user_id: Optional[int] = None, pending_only: bool = True,
+                   limit: int = 100) -> List[Dict]:
+        """Уведомления из outbox"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                query = 'SELECT id, sweep_id, user_id, kind, message, delivered, created_at FROM notifications_outbox'
+                conditions = []
+                params = []
+
+                if pending_only:
+                    conditions.append("delivered = 0")
+
+                if user_id:
+                    conditions.append("user_id = ?")
+                    params.append(user_id)
+
+                if conditions:
+                    query += " WHERE " + " AND ".join(conditions)
+
+                query += " ORDER BY id LIMIT ?"
+                params.append(limit)
+                cursor.execute(query, params)
+                return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения outbox: {e}")
+            raise
+
+    def mark_delivered(self, notification_ids: List[int]) -> int:
+        """Отметка уведомлений как доставленных"""
+        try:
+            with self.db_manager.connect_db() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('UPDATE notifications_outbox SET delivered = 1 WHERE id = ?',
+                                   [(notification_id,) for notification_id in notification_ids])
+                conn.commit()
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка отметки доставки уведомлений: {e}")
+            raise
+
+
+# Создаем глобальный экземпляр пакетной проверки
+notification_sweep = LazyInstance(NotificationSweep)
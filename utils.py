@@ -4,9 +4,12 @@
 
 import os
 import shutil
+from array import array
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable
 import logging
+from config import VALIDATION_CONFIG
+from dates import PERIODS, bucket, bucket_label, epoch_day, format_timestamp, sql_period_key
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +21,8 @@ def format_date(date_str: str, input_format: str = "%Y-%m-%d %H:%M:%S",
                 output_format: str = "%d.%m.%Y %H:%M") -> str:
     """Форматирование даты"""
     try:
+        if input_format == "%Y-%m-%d %H:%M:%S" and output_format == "%d.%m.%Y %H:%M":
+            return format_timestamp(date_str)
         date_obj = datetime.strptime(date_str, input_format)
         return date_obj.strftime(output_format)
     except ValueError as e:
@@ -99,13 +104,15 @@ def cleanup_old_backups(backup_dir: str = "backups", max_files: int = 10):
         logger.error(f"Ошибка очистки старых бэкапов: {e}")
 
 def validate_amount(amount: str) -> tuple[bool, float, str]:
-    """Валидация суммы"""
+    """Валидация суммы (границы из VALIDATION_CONFIG)"""
     try:
         value = float(amount)
         if value <= 0:
             return False, 0.0, "Сумма должна быть положительной"
-        if value > 1000000:
-            return False, 0.0, "Сумма слишком большая (максимум 1,000,000)"
+        if value < VALIDATION_CONFIG['min_amount']:
+            return False, 0.0, f"Сумма слишком маленькая (минимум {VALIDATION_CONFIG['min_amount']})"
+        if value > VALIDATION_CONFIG['max_amount']:
+            return False, 0.0, f"Сумма слишком большая (максимум {VALIDATION_CONFIG['max_amount']:,.0f})"
         return True, value, ""
     except ValueError:
         return False, 0.0, "Некорректный формат суммы"
@@ -114,10 +121,22 @@ def validate_category(category: str) -> tuple[bool, str]:
     """Валидация категории"""
     if not category or not category.strip():
         return False, "Категория не может быть пустой"
-    if len(category) > 100:
-        return False, "Название категории слишком длинное (максимум 100 символов)"
+    if len(category) > VALIDATION_CONFIG['max_category_length']:
+        return False, (f"Название категории слишком длинное "
+                       f"(максимум {VALIDATION_CONFIG['max_category_length']} символов)")
     return True, ""
 
+def validate_date(date_text: str) -> tuple[bool, str, str]:
+    """Валидация даты расхода (ГГГГ-ММ-ДД или ГГГГ-ММ-ДД ЧЧ:ММ:СС); дата
+    возвращается в каноническом виде, чтобы сравнение строк в SQL было верным"""
+    text = (date_text or '').strip()
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return True, datetime.strptime(text, fmt).strftime(fmt), ""
+        except ValueError:
+            continue
+    return False, "", "Некорректная дата (ожидается ГГГГ-ММ-ДД или ГГГГ-ММ-ДД ЧЧ:ММ:СС)"
+
 def validate_payment_method(method: str) -> tuple[bool, str]:
     """Валидация способа оплаты"""
     if not method or not method.strip():
@@ -189,8 +208,11 @@ def calculate_trend(current: float, previous: float) -> Dict[str, Any]:
     }
 
 def group_by_period(data: List[tuple], period: str = "day") -> Dict[str, List[tuple]]:
-    """Группировка данных по периоду"""
+    """Группировка данных по периоду (копирует строки; для больших объемов —
+    aggregate_by_period или period_ranges)"""
     grouped = {}
+    if period not in PERIODS:
+        period = "day"
     
     for item in data:
         if len(item) < 1:
@@ -198,19 +220,8 @@ def group_by_period(data: List[tuple], period: str = "day") -> Dict[str, List[tu
             
         date_str = item[0]  # Предполагаем, что дата в первом элементе
         try:
-            date_obj = datetime.strptime(date_str.split(' ')[0], "%Y-%m-%d")
-            
-            if period == "day":
-                key = date_obj.strftime("%Y-%m-%d")
-            elif period == "week":
-                week_start = date_obj - timedelta(days=date_obj.weekday())
-                key = week_start.strftime("%Y-%m-%d")
-            elif period == "month":
-                key = date_obj.strftime("%Y-%m")
-            elif period == "year":
-                key = date_obj.strftime("%Y")
-            else:
-                key = date_obj.strftime("%Y-%m-%d")
+            # Номер дня кэшируется по строке, ключ периода считается арифметически
+            key = bucket_label(bucket(epoch_day(date_str), period), period)
             
             if key not in grouped:
                 grouped[key] = []
@@ -221,8 +232,91 @@ def group_by_period(data: List[tuple], period: str = "day") -> Dict[str, List[tu
     
     return grouped
 
-def export_to_csv(data: List[tuple], headers: List[str], filename: str) -> bool:
-    """Экспорт данных в CSV файл"""
+def aggregate_by_period(source, period: str = "day",
+                        user_id: int = None, start_date: str = None,
+                        end_date: str = None, category_id: int = None) -> Dict[str, Dict[str, float]]:
+    """Суммы и количества по периодам без копирования строк.
+    
+    source — менеджер БД (группировка выполняется в SQLite одним запросом)
+    или колоночный пакет {'date': [...], 'amount': [...]} в памяти
+    (ключи периодов считаются арифметически в массивах). Возвращает
+    {метка периода: {'total': сумма, 'count': количество}} по возрастанию меток.
+    """
+    if period not in PERIODS:
+        period = "day"
+    
+    if hasattr(source, 'connect_db'):
+        return _aggregate_by_period_sql(source, period, user_id, start_date, end_date, category_id)
+    return _aggregate_by_period_columns(source['date'], source['amount'], period)
+
+def _aggregate_by_period_sql(db, period: str, user_id, start_date, end_date,
+                             category_id) -> Dict[str, Dict[str, float]]:
+    query = f"SELECT {sql_period_key('date', period)} AS bucket, SUM(amount), COUNT(*) FROM expenses"
+    conditions, params = db.build_expense_filters(user_id, start_date, end_date, category_id)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " GROUP BY bucket ORDER BY bucket"
+    
+    with db.connect_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        result = {label: {'total': total, 'count': count} for label, total, count in cursor.fetchall()}
+    
+    # Архивные расходы, если период доходит до границы архива
+    archived = db.archive.aggregate([period], user_id, start_date, end_date, category_id)
+    if not archived:
+        return result
+    for (label,), (total, count) in archived.items():
+        cell = result.setdefault(label, {'total': 0.0, 'count': 0})
+        cell['total'] += total
+        cell['count'] += count
+    return dict(sorted(result.items()))
+
+def _aggregate_by_period_columns(dates: List[str], amounts, period: str) -> Dict[str, Dict[str, float]]:
+    if not dates:
+        return {}
+    keys = period_keys(dates, period)
+    first = min(keys)
+    size = max(keys) - first + 1
+    totals = array('d', bytes(8 * size))
+    counts = array('q', bytes(8 * size))
+    for key, amount in zip(keys, amounts):
+        totals[key - first] += amount
+        counts[key - first] += 1
+    
+    return {
+        bucket_label(first + offset, period): {'total': totals[offset], 'count': counts[offset]}
+        for offset in range(size) if counts[offset]
+    }
+
+def period_keys(dates: Iterable[str], period: str = "day") -> array:
+    """Целочисленные ключи периодов для колонки дат (см. dates.bucket)"""
+    return array('q', (bucket(epoch_day(value), period) for value in dates))
+
+def period_ranges(dates: List[str], period: str = "day") -> List[tuple]:
+    """Диапазоны индексов [start, stop) для каждого периода в упорядоченной по дате колонке.
+    
+    Вместо копий строк возвращает (метка, start, stop); строки периода —
+    это data[start:stop] исходного пакета.
+    """
+    if period not in PERIODS:
+        period = "day"
+    
+    keys = period_keys(dates, period)
+    ranges = []
+    seen = set()
+    start = 0
+    for index in range(1, len(keys) + 1):
+        if index == len(keys) or keys[index] != keys[start]:
+            if keys[start] in seen:
+                raise ValueError("Данные должны быть упорядочены по дате")
+            seen.add(keys[start])
+            ranges.append((bucket_label(keys[start], period), start, index))
+            start = index
+    return ranges
+
+def export_to_csv(data: Iterable[tuple], headers: List[str], filename: str) -> bool:
+    """Экспорт данных в CSV файл (data может быть генератором; для расходов из БД см. export.py)"""
     try:
         import csv
         